@@ -249,6 +249,91 @@ def __fetch_fs_size(target, source, env):
     return (target, source)
 
 
+#
+# Core dump helpers
+#
+
+
+def _read_coredump_partition(env):
+    partition = None
+    for p in _parse_partitions(env):
+        if p["type"] == "data" and p["subtype"] == "coredump":
+            partition = p
+    if not partition:
+        sys.stderr.write(
+            "Could not find the coredump section in the partitions table %s\n"
+            % env.subst("$PARTITIONS_TABLE_CSV")
+        )
+        env.Exit(1)
+        return None
+    offset = _parse_size(partition["offset"])
+    size = _parse_size(partition["size"])
+
+    # a flash image saved earlier (e.g. from a field unit) can be used instead
+    # of reading the partition from the connected board
+    image_path = env.GetProjectOption("custom_coredump_image", "")
+    if image_path:
+        image_path = join(env.subst("$PROJECT_DIR"), image_path)
+        with open(image_path, "rb") as fp:
+            fp.seek(offset)
+            return fp.read(size)
+
+    BeforeUpload(None, None, env)
+    dump_path = join(env.subst("$BUILD_DIR"), "coredump_partition.bin")
+    if env.Execute(
+        env.VerboseAction(
+            '"$PYTHONEXE" "$OBJCOPY" $ERASEFLAGS --baud $UPLOAD_SPEED '
+            'read_flash %d %d "%s"' % (offset, size, dump_path),
+            "Reading coredump partition at 0x%x" % offset,
+        )
+    ):
+        env.Exit(1)
+        return None
+    with open(dump_path, "rb") as fp:
+        return fp.read()
+
+
+def __decode_coredump(target, source, env):
+    # the decoder is shared with the monitor filters
+    sys.path.append(join(platform.get_dir(), "monitor"))
+    import esp_coredump
+    import symbol_index
+    from filter_exception_decoder import Addr2LineProcess
+
+    data = _read_coredump_partition(env)
+    if data is None:
+        return 1
+    try:
+        core = esp_coredump.CoreDump(esp_coredump.read_partition_dump(data))
+    except esp_coredump.CoreDumpError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+
+    firmware_path = str(source[0])
+    symbols = None
+    # without pyelftools the symbols come from addr2line, as in the monitor
+    if symbol_index.is_available():
+        try:
+            symbols = symbol_index.SymbolIndex.load(
+                firmware_path, env.WhereIs("%s-elf-c++filt" % toolchain_arch))
+        except symbol_index.INDEX_ERRORS as e:
+            sys.stderr.write(
+                "Warning! Failed to index %s, using addr2line: %s\n"
+                % (firmware_path, e))
+    if symbols is not None:
+        resolve = symbols.resolve
+        is_code_address = symbols.is_code_address
+    else:
+        addr2line = Addr2LineProcess(
+            env.WhereIs("%s-elf-addr2line" % toolchain_arch)
+            or "%s-elf-addr2line" % toolchain_arch,
+            firmware_path)
+        resolve = addr2line.resolve
+        is_code_address = esp_coredump.is_code_region
+
+    print(esp_coredump.format_report(core, resolve, is_code_address))
+
+
 board = env.BoardConfig()
 mcu = board.get("build.mcu", "esp32")
 toolchain_arch = "xtensa-%s" % mcu
@@ -589,6 +674,19 @@ env.AddPlatformTarget(
     "Erase Flash",
 )
 
+#
+# Target: Read and decode core dump
+#
+
+env.AddPlatformTarget(
+    "coredump",
+    target_elf,
+    env.VerboseAction(__decode_coredump, "Decoding core dump of $SOURCE"),
+    "Read Core Dump",
+    "Decode the core dump stored in the coredump partition (or in the flash "
+    "image set with `custom_coredump_image`)",
+)
+
 #
 # Override memory inspection behavior
 #
@@ -47,6 +47,22 @@ def BeforeUpload(target, source, env):  # pylint: disable=W0613,W0621
         env.Replace(UPLOAD_PORT=basename(env.subst("$UPLOAD_PORT")))
 
 
+def _merge_hex(target, source, env):  # pylint: disable=W0621
+    # same result as `srec_cat $SOFTDEVICEHEX $SOURCES`, without the tool
+    sys.path.append(join(platform.get_dir(), "scripts"))
+    from hex_image import HexImage, HexImageError
+
+    try:
+        image = HexImage.from_hex_file(env.subst("$SOFTDEVICEHEX"))
+        for node in source:
+            image.merge(HexImage.from_hex_file(str(node)))
+        image.write_hex(str(target[0]))
+    except (OSError, HexImageError) as e:
+        sys.stderr.write("Error: could not merge %s: %s\n" % (target[0], e))
+        return 1
+    return None
+
+
 env = DefaultEnvironment()
 platform = env.PioPlatform()
 board = env.BoardConfig()
@@ -104,18 +120,7 @@ env.Append(
             suffix=".hex"
         ),
         MergeHex=Builder(
-            action=env.VerboseAction(" ".join([
-                '"%s"' % join(platform.get_package_dir("tool-sreccat") or "",
-                    "srec_cat"),
-                "$SOFTDEVICEHEX",
-                "-intel",
-                "$SOURCES",
-                "-intel",
-                "-o",
-                "$TARGET",
-                "-intel",
-                "--line-length=44"
-            ]), "Building $TARGET"),
+            action=env.VerboseAction(_merge_hex, "Building $TARGET"),
             suffix=".hex"
         )
     )
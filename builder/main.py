@@ -13,31 +13,23 @@
 # limitations under the License.
 
 
+import sys
+
 from SCons.Script import DefaultEnvironment
 
 
 env = DefaultEnvironment()
-board = env.BoardConfig()
-if "esp32" in board.id:
-    print("board id is seeed-xiao-esp32,will call board_build/esp/esp_build.py")
-    env.SConscript("board_build/esp/esp_build.py", exports="env")
-
-if board.id == "seeed-xiao-ra4m1":
-    print("board id is seeed-xiao-ra4m1,will call board_build/renesas/renesas_build.py")
-    env.SConscript("board_build/renesas/renesas_build.py", exports="env")
+platform = env.PioPlatform()
+sys.path.append(platform.get_dir())
 
-if board.id == "seeed-xiao-rp2040" or board.id == "seeed-xiao-rp2350":
-    print("board id is seeed-xiao-rpi,will call board_build/rpi/rpi_build.py")
-    env.SConscript("board_build/rpi/rpi_build.py", exports="env")
+from platform_cfg import profiling, registry  # noqa: E402
 
-if "nrf" in board.id:
-    print("board id is nrf,will call board_build/nrf/nrf_build.py")
-    env.SConscript("board_build/nrf/nrf_build.py", exports="env")
+if profiling.enabled():
+    profiling.install_build_hooks(env)
 
-if "samd" in board.id:
-    print("board id is samd,will call board_build/samd/samd_build.py")
-    env.SConscript("board_build/samd/samd_build.py", exports="env")
-
-if "mg24" in board.id:
-    print("board id is mg24,will call board_build/siliconlab/siliconlab_build.py")
-    env.SConscript("board_build/siliconlab/siliconlab_build.py", exports="env")
+board = env.BoardConfig()
+with profiling.span("resolve architecture of %s" % board.id, "dispatch"):
+    arch = registry.resolve(board.id, board.get("architecture", ""))
+if arch:
+    print("board id is %s,will call %s" % (board.id, arch.builder_script))
+    env.SConscript(arch.builder_script, exports="env")
@@ -0,0 +1,306 @@
+"""
+@file audio_stages.py
+@brief Block-wise NumPy analysis of recorded audio for microphone QA.
+@details The recorder hands every chunk of PCM to a StagePipeline, which views it
+         as int16 samples without copying and runs a chain of vectorized stages
+         on fixed-size blocks: gain, DC removal, level and clipping, spectrum
+         bands. A ThresholdStage turns the results into a pass/fail verdict, and
+         the summary of all stages is saved as JSON next to the WAV file.
+         The stages only see an analysis copy; the WAV file keeps the raw samples.
+"""
+
+import json
+import math
+
+import numpy as np
+
+FULL_SCALE = 32768.0            # int16 full scale
+CLIP_LEVEL = 32767              # Samples at or beyond this magnitude count as clipped
+BLOCK_DURATION_S = 0.1          # Analysis block length (seconds)
+DEFAULT_BANDS_HZ = (63, 125, 250, 500, 1000, 2000, 4000, 8000)  # Octave band centers
+SILENCE_DBFS = -150.0           # Level reported for digital silence
+
+def to_dbfs(value):
+    """
+    @brief Amplitude relative to full scale in dB.
+    """
+    return 20 * math.log10(value) if value > 0 else SILENCE_DBFS
+
+class Stage:
+    """
+    @brief One step of the analysis chain.
+    """
+
+    name = "stage"
+
+    def process(self, block, raw):
+        """
+        @brief Process one block.
+        @param block float32 samples scaled to [-1, 1), as left by the previous stage.
+        @param raw int16 view of the received samples of this block.
+        @return The block passed to the next stage.
+        """
+        return block
+
+    def summary(self):
+        """
+        @brief Results of the stage, JSON serializable.
+        """
+        return {}
+
+class GainStage(Stage):
+    """
+    @brief Applies a fixed gain, e.g. to compensate the microphone sensitivity.
+    """
+
+    name = "gain"
+
+    def __init__(self, gain_db=0.0):
+        self.gain_db = gain_db
+        self.factor = np.float32(10 ** (gain_db / 20))
+
+    def process(self, block, raw):
+        block *= self.factor
+        return block
+
+    def summary(self):
+        return {"gain_db": self.gain_db}
+
+class DcRemovalStage(Stage):
+    """
+    @brief Removes the mean of every block and reports the DC offset.
+    """
+
+    name = "dc"
+
+    def __init__(self):
+        self.total = 0.0
+        self.blocks = 0
+        self.max_offset = 0.0
+
+    def process(self, block, raw):
+        mean = float(block.mean())
+        block -= mean
+        self.total += mean
+        self.blocks += 1
+        self.max_offset = max(self.max_offset, abs(mean))
+        return block
+
+    def summary(self):
+        return {
+            "offset": self.total / self.blocks if self.blocks else 0.0,
+            "max_block_offset": self.max_offset,
+        }
+
+class LevelStage(Stage):
+    """
+    @brief RMS and peak level, clipping and the level spread.
+    @details Clipping is counted on the raw samples. The level spread compares the
+             loud blocks (90th percentile RMS) to the quiet ones (10th percentile RMS).
+             It approximates the SNR only for takes with pauses; a steady test tone
+             gives about 0 dB.
+    """
+
+    name = "level"
+
+    def __init__(self):
+        self.samples = 0
+        self.sum_squares = 0.0
+        self.peak = 0.0
+        self.clipped = 0
+        self.block_rms = []
+
+    def process(self, block, raw):
+        squares = float(np.dot(block, block))
+        self.samples += len(block)
+        self.sum_squares += squares
+        self.peak = max(self.peak, float(np.abs(block).max()))
+        self.clipped += int(np.count_nonzero((raw >= CLIP_LEVEL) | (raw <= -CLIP_LEVEL)))
+        self.block_rms.append(math.sqrt(squares / len(block)))
+        return block
+
+    def summary(self):
+        if not self.samples:
+            return {}
+        rms = np.array(self.block_rms)
+        noise = float(np.percentile(rms, 10))
+        signal = float(np.percentile(rms, 90))
+        return {
+            "rms_dbfs": to_dbfs(math.sqrt(self.sum_squares / self.samples)),
+            "peak_dbfs": to_dbfs(self.peak),
+            "clipped_samples": self.clipped,
+            "clipped_ratio": self.clipped / self.samples,
+            "noise_floor_dbfs": to_dbfs(noise),
+            "level_spread_db": to_dbfs(signal) - to_dbfs(noise),
+        }
+
+class SpectrumStage(Stage):
+    """
+    @brief Average power in octave bands, from a Hann-windowed FFT of every block.
+    """
+
+    name = "spectrum"
+
+    def __init__(self, sample_rate, block_size, bands_hz=DEFAULT_BANDS_HZ):
+        self.window = np.hanning(block_size).astype(np.float32)
+        # one-sided power per bin, the bins of a band add up to its mean square
+        self.scale = 2.0 / (block_size * float(np.dot(self.window, self.window)))
+        freqs = np.fft.rfftfreq(block_size, 1.0 / sample_rate)
+        self.bands = [b for b in bands_hz if b * math.sqrt(2) <= sample_rate / 2]
+        # bin -> band index, bins outside all bands go to an extra slot
+        self.band_of_bin = np.full(len(freqs), len(self.bands))
+        for i, center in enumerate(self.bands):
+            self.band_of_bin[(freqs >= center / math.sqrt(2)) & (freqs < center * math.sqrt(2))] = i
+        self.power = np.zeros(len(self.bands) + 1)
+        self.blocks = 0
+
+    def process(self, block, raw):
+        if len(block) != len(self.window):
+            return block
+        spectrum = np.fft.rfft(block * self.window)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2) * self.scale
+        self.power += np.bincount(self.band_of_bin, power, len(self.power))
+        self.blocks += 1
+        return block
+
+    def summary(self):
+        if not self.blocks:
+            return {}
+        levels = self.power[:-1] / self.blocks
+        return {
+            "bands_dbfs": {
+                str(center): to_dbfs(math.sqrt(level)) for center, level in zip(self.bands, levels)
+            }
+        }
+
+class ThresholdStage(Stage):
+    """
+    @brief Pass/fail limits on the results of the other stages.
+    @details Limits are given as (stage, key, "min" or "max", value) tuples.
+    """
+
+    name = "thresholds"
+
+    def __init__(self, stages, limits):
+        self.stages = stages
+        self.limits = limits
+
+    def summary(self):
+        results = {stage.name: stage.summary() for stage in self.stages if stage is not self}
+        checks = []
+        for stage, key, kind, limit in self.limits:
+            value = results.get(stage, {}).get(key)
+            if value is not None and stage == "dc":
+                value = abs(value)
+            ok = value is not None and (value >= limit if kind == "min" else value <= limit)
+            checks.append({"check": f"{stage}.{key} {kind} {limit}", "value": value, "pass": ok})
+        return {"pass": all(c["pass"] for c in checks), "checks": checks}
+
+class StagePipeline:
+    """
+    @brief Cuts received PCM into blocks and runs the stages on every block.
+    @details Chunks are viewed with np.frombuffer; only samples that complete a
+             block begun by the previous chunk are copied.
+    """
+
+    def __init__(self, stages, sample_rate, block_size=None):
+        self.stages = stages
+        self.sample_rate = sample_rate
+        self.block_size = block_size or int(sample_rate * BLOCK_DURATION_S)
+        self.partial = np.empty(self.block_size, dtype=np.int16)
+        self.partial_len = 0
+        self.odd_byte = b""
+        self.samples = 0
+
+    def _run(self, raw):
+        block = raw.astype(np.float32)
+        block *= np.float32(1 / FULL_SCALE)
+        for stage in self.stages:
+            block = stage.process(block, raw)
+
+    def feed(self, data):
+        """
+        @brief Analyze the next chunk of 16-bit little-endian mono PCM.
+        @param data Bytes as written to the WAV file.
+        """
+        if self.odd_byte:
+            data = self.odd_byte + bytes(data)
+            self.odd_byte = b""
+        if len(data) % 2:
+            self.odd_byte = bytes(data[-1:])
+            data = data[:-1]
+        samples = np.frombuffer(data, dtype="<i2")
+        self.samples += len(samples)
+        pos = 0
+        if self.partial_len:
+            take = min(self.block_size - self.partial_len, len(samples))
+            self.partial[self.partial_len:self.partial_len + take] = samples[:take]
+            self.partial_len += take
+            pos = take
+            if self.partial_len < self.block_size:
+                return
+            self._run(self.partial)
+            self.partial_len = 0
+        full = pos + (len(samples) - pos) // self.block_size * self.block_size
+        for start in range(pos, full, self.block_size):
+            self._run(samples[start:start + self.block_size])
+        rest = len(samples) - full
+        self.partial[:rest] = samples[full:]
+        self.partial_len = rest
+
+    def finish(self):
+        """
+        @brief Analyze the last, incomplete block.
+        """
+        if self.partial_len:
+            self._run(self.partial[:self.partial_len])
+            self.partial_len = 0
+
+    def summary(self):
+        result = {
+            "sample_rate": self.sample_rate,
+            "samples": self.samples,
+            "duration_s": self.samples / self.sample_rate,
+        }
+        for stage in self.stages:
+            result[stage.name] = stage.summary()
+        return result
+
+    def save_summary(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.summary(), fp, indent=2)
+
+class AnalyzingWriter:
+    """
+    @brief Wave writer proxy that feeds everything written to a StagePipeline.
+    """
+
+    def __init__(self, wav_file, pipeline):
+        self.wav_file = wav_file
+        self.pipeline = pipeline
+
+    def writeframesraw(self, data):
+        self.wav_file.writeframesraw(data)
+        self.pipeline.feed(data)
+
+    def writeframes(self, data):
+        self.wav_file.writeframes(data)
+        self.pipeline.feed(data)
+
+def default_pipeline(sample_rate, gain_db=0.0, limits=()):
+    """
+    @brief Gain, DC removal, level, spectrum and, if limits are given, thresholds.
+    @param sample_rate Sample rate in Hz.
+    @param gain_db Gain applied before the measurements.
+    @param limits Pass/fail limits, see ThresholdStage.
+    """
+    block_size = int(sample_rate * BLOCK_DURATION_S)
+    stages = [
+        DcRemovalStage(),
+        GainStage(gain_db),
+        LevelStage(),
+        SpectrumStage(sample_rate, block_size),
+    ]
+    if limits:
+        stages.append(ThresholdStage(stages, limits))
+    return StagePipeline(stages, sample_rate, block_size)
@@ -6,14 +6,28 @@ usage:
         python record.py -p COM3 -o output.wav -b 921600
     On Linux:
         python record.py -p /dev/ttyACM0 -o output.wav -b 921600
+    Streaming (until the END packet, --duration or Ctrl-C):
+        python record.py -p /dev/ttyACM0 -o long_take.wav --stream
+    Framed transport with CRC and resync (see README.md):
+        python record.py -p /dev/ttyACM0 -o long_take.wav --framed
+    Microphone QA (needs NumPy, writes output.json next to output.wav):
+        python record.py -p /dev/ttyACM0 -o output.wav --min-rms-dbfs -40 --max-clipped 0
 """
 
 import argparse
+import os
+import struct
 import sys
 import time
 import wave
+import zlib
 import serial
 
+try:
+    import audio_stages
+except ImportError:  # NumPy is only needed for --analyze
+    audio_stages = None
+
 SAMPLE_RATE = 16000              # Audio sample rate (Hz)
 SAMPLE_WIDTH_BYTES = 2           # Sample width in bytes (16-bit PCM)
 CHANNELS = 1                     # Number of audio channels
@@ -23,38 +37,347 @@ PACKET_START = bytes([0xAA, 0x55, ord('S'), ord('T'), ord('A'), ord('R'), ord('T
 PACKET_END = bytes([0xAA, 0x55, ord('E'), ord('N'), ord('D')])                       # End packet marker
 SYNC_TIMEOUT_S = 20             # Timeout for waiting start signal (seconds)
 
+FRAME_SIZE = SAMPLE_WIDTH_BYTES * CHANNELS       # Bytes per audio frame
+BYTES_PER_SECOND = SAMPLE_RATE * FRAME_SIZE      # Audio data rate of the device
+STATS_INTERVAL_S = 1.0          # Interval of the live statistics in streaming mode (seconds)
+
+FRAME_MAGIC = bytes([0xAA, 0x55, ord('F'), ord('R')])   # Start of every audio frame in framed mode
+FRAME_HEADER = struct.Struct("<4sHH")                   # Magic, sequence number, payload length
+FRAME_CRC = struct.Struct("<I")                         # CRC-32 of sequence number, length and payload
+MAX_FRAME_PAYLOAD = 8192        # Larger lengths are treated as a corrupt header (bytes)
+FRAME_PAYLOAD = BYTES_PER_SECOND // 10  # Nominal payload, one 100 ms DMIC block (bytes)
+SEQUENCE_MODULO = 0x10000       # Sequence numbers wrap around at 16 bits
+MAX_REPORTED_GAPS = 20          # Gaps listed individually in the loss report
+
+class FrameDecoder:
+    """
+    @brief Extracts CRC-checked audio frames from the framed byte stream.
+    @details Corrupt or incomplete data is skipped byte by byte up to the next
+             frame magic whose frame passes the CRC check, so a lost or altered
+             byte costs one frame instead of shifting all following samples.
+             A header whose frame would reach past a received END packet is
+             corrupt too, the frames after it are recovered instead of waiting
+             for payload bytes that never come.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.end_received = False
+        self.crc_errors = 0
+        self.skipped_bytes = 0
+
+    def feed(self, data):
+        """
+        @brief Add received bytes and return the frames they complete.
+        @param data Bytes read from the serial port.
+        @return List of (sequence number, payload) tuples.
+        """
+        buf = self.buffer
+        buf += data
+        frames = []
+        pos = 0
+        while not self.end_received:
+            sync = buf.find(FRAME_MAGIC[:2], pos)
+            if sync == -1:
+                # a trailing first magic byte may be completed by the next read
+                sync = max(pos, len(buf) - 1) if buf.endswith(FRAME_MAGIC[:1]) else len(buf)
+                self.skipped_bytes += sync - pos
+                pos = sync
+                break
+            self.skipped_bytes += sync - pos
+            pos = sync
+            if buf.startswith(PACKET_END, pos):
+                self.end_received = True
+                break
+            if len(buf) - pos < FRAME_HEADER.size:
+                break
+            magic, sequence, length = FRAME_HEADER.unpack_from(buf, pos)
+            if magic != FRAME_MAGIC or length > MAX_FRAME_PAYLOAD or length % FRAME_SIZE:
+                self.skipped_bytes += 1
+                pos += 1
+                continue
+            frame_end = pos + FRAME_HEADER.size + length + FRAME_CRC.size
+            if len(buf) < frame_end:
+                if buf.find(PACKET_END, pos + FRAME_HEADER.size) == -1:
+                    break
+                # the device stopped sending before this frame was complete
+                self.skipped_bytes += 1
+                pos += 1
+                continue
+            crc = FRAME_CRC.unpack_from(buf, frame_end - FRAME_CRC.size)[0]
+            if zlib.crc32(buf[pos + len(FRAME_MAGIC):frame_end - FRAME_CRC.size]) != crc:
+                self.crc_errors += 1
+                self.skipped_bytes += 1
+                pos += 1
+                continue
+            frames.append((sequence, bytes(buf[pos + FRAME_HEADER.size:frame_end - FRAME_CRC.size])))
+            pos = frame_end
+        del buf[:pos]
+        return frames
+
+class StartPacketSearch:
+    """
+    @brief Finds the start packet in a stream of reads with constant memory.
+    @details Only the last bytes that may hold the beginning of the marker are kept
+             between reads, and the marker is searched anywhere in each read.
+    """
+
+    def __init__(self):
+        self.tail = b""
+
+    def feed(self, data):
+        """
+        @brief Search the next read for the start packet.
+        @param data Bytes read from the serial port.
+        @return Audio bytes received after the start packet, or None if it was not found yet.
+        """
+        data = self.tail + data
+        pos = data.find(PACKET_START)
+        if pos != -1:
+            return data[pos + len(PACKET_START):]
+        self.tail = data[-(len(PACKET_START) - 1):]
+        return None
+
 def find_start_packet(ser, timeout):
     """
     @brief Wait for the start packet from serial port within a timeout.
+    @details Each read blocks until data arrives (or the remaining timeout expires),
+             so the marker is seen as soon as it is received.
     @param ser Serial port object.
     @param timeout Timeout in seconds.
-    @return True if start packet is found, False otherwise.
-    """
-    start_time = time.time()
-    buffer = bytearray()
-    while time.time() - start_time < timeout:
-        if ser.in_waiting > 0:
-            chunk = ser.read(ser.in_waiting)
-            buffer.extend(chunk)
-            if buffer.endswith(PACKET_START):
-                return True
+    @return Audio bytes received after the start packet, or None on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    search = StartPacketSearch()
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        ser.timeout = remaining
+        initial = search.feed(ser.read(ser.in_waiting or 1))
+        if initial is not None:
+            return initial
+
+def print_stream_stats(received, elapsed, end="\r"):
+    """
+    @brief Print throughput and shortfall against the device data rate.
+    @param received Audio bytes received so far.
+    @param elapsed Seconds since the start packet.
+    @param end Line terminator, "\\r" to overwrite the live line.
+    """
+    rate = received / elapsed if elapsed > 0 else 0.0
+    shortfall = max(0, int(elapsed * BYTES_PER_SECOND) - received)
+    print(f"  {received / BYTES_PER_SECOND:8.1f} s audio | {received:>10} bytes | "
+          f"{rate / 1024:7.1f} KiB/s | shortfall {shortfall:>8} bytes", end=end, flush=True)
+
+class RawAudioSink:
+    """
+    @brief Writes raw PCM to a WAV file up to the END packet or a size limit.
+    @details The END packet may be split across reads, so the last bytes of every
+             read are held back until the next one shows whether they start the marker.
+    """
+
+    def __init__(self, wav_file, limit=None):
+        """
+        @param wav_file Open wave writer; its header is patched when it is closed.
+        @param limit Maximum number of audio bytes to write, None for no limit.
+        """
+        self.wav_file = wav_file
+        self.limit = limit
+        self.pending = b""
+        self.written = 0
+        self.end_received = False
+
+    @property
+    def done(self):
+        return self.end_received or (self.limit is not None and self.written >= self.limit)
+
+    def feed(self, data):
+        """
+        @brief Write the complete audio frames of the next read.
+        @param data Bytes read from the serial port.
+        @return Number of audio bytes written.
+        """
+        data = self.pending + data
+        end = data.find(PACKET_END)
+        if end != -1:
+            cut = end - end % FRAME_SIZE
+            self.end_received = True
         else:
-            time.sleep(0.01)
-    return False
+            # keep a possible marker prefix and any incomplete frame for the next read
+            cut = max(0, len(data) - (len(PACKET_END) - 1))
+            cut -= cut % FRAME_SIZE
+        if self.limit is not None:
+            cut = min(cut, self.limit - self.written)
+        if cut:
+            self.wav_file.writeframesraw(data[:cut])
+            self.written += cut
+        self.pending = data[cut:]
+        return cut
 
-def main(port, baudrate, output_file):
+def stream_audio(ser, wav_file, duration=None, initial=b""):
+    """
+    @brief Write audio frames to the WAV file as they arrive, with constant memory.
+    @details Stops on the END packet, after the duration or on Ctrl-C.
+    @param ser Serial port object, synchronized to the start packet.
+    @param wav_file Open wave writer; its header is patched when it is closed.
+    @param duration Maximum recording duration in seconds, None to record until the END packet.
+    @param initial Audio bytes already received together with the start packet.
+    @return Tuple of the number of audio bytes written and whether the END packet was received.
+    """
+    limit = None if duration is None else int(duration * SAMPLE_RATE) * FRAME_SIZE
+    sink = RawAudioSink(wav_file, limit)
+    ser.timeout = STATS_INTERVAL_S
+    start_time = time.monotonic()
+    next_stats = start_time + STATS_INTERVAL_S
+    chunk = initial
+    try:
+        while True:
+            sink.feed(chunk)
+            if sink.done:
+                break
+
+            now = time.monotonic()
+            if now >= next_stats:
+                print_stream_stats(sink.written, now - start_time)
+                next_stats = now + STATS_INTERVAL_S
+            chunk = ser.read(ser.in_waiting or 1)
+    except KeyboardInterrupt:
+        print("\nInterrupted, finishing the WAV file...")
+    print_stream_stats(sink.written, time.monotonic() - start_time, end="\n")
+    return sink.written, sink.end_received
+
+def stream_framed_audio(ser, wav_file, duration=None, initial=b""):
+    """
+    @brief Write the payload of framed audio to the WAV file as it arrives.
+    @details Frames missing from the sequence are replaced with silence of the
+             nominal frame length, so the samples after a gap keep their position
+             in time. Stops
+             on the END packet, after the duration or on Ctrl-C.
+    @param ser Serial port object, synchronized to the start packet.
+    @param wav_file Open wave writer; its header is patched when it is closed.
+    @param duration Maximum recording duration in seconds, None to record until the END packet.
+    @param initial Bytes already received together with the start packet.
+    @return Tuple of the number of audio bytes written, whether the END packet was received
+            and the loss report (a dict).
+    """
+    limit = None if duration is None else int(duration * SAMPLE_RATE) * FRAME_SIZE
+    decoder = FrameDecoder()
+    report = dict(frames=0, lost_frames=0, duplicate_frames=0, silence_bytes=0, gaps=[])
+    written = 0
+    expected = None
+
+    def write(data):
+        nonlocal written
+        if limit is not None:
+            data = data[:limit - written]
+        wav_file.writeframesraw(data)
+        written += len(data)
+
+    ser.timeout = STATS_INTERVAL_S
+    start_time = time.monotonic()
+    next_stats = start_time + STATS_INTERVAL_S
+    chunk = initial
+    try:
+        while limit is None or written < limit:
+            for sequence, payload in decoder.feed(chunk):
+                if expected is not None:
+                    missing = (sequence - expected) % SEQUENCE_MODULO
+                    if missing >= SEQUENCE_MODULO // 2:
+                        report["duplicate_frames"] += 1
+                        continue
+                    if missing:
+                        report["lost_frames"] += missing
+                        report["gaps"].append((written / BYTES_PER_SECOND, missing))
+                        silence = bytes(FRAME_PAYLOAD)
+                        for _ in range(missing):
+                            write(silence)
+                        report["silence_bytes"] += missing * FRAME_PAYLOAD
+                expected = (sequence + 1) % SEQUENCE_MODULO
+                report["frames"] += 1
+                write(payload)
+            if decoder.end_received:
+                break
+
+            now = time.monotonic()
+            if now >= next_stats:
+                print_stream_stats(written, now - start_time)
+                next_stats = now + STATS_INTERVAL_S
+            chunk = ser.read(ser.in_waiting or 1)
+    except KeyboardInterrupt:
+        print("\nInterrupted, finishing the WAV file...")
+    print_stream_stats(written, time.monotonic() - start_time, end="\n")
+    report["crc_errors"] = decoder.crc_errors
+    report["skipped_bytes"] = decoder.skipped_bytes
+    return written, decoder.end_received, report
+
+def print_loss_report(report):
+    """
+    @brief Print the loss statistics of a framed capture.
+    @param report Loss report returned by stream_framed_audio().
+    """
+    total = report["frames"] + report["lost_frames"]
+    loss = 100.0 * report["lost_frames"] / total if total else 0.0
+    print("--- Loss report ---")
+    print(f"  - Frames received: {report['frames']}, lost: {report['lost_frames']} ({loss:.2f}%)")
+    print(f"  - CRC errors: {report['crc_errors']}, skipped bytes: {report['skipped_bytes']}, "
+          f"duplicates: {report['duplicate_frames']}")
+    print(f"  - Silence inserted: {report['silence_bytes'] / BYTES_PER_SECOND:.3f} s")
+    for offset, missing in report["gaps"][:MAX_REPORTED_GAPS]:
+        print(f"    gap at {offset:10.3f} s: {missing} frame(s)")
+    if len(report["gaps"]) > MAX_REPORTED_GAPS:
+        print(f"    ... {len(report['gaps']) - MAX_REPORTED_GAPS} more gap(s)")
+
+def report_analysis(pipeline, output_file):
+    """
+    @brief Finish the analysis, save its JSON summary next to the WAV file and print it.
+    @param pipeline audio_stages.StagePipeline fed with the recorded audio.
+    @param output_file Output WAV file name.
+    @return False if a threshold check failed.
+    """
+    pipeline.finish()
+    summary_file = os.path.splitext(output_file)[0] + ".json"
+    pipeline.save_summary(summary_file)
+    summary = pipeline.summary()
+    level = summary.get("level", {})
+    print("--- Analysis ---")
+    if level:
+        print(f"  - RMS {level['rms_dbfs']:.1f} dBFS, peak {level['peak_dbfs']:.1f} dBFS, "
+              f"level spread {level['level_spread_db']:.1f} dB, DC offset {summary['dc']['offset']:+.5f}, "
+              f"clipped samples {level['clipped_samples']}")
+    thresholds = summary.get("thresholds")
+    if thresholds:
+        for check in thresholds["checks"]:
+            value = "n/a" if check["value"] is None else f"{check['value']:.5g}"
+            print(f"  - {'PASS' if check['pass'] else 'FAIL'}: {check['check']} (got {value})")
+    print(f"  - Summary saved to '{summary_file}'.")
+    return thresholds is None or thresholds["pass"]
+
+def main(port, baudrate, output_file, stream=False, duration=None, framed=False, pipeline=None):
     """
     @brief Connect to serial port, synchronize, receive audio data, and save as WAV file.
     @param port Serial port name.
     @param baudrate Serial baudrate.
     @param output_file Output WAV file name.
+    @param stream Write the WAV file while receiving instead of after a fixed-length read.
+    @param duration Recording duration in seconds; in streaming mode None records until the END packet.
+    @param framed Expect the framed transport (implies streaming).
+    @param pipeline audio_stages.StagePipeline to analyze the audio with, or None.
     """
-    total_bytes_to_read = SAMPLE_RATE * SAMPLE_WIDTH_BYTES * CHANNELS * RECORD_DURATION_S
+    stream = stream or framed
+    if not stream and duration is None:
+        duration = RECORD_DURATION_S
+    total_bytes_to_read = None if duration is None else int(duration * SAMPLE_RATE) * FRAME_SIZE
 
     print("--- Zephyr/Python Audio Recorder ---")
     print(f"  - Serial port: {port}, Baudrate: {baudrate}")
     print(f"  - Output: {output_file}")
-    print(f"  - Expected bytes: {total_bytes_to_read}")
+    if stream:
+        if framed:
+            print("  - Transport: framed (sequence number + CRC-32)")
+        print(f"  - Streaming until {'the END packet' if duration is None else f'{duration} s or the END packet'}")
+    else:
+        print(f"  - Expected bytes: {total_bytes_to_read}")
     print("-" * 36)
 
     try:
@@ -62,16 +385,40 @@ def main(port, baudrate, output_file):
             print(f"Serial port opened. Please press SW0 on device within {SYNC_TIMEOUT_S} seconds...")
 
             # Wait for start packet
-            if not find_start_packet(ser, SYNC_TIMEOUT_S):
+            initial = find_start_packet(ser, SYNC_TIMEOUT_S)
+            if initial is None:
                 print("\nError: Timeout waiting for start packet.")
                 print("Check if device is running and button is pressed.")
                 sys.exit(1)
             
             print("Synchronized (START packet received). Receiving audio data...")
-            
+
+            if stream:
+                with wave.open(output_file, "wb") as wav_file:
+                    wav_file.setnchannels(CHANNELS)
+                    wav_file.setsampwidth(SAMPLE_WIDTH_BYTES)
+                    wav_file.setframerate(SAMPLE_RATE)
+                    writer = wav_file if pipeline is None else audio_stages.AnalyzingWriter(wav_file, pipeline)
+                    if framed:
+                        written, end_received, report = stream_framed_audio(ser, writer, duration, initial)
+                    else:
+                        written, end_received = stream_audio(ser, writer, duration, initial)
+                if framed:
+                    print_loss_report(report)
+                if end_received:
+                    print("Transfer complete (END packet received).")
+                if total_bytes_to_read is not None and written < total_bytes_to_read:
+                    print(f"Warning: got {written} of {total_bytes_to_read} bytes.")
+                print(f"Saved {written} bytes of audio to '{output_file}'.")
+                if pipeline is not None and not report_analysis(pipeline, output_file):
+                    sys.exit(1)
+                return
+
             # Read fixed-length audio data
-            ser.timeout = RECORD_DURATION_S + 2
-            audio_data = ser.read(total_bytes_to_read)
+            ser.timeout = duration + 2
+            audio_data = initial[:total_bytes_to_read]
+            rest = initial[total_bytes_to_read:]
+            audio_data += ser.read(total_bytes_to_read - len(audio_data))
             
             if len(audio_data) < total_bytes_to_read:
                 print(f"\nError: Timeout reading audio data.")
@@ -82,7 +429,8 @@ def main(port, baudrate, output_file):
             
             # Optionally verify end packet
             ser.timeout = 2.0 
-            end_buffer = ser.read(len(PACKET_END))
+            end_buffer = rest[:len(PACKET_END)]
+            end_buffer += ser.read(len(PACKET_END) - len(end_buffer))
             if end_buffer == PACKET_END:
                 print("Transfer verified (END packet received).")
             else:
@@ -94,9 +442,12 @@ def main(port, baudrate, output_file):
                 wav_file.setnchannels(CHANNELS)
                 wav_file.setsampwidth(SAMPLE_WIDTH_BYTES)
                 wav_file.setframerate(SAMPLE_RATE)
-                wav_file.writeframes(audio_data)
+                writer = wav_file if pipeline is None else audio_stages.AnalyzingWriter(wav_file, pipeline)
+                writer.writeframes(audio_data)
             
             print("WAV file saved.")
+            if pipeline is not None and not report_analysis(pipeline, output_file):
+                sys.exit(1)
 
     except serial.SerialException as e:
         print(f"Serial error: {e}")
@@ -108,7 +459,38 @@ if __name__ == "__main__":
     parser.add_argument("-p", "--port", required=True, help="Serial port (e.g. COM3 or /dev/ttyACM0)")
     parser.add_argument("-o", "--output", default="output.wav", help="Output WAV file name (default: output.wav)")
     parser.add_argument("-b", "--baudrate", type=int, default=921600, help="Serial baudrate (default: 921600)")
-    
+    parser.add_argument("-s", "--stream", action="store_true",
+                        help="Write the WAV file while receiving, until the END packet, --duration or Ctrl-C")
+    parser.add_argument("-d", "--duration", type=float,
+                        help=f"Recording duration in seconds (default: {RECORD_DURATION_S}, unlimited with --stream)")
+    parser.add_argument("-f", "--framed", action="store_true",
+                        help="Expect framed audio with sequence numbers and CRCs (implies --stream, see README.md)")
+
+    parser.add_argument("-a", "--analyze", action="store_true",
+                        help="Measure level, clipping, DC offset, level spread and octave bands while recording (needs NumPy)")
+    parser.add_argument("--gain-db", type=float, default=0.0, help="Gain applied before the measurements (default: 0)")
+    parser.add_argument("--min-rms-dbfs", type=float, help="Fail below this RMS level (implies --analyze)")
+    parser.add_argument("--max-clipped", type=float, help="Fail above this ratio of clipped samples (implies --analyze)")
+    parser.add_argument("--max-dc", type=float, help="Fail above this DC offset, relative to full scale (implies --analyze)")
+    parser.add_argument("--min-level-spread-db", type=float,
+                        help="Fail below this spread between loud and quiet blocks (implies --analyze)")
+
     args = parser.parse_args()
 
-    main(args.port, args.baudrate, args.output)
\ No newline at end of file
+    limits = [
+        (stage, key, kind, value)
+        for stage, key, kind, value in (
+            ("level", "rms_dbfs", "min", args.min_rms_dbfs),
+            ("level", "clipped_ratio", "max", args.max_clipped),
+            ("dc", "offset", "max", args.max_dc),
+            ("level", "level_spread_db", "min", args.min_level_spread_db),
+        )
+        if value is not None
+    ]
+    pipeline = None
+    if args.analyze or limits:
+        if audio_stages is None:
+            parser.error("--analyze and the QA limits need NumPy (pip install numpy)")
+        pipeline = audio_stages.default_pipeline(SAMPLE_RATE, args.gain_db, limits)
+
+    main(args.port, args.baudrate, args.output, args.stream, args.duration, args.framed, pipeline)
\ No newline at end of file
@@ -0,0 +1,262 @@
+"""
+@file record_multi.py
+@brief Record audio from several boards at once, with host timestamps for alignment.
+@details All ports are opened and armed together, then read concurrently by one
+         asyncio event loop. Every port gets its own WAV file and a CSV sidecar
+         that maps sample offsets to the host time at which they were received.
+usage:
+    python record_multi.py -o take1 /dev/ttyACM0 /dev/ttyACM1 /dev/ttyACM2
+    python record_multi.py -o take1 -d 30 COM3 COM4
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+import wave
+import serial
+
+from record import (
+    BYTES_PER_SECOND,
+    CHANNELS,
+    FRAME_SIZE,
+    SAMPLE_RATE,
+    SAMPLE_WIDTH_BYTES,
+    STATS_INTERVAL_S,
+    SYNC_TIMEOUT_S,
+    RawAudioSink,
+    StartPacketSearch,
+)
+
+OVERRUN_BACKLOG_S = 0.5         # Unread data that counts as an overrun (seconds of audio)
+READ_SIZE = 65536               # Maximum bytes per read (bytes)
+
+class PortRecorder:
+    """
+    @brief Capture state and statistics of one serial port.
+    """
+
+    def __init__(self, port, baudrate, prefix, duration):
+        """
+        @param port Serial port name.
+        @param baudrate Serial baudrate.
+        @param prefix Output file prefix, the port name is appended.
+        @param duration Recording duration in seconds, None to record until the END packet.
+        """
+        name = re.sub(r"[^A-Za-z0-9]+", "_", os.path.basename(port)).strip("_")
+        self.port = port
+        self.baudrate = baudrate
+        self.output_file = f"{prefix}_{name}.wav"
+        self.timestamps_file = f"{prefix}_{name}.timestamps.csv"
+        self.limit = None if duration is None else int(duration * SAMPLE_RATE) * FRAME_SIZE
+        self.ser = None
+        self.queue = None
+        self.start_ns = None
+        self.end_ns = None
+        self.written = 0
+        self.end_received = False
+        self.overruns = 0
+        self.max_backlog = 0
+        self.error = None
+
+    def open(self):
+        self.ser = serial.Serial(self.port, self.baudrate, timeout=0)
+        self.ser.reset_input_buffer()
+
+    def close(self):
+        if self.ser is not None:
+            self.ser.close()
+
+    def _read(self):
+        """
+        @brief Read what is available without blocking and track the backlog.
+        """
+        backlog = self.ser.in_waiting
+        self.max_backlog = max(self.max_backlog, backlog)
+        if backlog >= OVERRUN_BACKLOG_S * BYTES_PER_SECOND:
+            self.overruns += 1
+        return self.ser.read(min(backlog, READ_SIZE) or 1)
+
+    def start_reader(self, loop):
+        """
+        @brief Deliver (host time, data) tuples of every read to self.queue.
+        @details Uses the event loop's readiness notification where the port has a
+                 file descriptor (POSIX) and a reader thread elsewhere (Windows).
+        """
+        self.queue = asyncio.Queue()
+
+        def on_readable():
+            try:
+                data = self._read()
+            except serial.SerialException as e:
+                loop.remove_reader(self.ser.fileno())
+                self.queue.put_nowait(e)
+                return
+            if data:
+                self.queue.put_nowait((time.time_ns(), data))
+
+        try:
+            loop.add_reader(self.ser.fileno(), on_readable)
+            return
+        except (AttributeError, NotImplementedError, ValueError):
+            pass
+
+        def reader_thread():
+            self.ser.timeout = STATS_INTERVAL_S
+            while self.ser.is_open:
+                try:
+                    data = self._read()
+                except serial.SerialException as e:
+                    if self.ser.is_open:
+                        loop.call_soon_threadsafe(self.queue.put_nowait, e)
+                    return
+                if data:
+                    loop.call_soon_threadsafe(self.queue.put_nowait, (time.time_ns(), data))
+
+        threading.Thread(target=reader_thread, daemon=True).start()
+
+    def stop_reader(self, loop):
+        try:
+            loop.remove_reader(self.ser.fileno())
+        except (AttributeError, NotImplementedError, ValueError):
+            pass
+
+    async def _next(self, timeout=None):
+        item = await asyncio.wait_for(self.queue.get(), timeout)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def record(self, sync_deadline):
+        """
+        @brief Wait for the start packet, then write audio and timestamps until done.
+        @param sync_deadline Event loop time by which the start packet must arrive.
+        """
+        loop = asyncio.get_running_loop()
+        search = StartPacketSearch()
+        initial = None
+        while initial is None:
+            remaining = sync_deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            received_ns, data = await self._next(remaining)
+            initial = search.feed(data)
+        self.start_ns = received_ns
+
+        with wave.open(self.output_file, "wb") as wav_file, \
+                open(self.timestamps_file, "w") as timestamps:
+            wav_file.setnchannels(CHANNELS)
+            wav_file.setsampwidth(SAMPLE_WIDTH_BYTES)
+            wav_file.setframerate(SAMPLE_RATE)
+            timestamps.write("host_time_ns,sample\n")
+            sink = RawAudioSink(wav_file, self.limit)
+            data = initial
+            while True:
+                # host time at which the first sample of this read arrived
+                timestamps.write(f"{received_ns},{sink.written // FRAME_SIZE}\n")
+                sink.feed(data)
+                self.written = sink.written
+                self.end_received = sink.end_received
+                if sink.done:
+                    break
+                received_ns, data = await self._next()
+        self.end_ns = time.time_ns()
+
+    async def run(self, sync_deadline):
+        try:
+            await self.record(sync_deadline)
+        except asyncio.TimeoutError:
+            self.error = "no START packet"
+        except serial.SerialException as e:
+            self.error = str(e)
+
+def print_report(recorders, started_ns):
+    """
+    @brief Print throughput, overruns and the start offsets of all ports.
+    @param recorders PortRecorder objects.
+    @param started_ns Host time at which the ports were armed.
+    """
+    synced = [r.start_ns for r in recorders if r.start_ns is not None]
+    first = min(synced) if synced else None
+    now_ns = time.time_ns()
+    print(f"{'port':<16} {'start':>10} {'audio':>9} {'KiB/s':>8} {'shortfall':>10} "
+          f"{'overruns':>8} {'backlog':>8}  status")
+    for r in recorders:
+        if r.start_ns is None:
+            print(f"{r.port:<16} {'-':>10} {'-':>9} {'-':>8} {'-':>10} "
+                  f"{r.overruns:>8} {r.max_backlog:>8}  {r.error or 'not synchronized'}")
+            continue
+        elapsed = ((r.end_ns or now_ns) - r.start_ns) / 1e9
+        rate = r.written / elapsed if elapsed > 0 else 0.0
+        shortfall = max(0, int(elapsed * BYTES_PER_SECOND) - r.written)
+        status = r.error or ("END" if r.end_received else "stopped")
+        print(f"{r.port:<16} {(r.start_ns - first) / 1e6:>8.1f}ms "
+              f"{r.written / BYTES_PER_SECOND:>8.1f}s {rate / 1024:>8.1f} {shortfall:>10} "
+              f"{r.overruns:>8} {r.max_backlog:>8}  {status}")
+    print(f"Armed for {(now_ns - started_ns) / 1e9:.1f} s. "
+          "Start offsets are relative to the first START packet received.")
+
+async def record_all(recorders):
+    """
+    @brief Arm all ports together and record them concurrently.
+    @param recorders Opened PortRecorder objects.
+    """
+    loop = asyncio.get_running_loop()
+    for r in recorders:
+        r.start_reader(loop)
+    try:
+        sync_deadline = loop.time() + SYNC_TIMEOUT_S
+        await asyncio.gather(*(r.run(sync_deadline) for r in recorders))
+    finally:
+        for r in recorders:
+            r.stop_reader(loop)
+
+def main(ports, baudrate, prefix, duration):
+    """
+    @brief Open all ports, record them and print a per-port report.
+    @param ports Serial port names.
+    @param baudrate Serial baudrate.
+    @param prefix Output file prefix.
+    @param duration Recording duration in seconds, None to record until the END packet.
+    """
+    recorders = [PortRecorder(port, baudrate, prefix, duration) for port in ports]
+    try:
+        for r in recorders:
+            r.open()
+    except serial.SerialException as e:
+        print(f"Serial error: {e}")
+        for r in recorders:
+            r.close()
+        sys.exit(1)
+
+    print(f"{len(recorders)} port(s) armed. Please press SW0 on every device within {SYNC_TIMEOUT_S} seconds...")
+    started_ns = time.time_ns()
+    try:
+        asyncio.run(record_all(recorders))
+    except KeyboardInterrupt:
+        print("\nInterrupted, WAV files were finished.")
+    finally:
+        for r in recorders:
+            r.close()
+
+    print_report(recorders, started_ns)
+    for r in recorders:
+        if r.start_ns is not None:
+            print(f"  - {r.port}: {r.output_file}, {r.timestamps_file}")
+    if any(r.error for r in recorders):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record audio from several serial ports at once.")
+    parser.add_argument("ports", nargs="+", help="Serial ports (e.g. COM3 or /dev/ttyACM0)")
+    parser.add_argument("-o", "--output", default="take", help="Output file prefix (default: take)")
+    parser.add_argument("-b", "--baudrate", type=int, default=921600, help="Serial baudrate (default: 921600)")
+    parser.add_argument("-d", "--duration", type=float,
+                        help="Recording duration in seconds (default: until the END packet or Ctrl-C)")
+
+    args = parser.parse_args()
+
+    main(args.ports, args.baudrate, args.output, args.duration)
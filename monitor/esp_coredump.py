@@ -0,0 +1,266 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ESP-IDF core dumps (ELF data format): reassembly of the base64 dump printed
+with CONFIG_ESP_COREDUMP_ENABLE_TO_UART and in-process decoding of task
+registers and stacks, as read from UART or from the coredump partition.
+"""
+
+import base64
+import binascii
+import re
+import struct
+
+ELF_MAGIC = b"\x7fELF"
+EM_XTENSA = 94
+EM_RISCV = 243
+PT_LOAD = 1
+PT_NOTE = 4
+NT_PRSTATUS = 1
+NT_ESP_EXTRA_INFO = 677
+
+# offset of the register set in the ESP-IDF prstatus notes
+PRSTATUS_PID_OFFSET = 24
+PRSTATUS_REGS_OFFSET = 72
+
+XTENSA_AR_START = 64
+RISCV_REGISTERS = (
+    ["pc", "ra", "sp", "gp", "tp", "t0", "t1", "t2", "s0", "s1"]
+    + ["a%d" % i for i in range(8)]
+    + ["s%d" % i for i in range(2, 12)]
+    + ["t3", "t4", "t5", "t6"]
+)
+
+EMPTY_PARTITION_LENGTHS = (0, 0xFFFFFFFF)
+
+# instruction buses (ROM, IRAM, flash cache) of all ESP32 variants, used when
+# the firmware ELF cannot be indexed
+CODE_REGION = (0x40000000, 0x50000000)
+
+
+class CoreDumpError(Exception):
+    pass
+
+
+class UartCoreDumpCollector(object):
+    """Collects the base64 core dump printed to the console line by line.
+    Only the dump itself is kept in memory, never the rest of the session."""
+
+    START_RE = re.compile(r"=+ CORE DUMP START =+")
+    END_RE = re.compile(r"=+ CORE DUMP END =+")
+    BASE64_RE = re.compile(r"[A-Za-z0-9+/=]+")
+
+    def __init__(self):
+        self.active = False
+        self._data = bytearray()
+        self._pending = ""
+
+    def feed(self, line):
+        """Returns the decoded dump once its END marker has been fed"""
+        if self.START_RE.search(line):
+            self.active = True
+            self._data = bytearray()
+            self._pending = ""
+            return None
+        if not self.active:
+            return None
+        if self.END_RE.search(line):
+            self.active = False
+            data = bytes(self._data)
+            self._data = bytearray()
+            return data
+
+        m = self.BASE64_RE.search(line)
+        if m is None:
+            return None
+        chunk = self._pending + m.group(0)
+        size = len(chunk) - len(chunk) % 4
+        try:
+            self._data.extend(base64.b64decode(chunk[:size]))
+        except binascii.Error:
+            self.active = False
+            return None
+        self._pending = chunk[size:]
+        return None
+
+
+class Task(object):
+    def __init__(self, tcb, registers, sp_register):
+        self.tcb = tcb
+        self.registers = registers
+        self.crashed = False
+        self.pc = registers.get("pc", 0)
+        # a1 is the stack pointer on Xtensa, but an argument on RISC-V
+        self.sp = registers.get(sp_register, 0)
+
+
+class CoreDump(object):
+    def __init__(self, data):
+        self.data = data
+        self.machine = None
+        self.tasks = []
+        self.segments = []
+        self._parse(data)
+
+    @property
+    def arch(self):
+        return {EM_XTENSA: "xtensa", EM_RISCV: "riscv"}.get(self.machine, "unknown")
+
+    def _parse(self, data):
+        # the dump starts with a small header (total length, version, ...),
+        # which differs between ESP-IDF releases, followed by the ELF file
+        elf_start = data.find(ELF_MAGIC, 0, 64)
+        if elf_start == -1:
+            raise CoreDumpError(
+                "Not an ELF core dump, set CONFIG_ESP_COREDUMP_DATA_FORMAT_ELF"
+            )
+        elf = memoryview(data)[elf_start:]
+        if len(elf) < 52 or elf[4] != 1 or elf[5] != 1:
+            raise CoreDumpError("Only 32-bit little-endian core dumps are supported")
+
+        self.machine = struct.unpack_from("<H", elf, 18)[0]
+        phoff = struct.unpack_from("<I", elf, 28)[0]
+        phentsize, phnum = struct.unpack_from("<HH", elf, 42)
+        crashed_tcb = None
+        for i in range(phnum):
+            p_type, p_offset, p_vaddr, _, p_filesz = struct.unpack_from(
+                "<IIIII", elf, phoff + i * phentsize
+            )
+            segment = bytes(elf[p_offset : p_offset + p_filesz])
+            if p_type == PT_LOAD and p_filesz:
+                self.segments.append((p_vaddr, segment))
+            elif p_type == PT_NOTE:
+                for n_type, desc in self._iter_notes(segment):
+                    if n_type == NT_PRSTATUS:
+                        self.tasks.append(self._parse_prstatus(desc))
+                    elif n_type == NT_ESP_EXTRA_INFO and len(desc) >= 4:
+                        crashed_tcb = struct.unpack_from("<I", desc)[0]
+        for task in self.tasks:
+            task.crashed = task.tcb == crashed_tcb
+
+    @staticmethod
+    def _iter_notes(data):
+        offset = 0
+        while offset + 12 <= len(data):
+            namesz, descsz, n_type = struct.unpack_from("<III", data, offset)
+            offset += 12 + ((namesz + 3) & ~3)
+            yield n_type, data[offset : offset + descsz]
+            offset += (descsz + 3) & ~3
+
+    def _parse_prstatus(self, desc):
+        tcb = struct.unpack_from("<I", desc, PRSTATUS_PID_OFFSET)[0]
+        count = (len(desc) - PRSTATUS_REGS_OFFSET) // 4
+        values = struct.unpack_from("<%dI" % count, desc, PRSTATUS_REGS_OFFSET)
+        if self.machine == EM_XTENSA:
+            registers = dict(pc=values[0], ps=values[1])
+            for i in range(16):
+                if XTENSA_AR_START + i < count:
+                    registers["a%d" % i] = values[XTENSA_AR_START + i]
+            return Task(tcb, registers, "a1")
+        return Task(tcb, dict(zip(RISCV_REGISTERS, values)), "sp")
+
+    def read_word(self, address):
+        for start, segment in self.segments:
+            if start <= address and address + 4 <= start + len(segment):
+                return struct.unpack_from("<I", segment, address - start)[0]
+        return None
+
+    def stack_words(self, task, limit=1024):
+        """Words from the task's stack pointer upwards"""
+        for start, segment in self.segments:
+            if start <= task.sp < start + len(segment):
+                offset = task.sp - start
+                end = min(len(segment), offset + limit * 4)
+                end -= (end - offset) % 4
+                return struct.unpack_from("<%dI" % ((end - offset) // 4), segment, offset)
+        return ()
+
+    def backtrace(self, task, is_code_address, depth=32):
+        if self.machine == EM_XTENSA:
+            return self._xtensa_backtrace(task, is_code_address, depth)
+        # without frame pointers, report the return address and the code
+        # addresses found on the stack
+        result = [task.pc]
+        ra = task.registers.get("ra")
+        if ra and is_code_address(ra):
+            result.append(ra)
+        for word in self.stack_words(task):
+            if len(result) >= depth:
+                break
+            if is_code_address(word) and word not in result:
+                result.append(word)
+        return result
+
+    def _xtensa_backtrace(self, task, is_code_address, depth):
+        # windowed ABI unwinding, the same as esp_backtrace_get_next_frame()
+        result = [task.pc]
+        pc = task.registers.get("a0", 0)
+        sp = task.sp
+        while pc and len(result) < depth:
+            if pc & 0x80000000:
+                pc = (pc & 0x3FFFFFFF) | 0x40000000
+            pc -= 3  # point to the call instruction
+            if not is_code_address(pc):
+                break
+            result.append(pc)
+            next_pc = self.read_word(sp - 16)
+            next_sp = self.read_word(sp - 12)
+            if next_pc is None or next_sp is None or next_sp <= sp:
+                break
+            pc, sp = next_pc, next_sp
+        return result
+
+
+def is_code_region(address):
+    return CODE_REGION[0] <= address < CODE_REGION[1]
+
+
+def read_partition_dump(partition_data):
+    """Extracts the core dump stored at the start of the coredump partition"""
+    if len(partition_data) < 4:
+        raise CoreDumpError("Core dump partition is empty")
+    length = struct.unpack_from("<I", partition_data)[0]
+    if length in EMPTY_PARTITION_LENGTHS:
+        raise CoreDumpError("No core dump is stored in the partition")
+    if length > len(partition_data):
+        raise CoreDumpError(
+            "Invalid core dump length %d, the partition has %d bytes"
+            % (length, len(partition_data))
+        )
+    return bytes(partition_data[:length])
+
+
+def format_report(core, resolve, is_code_address):
+    """Human readable summary of all tasks, `resolve(addresses)` returns
+    `addr2line -fipC` style output for every "0x..." address"""
+    lines = [
+        "",
+        "================== CORE DUMP (%s, %d tasks) ==================="
+        % (core.arch, len(core.tasks)),
+    ]
+    for task in sorted(core.tasks, key=lambda t: not t.crashed):
+        lines.append(
+            "Task TCB 0x%08x%s" % (task.tcb, " (crashed)" if task.crashed else "")
+        )
+        registers = ["%s=0x%08x" % (name, value) for name, value in task.registers.items()]
+        for i in range(0, len(registers), 6):
+            lines.append("  " + " ".join(registers[i : i + 6]))
+        addresses = ["0x%08x" % pc for pc in core.backtrace(task, is_code_address)]
+        for i, (addr, output) in enumerate(zip(addresses, resolve(addresses))):
+            output = output.strip().replace("\n", "\n     ")
+            lines.append("  #%-2d %s in %s" % (i, addr, output or "??"))
+        lines.append("")
+    lines.append("=" * 63)
+    return "\n".join(lines) + "\n"
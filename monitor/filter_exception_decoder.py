@@ -12,10 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
+import collections
 import os
+import queue
 import re
+import shutil
+import struct
 import subprocess
 import sys
+import threading
+import time
 
 from platformio.exception import PlatformioException
 from platformio.public import (
@@ -23,12 +30,150 @@ from platformio.public import (
     load_build_metadata,
 )
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import esp_coredump  # pylint: disable=wrong-import-position
+import symbol_index  # pylint: disable=wrong-import-position
+
 # By design, __init__ is called inside miniterm and we can't pass context to it.
 # pylint: disable=attribute-defined-outside-init
 
 IS_WINDOWS = sys.platform.startswith("win")
 
 
+class Addr2LineProcess(object):
+    """A long-lived `addr2line` coprocess resolving a whole backtrace per
+    round-trip instead of spawning the tool (and reloading DWARF) per address"""
+
+    # addr2line echoes every input address (-a) before its location, so a
+    # trailing address that can never resolve marks the end of a response
+    SENTINEL = "0xffffffff"
+    ADDR_ECHO_RE = re.compile(r"^0x[0-9a-fA-F]+: ")
+    MAX_BATCH = 256
+
+    def __init__(self, addr2line_path, firmware_path):
+        self.args = [addr2line_path, "-afipC", "-e", firmware_path]
+        self.encoding = "mbcs" if IS_WINDOWS else "utf-8"
+        self._proc = None
+
+    def start(self):
+        self.close()
+        self._proc = subprocess.Popen(
+            self.args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=1,
+            universal_newlines=True,
+            encoding=self.encoding,
+        )
+
+    def close(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+            self._proc.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            self._proc.kill()
+        self._proc = None
+
+    def resolve(self, addresses):
+        """Returns addr2line output for every address, in order.
+        Restarts the coprocess once if it has died, raises OSError if that
+        does not help either."""
+        result = []
+        for i in range(0, len(addresses), self.MAX_BATCH):
+            batch = addresses[i : i + self.MAX_BATCH]
+            try:
+                result.extend(self._resolve_batch(batch))
+            except (OSError, ValueError, EOFError):
+                self.start()
+                try:
+                    result.extend(self._resolve_batch(batch))
+                except (ValueError, EOFError) as e:
+                    raise OSError(str(e))
+        return result
+
+    def _resolve_batch(self, addresses):
+        if self._proc is None or self._proc.poll() is not None:
+            self.start()
+        self._proc.stdin.write("\n".join(addresses + [self.SENTINEL]) + "\n")
+        self._proc.stdin.flush()
+
+        result = []
+        current = None
+        while True:
+            line = self._proc.stdout.readline()
+            if not line:
+                raise EOFError("%s exited unexpectedly" % self.args[0])
+            line = line.rstrip("\r\n")
+            m = self.ADDR_ECHO_RE.match(line)
+            if m is None:
+                # newlines happen with inlined methods
+                if current is not None:
+                    current += "\n" + line
+                continue
+            if current is not None:
+                result.append(current)
+            if len(result) == len(addresses):
+                # this is the echo of the sentinel
+                return result
+            current = line[m.end() :]
+
+
+class LineAssembler(object):
+    """Splits a stream of text chunks into lines in a single pass.
+
+    Partial lines are kept as a list of fragments until their line break
+    arrives. Lines longer than `max_length` keep only their last
+    `max_length` characters, which is where the address lists are."""
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self.truncated_lines = 0
+        self._parts = []
+        self._size = 0
+
+    @property
+    def pending(self):
+        """True in the middle of a line"""
+        return bool(self._parts)
+
+    def feed(self, text):
+        """Yields (end, line) for every line completed by `text`, where
+        `end` is the offset in `text` right after the line break"""
+        last = 0
+        while True:
+            idx = text.find("\n", last)
+            if idx == -1:
+                self._keep(text[last:])
+                return
+            line = text[last:idx]
+            if self._parts:
+                self._parts.append(line)
+                line = "".join(self._parts)
+                self._parts = []
+                self._size = 0
+            if len(line) > self.max_length:
+                line = line[-self.max_length :]
+                self.truncated_lines += 1
+            last = idx + 1
+            yield last, line
+
+    def _keep(self, fragment):
+        if not fragment:
+            return
+        self._parts.append(fragment)
+        self._size += len(fragment)
+        # trim rarely enough that the total work stays linear, one extra
+        # character makes feed() count the line as truncated
+        if self._size > 2 * self.max_length:
+            tail = "".join(self._parts)[-self.max_length - 1 :]
+            self._parts = [tail]
+            self._size = len(tail)
+
+
 class Esp32ExceptionDecoder(DeviceMonitorFilterBase):
     NAME = "esp32_exception_decoder"
 
@@ -36,12 +181,49 @@ class Esp32ExceptionDecoder(DeviceMonitorFilterBase):
     ADDR_SPLIT = re.compile(r"[ :]")
     PREFIX_RE = re.compile(r"^ *")
 
+    # backtraces waiting for the decoder thread, further ones are dropped
+    DECODE_QUEUE_SIZE = 32
+    # can be changed with `custom_monitor_max_line_length` in "platformio.ini"
+    MAX_LINE_LENGTH = 65536
+    # how often the firmware is checked for a rebuild, in seconds
+    FIRMWARE_CHECK_INTERVAL = 1.0
+    # finished traces are written by the decoder thread itself once no data
+    # arrived for this long, e.g. the device halted after a panic
+    IDLE_FLUSH_DELAY = 0.5
+    # attempts to index a rebuilt firmware, FIRMWARE_CHECK_INTERVAL apart,
+    # before it counts as gone (e.g. after "pio run -t clean")
+    INDEX_ATTEMPTS = 30
+    # longest wait for the index of a rebuilt firmware without addr2line
+    INDEX_WAIT_TIMEOUT = 10.0
+    # how long closing the filter waits for backtraces still being decoded
+    CLOSE_TIMEOUT = 2.0
+
     def __call__(self):
-        self.buffer = ""
+        self.init_stream_state(
+            int(
+                self.config.get(
+                    "env:" + self.environment,
+                    "custom_monitor_max_line_length",
+                    self.MAX_LINE_LENGTH,
+                )
+            )
+        )
 
         self.firmware_path = None
         self.addr2line_path = None
+        self.cxxfilt_path = None
+        self.addr2line = None
+        self.symbols = None
+        self.symbols_failed = not symbol_index.is_available()
+        self.index_thread = None
+        self.firmware_stat = None
         self.enabled = self.setup_paths()
+        if self.enabled and self.addr2line_path:
+            self.addr2line = Addr2LineProcess(self.addr2line_path, self.firmware_path)
+            atexit.register(self.addr2line.close)
+        if self.enabled:
+            # registered last, so it runs before the addr2line coprocess is closed
+            atexit.register(self.close)
 
         if self.config.get("env:" + self.environment, "build_type") != "debug":
             print(
@@ -54,13 +236,28 @@ See https://docs.platformio.org/page/projectconf/build_configurations.html
 
         return self
 
+    def init_stream_state(self, max_line_length):
+        """State of rx() and of the decoder thread, also used to run the
+        filter outside of a monitor session"""
+        self.lines = LineAssembler(max_line_length)
+        self.decode_queue = queue.Queue(self.DECODE_QUEUE_SIZE)
+        self.decoded_traces = collections.deque()
+        self.output_lock = threading.Lock()
+        self.last_rx = 0
+        self.decode_thread = None
+        self.dropped_decodes = 0
+        self.coredump = esp_coredump.UartCoreDumpCollector()
+        self.index_lock = threading.Lock()
+        self.firmware_checked = 0
+
     def setup_paths(self):
         self.project_dir = os.path.abspath(self.project_dir)
         try:
             data = load_build_metadata(self.project_dir, self.environment, cache=True)
 
             self.firmware_path = data["prog_path"]
-            if not os.path.isfile(self.firmware_path):
+            self.firmware_stat = symbol_index.get_file_stat(self.firmware_path)
+            if self.firmware_stat is None:
                 sys.stderr.write(
                     "%s: firmware at %s does not exist, rebuild the project?\n"
                     % (self.__class__.__name__, self.firmware_path)
@@ -72,7 +269,14 @@ See https://docs.platformio.org/page/projectconf/build_configurations.html
                 path = cc_path.replace("-gcc", "-addr2line")
                 if os.path.isfile(path):
                     self.addr2line_path = path
-                    return True
+                path = cc_path.replace("-gcc", "-c++filt")
+                if os.path.isfile(path):
+                    self.cxxfilt_path = path
+            if not self.cxxfilt_path:
+                self.cxxfilt_path = shutil.which("c++filt")
+            # the in-process symbol index does not need the toolchain at all
+            if self.addr2line_path or not self.symbols_failed:
+                return True
         except PlatformioException as e:
             sys.stderr.write(
                 "%s: disabling, exception while looking for addr2line: %s\n"
@@ -85,32 +289,132 @@ See https://docs.platformio.org/page/projectconf/build_configurations.html
         return False
 
     def rx(self, text):
+        """Passes `text` through immediately, backtraces found in it are
+        decoded on a worker thread and every finished trace is inserted
+        after the next line break of the device output, in the order they
+        were requested. A device line left unfinished for IDLE_FLUSH_DELAY
+        is split by the traces, see write_idle_traces()."""
         if not self.enabled:
             return text
 
+        with self.output_lock:
+            self.last_rx = time.monotonic()
+            return self._rx(text)
+
+    def _rx(self, text):
+        # traces finished since the previous call wait for the end of the
+        # device line that is in progress
+        pieces = [] if self.lines.pending else [self.take_decoded_traces()]
         last = 0
-        while True:
-            idx = text.find("\n", last)
-            if idx == -1:
-                if len(self.buffer) < 4096:
-                    self.buffer += text[last:]
-                break
+        truncated_lines = self.lines.truncated_lines
+        for end, line in self.lines.feed(text):
+            pieces.append(text[last:end])
+            last = end
+            while self.decoded_traces:
+                pieces.append(self.decoded_traces.popleft())
 
-            line = text[last:idx]
-            if self.buffer:
-                line = self.buffer + line
-                self.buffer = ""
-            last = idx + 1
+            if self.coredump is not None:
+                data = self.coredump.feed(line)
+                if data is not None:
+                    self.submit_decode(self.build_coredump_report, data)
+                if self.coredump.active:
+                    continue
 
-            m = self.ADDR_PATTERN.search(line)
-            if m is None:
-                continue
+            match = self.match_line(line)
+            if match:
+                self.request_decode(line, match)
+        pieces.append(text[last:])
+
+        if self.lines.truncated_lines != truncated_lines:
+            sys.stderr.write(
+                "%s: %d line(s) longer than %d characters so far, only their "
+                "ends were searched for backtraces\n"
+                % (
+                    self.__class__.__name__,
+                    self.lines.truncated_lines,
+                    self.lines.max_length,
+                )
+            )
+        return "".join(pieces)
+
+    def take_decoded_traces(self):
+        if not self.decoded_traces:
+            return ""
+        traces = []
+        while self.decoded_traces:
+            traces.append(self.decoded_traces.popleft())
+        # the rest of an interrupted line follows the traces
+        return ("\n" if self.lines.pending else "") + "".join(traces)
+
+    def write_idle_traces(self):
+        """Writes finished traces to the terminal when rx() is not called,
+        in the middle of a device line if it stopped there"""
+        terminal = getattr(self, "_running_terminal", None)
+        if terminal is None:
+            return
+        with self.output_lock:
+            if time.monotonic() - self.last_rx < self.IDLE_FLUSH_DELAY:
+                return
+            text = self.take_decoded_traces()
+            if text:
+                terminal.console.write(text)
+
+    def close(self):
+        """Writes the backtraces still waiting or being decoded"""
+        deadline = time.monotonic() + self.CLOSE_TIMEOUT
+        while self.decode_queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self.output_lock:
+            text = self.take_decoded_traces()
+        if text:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+    def match_line(self, line):
+        m = self.ADDR_PATTERN.search(line)
+        return m.group(1) if m is not None else None
+
+    def request_decode(self, line, address_match):
+        self.submit_decode(self.build_backtrace, line, address_match)
+
+    def submit_decode(self, func, *args):
+        if self.decode_thread is None:
+            self.decode_thread = threading.Thread(
+                target=self._decode_worker, name=self.NAME, daemon=True
+            )
+            self.decode_thread.start()
+        try:
+            self.decode_queue.put_nowait((func, args))
+        except queue.Full:
+            self.dropped_decodes += 1
+            sys.stderr.write(
+                "%s: decoder is busy, dropped %d backtrace(s) so far\n"
+                % (self.__class__.__name__, self.dropped_decodes)
+            )
 
-            trace = self.build_backtrace(line, m.group(1))
+    def _decode_worker(self):
+        while True:
+            try:
+                func, args = self.decode_queue.get(
+                    timeout=self.IDLE_FLUSH_DELAY if self.decoded_traces else None
+                )
+            except queue.Empty:
+                self.write_idle_traces()
+                continue
+            try:
+                self.check_firmware()
+                trace = func(*args)
+            except Exception as e:  # pylint: disable=broad-except
+                # e.g. the ELF was removed, keep serving the next requests
+                trace = None
+                sys.stderr.write(
+                    "%s: failed to decode a backtrace: %s\n"
+                    % (self.__class__.__name__, e)
+                )
+            finally:
+                self.decode_queue.task_done()
             if trace:
-                text = text[: idx + 1] + trace + text[idx + 1 :]
-                last += len(trace)
-        return text
+                self.decoded_traces.append(trace)
 
     def is_address_ignored(self, address):
         return address in ("", "0x00000000")
@@ -131,36 +435,171 @@ See https://docs.platformio.org/page/projectconf/build_configurations.html
         prefix = prefix_match.group(0) if prefix_match is not None else ""
 
         trace = ""
-        enc = "mbcs" if IS_WINDOWS else "utf-8"
-        args = [self.addr2line_path, u"-fipC", u"-e", self.firmware_path]
+        i = 0
+        for addr, output in zip(addresses, self.resolve_addresses(addresses)):
+            output = output.strip().replace("\n", "\n     ")
+
+            # throw out addresses not from ELF
+            if not output or output == "?? ??:0":
+                continue
+
+            output = self.strip_project_dir(output)
+            trace += "%s  #%-2d %s in %s\n" % (prefix, i, addr, output)
+            i += 1
+
+        return trace + "\n" if trace else ""
+
+    def build_coredump_report(self, data):
         try:
-            i = 0
-            for addr in addresses:
-                output = (
-                    subprocess.check_output(args + [addr])
-                    .decode(enc)
-                    .strip()
+            core = esp_coredump.CoreDump(data)
+        except (esp_coredump.CoreDumpError, struct.error) as e:
+            return "Failed to decode core dump (%d bytes): %s\n" % (len(data), e)
+
+        path = os.path.join(os.path.dirname(self.firmware_path), "coredump.bin")
+        try:
+            with open(path, "wb") as fp:
+                fp.write(data)
+        except OSError:
+            path = None
+
+        symbols = self.get_symbol_index()
+        report = esp_coredump.format_report(
+            core,
+            lambda addresses: [
+                self.strip_project_dir(output)
+                for output in self.resolve_addresses(addresses)
+            ],
+            (
+                symbols.is_code_address
+                if symbols is not None
+                else esp_coredump.is_code_region
+            ),
+        )
+        if path:
+            report += "Core dump saved to %s\n" % path
+        return report + "\n"
+
+    def check_firmware(self):
+        """Notices a rebuilt firmware, the index of the old one is dropped
+        right away and the new one is indexed in the background. Meanwhile
+        addr2line resolves against the new ELF."""
+        now = time.monotonic()
+        if now - self.firmware_checked < self.FIRMWARE_CHECK_INTERVAL:
+            return
+        self.firmware_checked = now
+        stat = symbol_index.get_file_stat(self.firmware_path)
+        if stat is None or stat == self.firmware_stat:
+            return
+
+        with self.index_lock:
+            self.firmware_stat = stat
+            self.symbols = None
+            if self.addr2line is not None:
+                # restarted with the new ELF by the next resolve()
+                self.addr2line.close()
+            if not symbol_index.is_available():
+                return
+            self.symbols_failed = False
+            if self.index_thread is None:
+                self.index_thread = threading.Thread(
+                    target=self._index_worker, name=self.NAME + "-index", daemon=True
                 )
+                self.index_thread.start()
 
-                # newlines happen with inlined methods
-                output = output.replace(
-                    "\n", "\n     "
+    def _index_worker(self):
+        for _ in range(self.INDEX_ATTEMPTS):
+            stat = symbol_index.get_file_stat(self.firmware_path)
+            symbols = None
+            error = None
+            if stat is not None:
+                try:
+                    symbols = symbol_index.SymbolIndex.load(
+                        self.firmware_path, self.cxxfilt_path
+                    )
+                except symbol_index.INDEX_ERRORS as e:
+                    error = e
+            with self.index_lock:
+                # the ELF may still be (or again be) written by the linker
+                if stat is not None and stat == symbol_index.get_file_stat(
+                    self.firmware_path
+                ) and (
+                    symbols is None
+                    or symbols.elf_hash
+                    == symbol_index.get_file_hash(self.firmware_path)
+                ):
+                    self.firmware_stat = stat
+                    self.symbols = symbols
+                    self.symbols_failed = symbols is None
+                    self.index_thread = None
+                    break
+            time.sleep(self.FIRMWARE_CHECK_INTERVAL)
+        else:
+            with self.index_lock:
+                self.symbols = None
+                self.symbols_failed = True
+                self.index_thread = None
+            sys.stderr.write(
+                "%s: %s is missing or still changing, decoding without symbols "
+                "until it is rebuilt\n" % (self.__class__.__name__, self.firmware_path)
+            )
+            return
+        if error is not None:
+            sys.stderr.write(
+                "%s: failed to index %s, using addr2line: %s\n"
+                % (self.__class__.__name__, self.firmware_path, error)
+            )
+
+    def get_symbol_index(self):
+        index_thread = self.index_thread
+        if index_thread is not None:
+            # being rebuilt for a new firmware, addr2line bridges the gap
+            if self.addr2line_path:
+                return None
+            index_thread.join(self.INDEX_WAIT_TIMEOUT)
+            if index_thread.is_alive():
+                return None
+        if self.symbols is None and not self.symbols_failed:
+            try:
+                self.symbols = symbol_index.SymbolIndex.load(
+                    self.firmware_path, self.cxxfilt_path
+                )
+            except symbol_index.INDEX_ERRORS as e:
+                self.symbols_failed = True
+                sys.stderr.write(
+                    "%s: failed to index %s, using addr2line: %s\n"
+                    % (self.__class__.__name__, self.firmware_path, e)
                 )
+        return self.symbols
 
-                # throw out addresses not from ELF
-                if output == "?? ??:0":
-                    continue
+    def resolve_addresses(self, addresses):
+        symbols = self.get_symbol_index()
+        if symbols is not None:
+            return symbols.resolve(addresses)
+        if self.addr2line is not None:
+            try:
+                return self.addr2line.resolve(addresses)
+            except OSError as e:
+                sys.stderr.write(
+                    "%s: addr2line coprocess failed, falling back to a call per "
+                    "address: %s\n" % (self.__class__.__name__, e)
+                )
+                self.addr2line.close()
+                self.addr2line = None
+        return [self.resolve_address(addr) for addr in addresses]
 
-                output = self.strip_project_dir(output)
-                trace += "%s  #%-2d %s in %s\n" % (prefix, i, addr, output)
-                i += 1
+    def resolve_address(self, addr):
+        if not self.addr2line_path:
+            return ""
+        enc = "mbcs" if IS_WINDOWS else "utf-8"
+        args = [self.addr2line_path, u"-fipC", u"-e", self.firmware_path, addr]
+        try:
+            return subprocess.check_output(args).decode(enc)
         except subprocess.CalledProcessError as e:
             sys.stderr.write(
                 "%s: failed to call %s: %s\n"
                 % (self.__class__.__name__, self.addr2line_path, e)
             )
-
-        return trace + "\n" if trace else ""
+        return ""
 
     def strip_project_dir(self, trace):
         while True:
@@ -169,3 +608,84 @@ See https://docs.platformio.org/page/projectconf/build_configurations.html
                 break
             trace = trace[:idx] + trace[idx + len(self.project_dir) + 1 :]
         return trace
+
+
+class CortexMFaultDecoder(Esp32ExceptionDecoder):
+    """Symbolizes PC, LR and stacked return addresses of the Cortex-M fault
+    dumps printed by Zephyr and the Arduino cores (mbed, Adafruit nRF52,
+    SAMD, Renesas, Pico, Silicon Labs)"""
+
+    NAME = "cortexm_fault_decoder"
+
+    # fault banners only, plain "fault" also appears in ordinary log lines
+    FAULT_RE = re.compile(
+        r"hard ?fault|memmanage|bus ?fault|usage ?fault|secure ?fault"
+        r"|fault handler|>>> ZEPHYR FATAL ERROR|\*{3,}[^*]*\bFAULT\b[^*]*\*{3,}"
+        r"|\bpanic\b",
+        re.IGNORECASE,
+    )
+    # "r14/lr:  0x0000abcd", "(r15/pc): 0x000012ab", "PC   : 0002A0C2", "LR = 0x..."
+    REGISTER_RE = re.compile(
+        r"\b(pc|lr)\b\)?\s*[:=]\s*((?:0x)?[0-9a-fA-F]{1,8})\b", re.IGNORECASE
+    )
+    ANY_REGISTER_RE = re.compile(
+        r"\b[a-zA-Z][\w/]+\)?\s*[:=]\s*(?:0x)?[0-9a-fA-F]+\b"
+    )
+    STACK_WORD_RE = re.compile(r"\b(?:0x)?([0-9a-fA-F]{8})\b")
+    # lines after a fault banner which are still part of the dump
+    FAULT_CONTEXT_LINES = 48
+
+    def __call__(self):
+        self.fault_lines_left = 0
+        super().__call__()
+        self.coredump = None
+        return self
+
+    def match_line(self, line):
+        if self.FAULT_RE.search(line):
+            self.fault_lines_left = self.FAULT_CONTEXT_LINES
+        if not self.fault_lines_left:
+            return None
+        self.fault_lines_left -= 1
+
+        frames = []
+        for m in self.REGISTER_RE.finditer(line):
+            address = int(m.group(2), 16)
+            # skip EXC_RETURN values in LR
+            if address < 0xF0000000:
+                frames.append((m.group(1).upper(), address & ~1))
+        if frames or self.ANY_REGISTER_RE.search(line):
+            return frames
+
+        # a stack dump line, Thumb return addresses pushed to the stack are odd
+        for m in self.STACK_WORD_RE.finditer(line):
+            address = int(m.group(1), 16)
+            if address & 1:
+                frames.append(("stack", address & ~1))
+        return frames
+
+    def build_backtrace(self, line, frames):
+        symbols = self.get_symbol_index()
+        if symbols is not None:
+            frames = [f for f in frames if symbols.is_code_address(f[1])]
+        if not frames:
+            return ""
+
+        prefix_match = self.PREFIX_RE.match(line)
+        prefix = prefix_match.group(0) if prefix_match is not None else ""
+
+        addresses = ["0x%08x" % address for _, address in frames]
+        trace = ""
+        i = 0
+        for (label, _), addr, output in zip(
+            frames, addresses, self.resolve_addresses(addresses)
+        ):
+            output = output.strip().replace("\n", "\n     ")
+            if not output or output == "?? ??:0":
+                continue
+
+            output = self.strip_project_dir(output)
+            trace += "%s  #%-2d %-5s %s in %s\n" % (prefix, i, label, addr, output)
+            i += 1
+
+        return trace + "\n" if trace else ""
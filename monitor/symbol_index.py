@@ -0,0 +1,452 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process address index of a firmware ELF (function ranges, DWARF line
+tables and inlined call chains) used by the monitor filters instead of
+the toolchain `addr2line`. The index is cached next to the firmware and
+keyed by the ELF content hash.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import subprocess
+from array import array
+from bisect import bisect_right
+
+try:
+    from elftools.common.exceptions import DWARFError, ELFError
+    from elftools.elf.elffile import ELFFile
+    from elftools.elf.sections import SymbolTableSection
+
+    # errors that mean "cannot index this file", the caller falls back to addr2line
+    INDEX_ERRORS = (OSError, ValueError, KeyError, ELFError, DWARFError)
+except ImportError:  # pyelftools is shipped with PlatformIO Core
+    ELFFile = None
+    INDEX_ERRORS = (OSError, ValueError, KeyError)
+
+CACHE_FILE_NAME = "symbol_index.json"
+
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+
+
+def is_available():
+    return ELFFile is not None
+
+
+def get_file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_file_stat(path):
+    """Cheap change detection, (mtime, size) or None if the file is missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _pack(values, typecode):
+    return base64.b64encode(array(typecode, values).tobytes()).decode("ascii")
+
+
+def _unpack(data, typecode):
+    result = array(typecode)
+    result.frombytes(base64.b64decode(data))
+    return result
+
+
+class SymbolIndex(object):
+    VERSION = 1
+
+    def __init__(self, elf_hash, data):
+        self.elf_hash = elf_hash
+        self.files = data["files"]
+        self.code_ranges = [tuple(r) for r in data["code_ranges"]]
+
+        self.func_starts = _unpack(data["func_starts"], "Q")
+        self.func_ends = _unpack(data["func_ends"], "Q")
+        self.func_names = data["func_names"]
+
+        self.line_addrs = _unpack(data["line_addrs"], "Q")
+        self.line_files = _unpack(data["line_files"], "I")
+        self.line_numbers = _unpack(data["line_numbers"], "I")
+
+        # flattened inlined call chains: every segment maps to a chain of
+        # (name, call file, call line) frames, innermost first
+        self.inline_starts = _unpack(data["inline_starts"], "Q")
+        self.inline_chains = data["inline_chains"]
+        self.inline_segments = _unpack(data["inline_segments"], "i")
+
+    @classmethod
+    def load(cls, firmware_path, cxxfilt_path=None, cache_dir=None):
+        """Returns the index of `firmware_path`, reusing the cache file when
+        it was built for exactly the same ELF contents"""
+        elf_hash = get_file_hash(firmware_path)
+        cache_path = os.path.join(
+            cache_dir or os.path.dirname(firmware_path), CACHE_FILE_NAME
+        )
+        try:
+            with open(cache_path) as fp:
+                data = json.load(fp)
+            if data.get("version") == cls.VERSION and data.get("elf_hash") == elf_hash:
+                return cls(elf_hash, data)
+        except (OSError, ValueError, KeyError):
+            pass
+
+        data = ElfIndexBuilder(firmware_path, cxxfilt_path).build()
+        data.update(version=cls.VERSION, elf_hash=elf_hash)
+        try:
+            with open(cache_path + ".tmp", "w") as fp:
+                json.dump(data, fp)
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError:
+            pass
+        return cls(elf_hash, data)
+
+    def is_code_address(self, address):
+        for start, end in self.code_ranges:
+            if start <= address < end:
+                return True
+        return False
+
+    def find_function(self, address):
+        idx = bisect_right(self.func_starts, address) - 1
+        if idx >= 0 and address < self.func_ends[idx]:
+            return self.func_names[idx]
+        return None
+
+    def find_line(self, address):
+        idx = bisect_right(self.line_addrs, address) - 1
+        if idx < 0 or not self.line_numbers[idx]:
+            return None
+        return self.files[self.line_files[idx]], self.line_numbers[idx]
+
+    def find_inline_chain(self, address):
+        idx = bisect_right(self.inline_starts, address) - 1
+        if idx < 0 or self.inline_segments[idx] < 0:
+            return []
+        return self.inline_chains[self.inline_segments[idx]]
+
+    def lookup(self, address):
+        """Returns the same text as `addr2line -fipC` for `address`"""
+        function = self.find_function(address)
+        line = self.find_line(address)
+        if function is None and line is None:
+            return "?? ??:0"
+
+        frames = []
+        location = "%s:%d" % line if line else "??:?"
+        for name, call_file, call_line in self.find_inline_chain(address):
+            frames.append("%s at %s" % (name, location))
+            location = "%s:%d" % (self.files[call_file], call_line)
+        frames.append("%s at %s" % (function or "??", location))
+        return "\n (inlined by) ".join(frames)
+
+    def resolve(self, addresses):
+        result = []
+        for addr in addresses:
+            try:
+                result.append(self.lookup(int(addr, 16)))
+            except ValueError:
+                result.append("?? ??:0")
+        return result
+
+
+class ElfIndexBuilder(object):
+    def __init__(self, firmware_path, cxxfilt_path=None):
+        self.firmware_path = firmware_path
+        self.cxxfilt_path = cxxfilt_path
+        self.files = []
+        self._file_ids = {}
+        self._file_id("??")
+
+    def build(self):
+        with open(self.firmware_path, "rb") as fp:
+            elf = ELFFile(fp)
+            is_thumb = elf["e_machine"] == "EM_ARM"
+            code_ranges = [
+                [s["sh_addr"], s["sh_addr"] + s["sh_size"]]
+                for s in elf.iter_sections()
+                if s["sh_flags"] & SHF_ALLOC
+                and s["sh_flags"] & SHF_EXECINSTR
+                and s["sh_size"]
+            ]
+            functions = self._collect_functions(elf, is_thumb)
+            lines, inlines = [], []
+            if elf.has_dwarf_info():
+                dwarf = elf.get_dwarf_info()
+                for cu in dwarf.iter_CUs():
+                    file_map = self._collect_lines(dwarf, cu, lines)
+                    self._collect_inlines(dwarf, cu, file_map, inlines)
+
+        # demangle symbol and inlined function names with a single call
+        names = [f[2] for f in functions]
+        names.extend(r[3][0] for r in inlines)
+        names = self._demangle(names)
+        func_names = names[: len(functions)]
+        inlines = [
+            (r[0], r[1], r[2], (name,) + r[3][1:])
+            for r, name in zip(inlines, names[len(functions) :])
+        ]
+
+        lines.sort(key=lambda row: (row[0], row[2] != 0))
+        inline_starts, inline_segments, inline_chains = self._flatten_inlines(
+            inlines
+        )
+        return dict(
+            files=self.files,
+            code_ranges=code_ranges,
+            func_starts=_pack([f[0] for f in functions], "Q"),
+            func_ends=_pack([f[1] for f in functions], "Q"),
+            func_names=func_names,
+            line_addrs=_pack([row[0] for row in lines], "Q"),
+            line_files=_pack([row[1] for row in lines], "I"),
+            line_numbers=_pack([row[2] for row in lines], "I"),
+            inline_starts=_pack(inline_starts, "Q"),
+            inline_segments=_pack(inline_segments, "i"),
+            inline_chains=inline_chains,
+        )
+
+    def _file_id(self, path):
+        if path not in self._file_ids:
+            self._file_ids[path] = len(self.files)
+            self.files.append(path)
+        return self._file_ids[path]
+
+    @staticmethod
+    def _collect_functions(elf, is_thumb):
+        symbols = {}
+        for section in elf.iter_sections():
+            if not isinstance(section, SymbolTableSection):
+                continue
+            for sym in section.iter_symbols():
+                if sym["st_info"]["type"] != "STT_FUNC" or not sym.name:
+                    continue
+                if not isinstance(sym["st_shndx"], int):
+                    continue
+                start = sym["st_value"] & ~1 if is_thumb else sym["st_value"]
+                # prefer sized, global symbols when several alias one address
+                rank = (sym["st_size"] > 0, sym["st_info"]["bind"] == "STB_GLOBAL")
+                if start not in symbols or rank > symbols[start][0]:
+                    symbols[start] = (rank, sym["st_size"], sym["st_shndx"], sym.name)
+
+        section_ends = {}
+        starts = sorted(symbols)
+        functions = []
+        for i, start in enumerate(starts):
+            _, size, shndx, name = symbols[start]
+            if size:
+                end = start + size
+            else:
+                # unsized (assembly) symbols span up to the next function
+                if shndx not in section_ends:
+                    section = elf.get_section(shndx)
+                    section_ends[shndx] = section["sh_addr"] + section["sh_size"]
+                end = section_ends[shndx]
+                if i + 1 < len(starts):
+                    end = min(end, starts[i + 1])
+            if end > start:
+                functions.append((start, end, name))
+        return functions
+
+    def _collect_lines(self, dwarf, cu, rows):
+        """Appends (address, file id, line) rows of the CU line program,
+        end of sequence rows have line 0. Returns file index -> file id."""
+        lineprog = dwarf.line_program_for_CU(cu)
+        if lineprog is None:
+            return {}
+        top = cu.get_top_DIE()
+        comp_dir = self._attr_str(top, "DW_AT_comp_dir")
+        version = lineprog["version"]
+        include_dirs = [self._decode(d) for d in lineprog["include_directory"]]
+
+        file_map = {}
+        for i, entry in enumerate(lineprog["file_entry"]):
+            if version >= 5:
+                idx = i
+                dirname = include_dirs[entry.dir_index] if entry.dir_index < len(
+                    include_dirs
+                ) else ""
+            else:
+                idx = i + 1
+                dirname = (
+                    include_dirs[entry.dir_index - 1]
+                    if 0 < entry.dir_index <= len(include_dirs)
+                    else ""
+                )
+            path = os.path.join(comp_dir, dirname, self._decode(entry.name))
+            file_map[idx] = self._file_id(os.path.normpath(path))
+
+        sequence_start = len(rows)
+        for entry in lineprog.get_entries():
+            state = entry.state
+            if state is None:
+                continue
+            if state.end_sequence:
+                row = (state.address, 0, 0)
+            else:
+                row = (state.address, file_map.get(state.file, 0), state.line)
+            # only the last row of a sequence at the same address is in effect
+            if len(rows) > sequence_start and rows[-1][0] == state.address:
+                rows[-1] = row
+            else:
+                rows.append(row)
+            if state.end_sequence:
+                sequence_start = len(rows)
+        return file_map
+
+    def _collect_inlines(self, dwarf, cu, file_map, result):
+        top = cu.get_top_DIE()
+        base = top.attributes.get("DW_AT_low_pc")
+        base = base.value if base else 0
+
+        def _walk(die, depth):
+            for child in die.iter_children():
+                child_depth = depth
+                if child.tag == "DW_TAG_inlined_subroutine":
+                    child_depth += 1
+                    name = self._die_name(child)
+                    call_file = child.attributes.get("DW_AT_call_file")
+                    call_line = child.attributes.get("DW_AT_call_line")
+                    frame = (
+                        name or "??",
+                        file_map.get(call_file.value, 0) if call_file else 0,
+                        call_line.value if call_line else 0,
+                    )
+                    for start, end in self._die_ranges(dwarf, cu, child, base):
+                        result.append((start, end, child_depth, frame))
+                if child.has_children:
+                    _walk(child, child_depth)
+
+        _walk(top, 0)
+
+    @staticmethod
+    def _flatten_inlines(inlines):
+        """Converts nested inline ranges into sorted, non-overlapping
+        segments that each point to a chain of frames, innermost first"""
+        inlines.sort(key=lambda r: (r[0], r[2]))
+        starts, segments, chains = [], [], []
+        chain_ids = {}
+        stack = []
+
+        def _emit(address):
+            chain = tuple(r[3] for r in reversed(stack))
+            if chain and chain not in chain_ids:
+                chain_ids[chain] = len(chains)
+                chains.append([list(frame) for frame in chain])
+            segment = chain_ids[chain] if chain else -1
+            if starts and starts[-1] == address:
+                segments[-1] = segment
+            else:
+                starts.append(address)
+                segments.append(segment)
+
+        for item in inlines:
+            start = item[0]
+            while stack and (stack[-1][1] <= start or stack[-1][2] >= item[2]):
+                end = stack.pop()[1]
+                if end <= start:
+                    _emit(end)
+            stack.append(item)
+            _emit(start)
+        while stack:
+            _emit(stack.pop()[1])
+        return starts, segments, chains
+
+    @staticmethod
+    def _die_ranges(dwarf, cu, die, base):
+        attrs = die.attributes
+        if "DW_AT_low_pc" in attrs and "DW_AT_high_pc" in attrs:
+            low = attrs["DW_AT_low_pc"]
+            high = attrs["DW_AT_high_pc"]
+            low_pc = low.value
+            if low.form.startswith("DW_FORM_addrx"):
+                low_pc = dwarf.get_addr(cu, low.value)
+            if high.form == "DW_FORM_addr":
+                high_pc = high.value
+            elif high.form.startswith("DW_FORM_addrx"):
+                high_pc = dwarf.get_addr(cu, high.value)
+            else:
+                high_pc = low_pc + high.value
+            return [(low_pc, high_pc)]
+
+        ranges = attrs.get("DW_AT_ranges")
+        range_lists = dwarf.range_lists()
+        if ranges is None or range_lists is None or ranges.form != "DW_FORM_sec_offset":
+            return []
+        result = []
+        for entry in range_lists.get_range_list_at_offset(ranges.value, cu=cu):
+            if hasattr(entry, "base_address"):
+                base = entry.base_address
+            elif entry.is_absolute:
+                result.append((entry.begin_offset, entry.end_offset))
+            else:
+                result.append((base + entry.begin_offset, base + entry.end_offset))
+        return result
+
+    def _die_name(self, die):
+        visited = 0
+        while die is not None and visited < 8:
+            visited += 1
+            for attr in ("DW_AT_linkage_name", "DW_AT_MIPS_linkage_name"):
+                if attr in die.attributes:
+                    return self._attr_str(die, attr)
+            if "DW_AT_name" in die.attributes:
+                return self._attr_str(die, "DW_AT_name")
+            for attr in ("DW_AT_abstract_origin", "DW_AT_specification"):
+                if attr in die.attributes:
+                    die = die.get_DIE_from_attribute(attr)
+                    break
+            else:
+                return None
+        return None
+
+    def _attr_str(self, die, name):
+        attr = die.attributes.get(name)
+        return self._decode(attr.value) if attr else ""
+
+    @staticmethod
+    def _decode(value):
+        if isinstance(value, bytes):
+            return value.decode("utf-8", "replace")
+        return value
+
+    def _demangle(self, names):
+        mangled = sorted(set(n for n in names if n.startswith("_Z")))
+        if not mangled or not self.cxxfilt_path:
+            return names
+        try:
+            output = subprocess.run(
+                [self.cxxfilt_path],
+                input="\n".join(mangled) + "\n",
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                universal_newlines=True,
+                check=True,
+            ).stdout.splitlines()
+        except (OSError, subprocess.CalledProcessError):
+            return names
+        if len(output) != len(mangled):
+            return names
+        demangled = dict(zip(mangled, output))
+        return [demangled.get(n, n) for n in names]
@@ -14,11 +14,13 @@
 
 import os
 import sys
+import threading
+import time
 
 from platformio.public import PlatformBase, to_unix_path
-from importlib import import_module
-
 
+# PlatformIO Core is already imported by the time it loads this file
+_load_started = time.time() * 1e6
 
 IS_WINDOWS = sys.platform.startswith("win")
 # Set Platformio env var to use windows_amd64 for all windows architectures
@@ -29,40 +31,45 @@ if IS_WINDOWS:
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-Architecture = ""
+from platform_cfg import board_cache, footprint, profiling, registry  # noqa: E402
+
+_options_lock = threading.Lock()
+
+if profiling.enabled():
+    profiling.install_process_hooks()
 
 class SeeedstudioPlatform(PlatformBase):
-    def configure_default_packages(self, variables, targets):
+    def __init__(self, manifest_path):
+        super().__init__(manifest_path)
+        self._lazy_boards = {}
 
-        global Architecture
+    def configure_default_packages(self, variables, targets):
         if not variables.get("board"):
             return super().configure_default_packages(variables, targets)
 
         board_name = variables.get("board")
+        with profiling.span("configure_default_packages %s" % board_name, "packages"):
+            result = self._configure_default_packages(board_name, variables, targets)
+        # the pio process hands its spans over to the SCons process
+        if profiling.enabled() and "SCons" not in sys.modules:
+            profiling.flush_parent_trace(
+                self.config.get("platformio", "build_dir"), _load_started
+            )
+        return result
 
-        if "esp32" in board_name:
-            Architecture = "esp"
-        if board_name == "seeed-xiao-ra4m1":
-            Architecture = "renesas"
-        if board_name == "seeed-xiao-rp2040" or board_name == "seeed-xiao-rp2350":
-            Architecture = "rpi"
-        if "nrf" in board_name:
-            Architecture = "nrf"
-        if "samd" in board_name:
-            Architecture = "samd"
-        if "mg24" in board_name:
-            Architecture = "siliconlab"
-
-        if Architecture:
-            try:
-                board_module = import_module(f"platform_cfg.{Architecture}_cfg")
-                configure_board = getattr(board_module, f"configure_{Architecture}_default_packages")
-                configure_board(self, variables, targets)
-            except (ImportError, AttributeError) as e:
-
-                print(f"Error: {e} for board {board_name}")
-
-        return super().configure_default_packages(variables, targets)
+    def _configure_default_packages(self, board_name, variables, targets):
+        arch = registry.resolve(
+            board_name, self.board_config(board_name).get("architecture", "")
+        )
+        if arch:
+            arch.configure_default_packages(self, variables, targets)
+
+        result = super().configure_default_packages(variables, targets)
+        if footprint.minimal_mode():
+            footprint.drop_unselected_uploaders(self)
+        if arch and footprint.report_enabled():
+            footprint.print_report(self, board_name, arch.name, targets)
+        return result
 
 
     def get_boards(self, id_=None):
@@ -77,46 +84,50 @@ class SeeedstudioPlatform(PlatformBase):
         return result
 
 
+    def get_package_dir(self, name):
+        board_cache.note_package_lookup()
+        with profiling.span("get_package_dir %s" % name, "packages"):
+            return super().get_package_dir(name)
+
+
     def _add_dynamic_options(self, board):
-        global Architecture
-        board_name = board.id
-        if "esp32" in board_name:
-            Architecture = "esp"
-        if board_name == "seeed-xiao-ra4m1":
-            Architecture = "renesas"
-
-        if board_name == "seeed-xiao-rp2040" or board_name == "seeed-xiao-rp2350":
-            Architecture = "rpi"
-
-        if "nrf" in board_name:
-            Architecture = "nrf"
-        if "samd" in board_name:
-            Architecture = "samd"
-        if "mg24" in board_name:
-            Architecture = "siliconlab"
-
-        if Architecture:
-            # 动态导入板子配置函数
-            try:
-                board_module = import_module(f"platform_cfg.{Architecture}_cfg")
-                configure_tool = getattr(board_module, f"_add_{Architecture}_default_debug_tools")
-                return configure_tool(self, board)
-            except (ImportError, AttributeError) as e:
-                print(f"Error: in _add_dynamic_options {e} for board {board_name}")
-        else:
-            print("no config Architecture")
-            return
+        if isinstance(board, board_cache.LazyBoardConfig):
+            return board
+        with _options_lock:
+            lazy = self._lazy_boards.get(board.manifest_path)
+            if lazy is not None:
+                return lazy
+            arch = registry.resolve(board.id, board.get("architecture", ""))
+            if not arch:
+                print("no config Architecture for board %s" % board.id)
+                return board
+            # the debug tools are only worked out once a build or debug
+            # session actually reads them, and are cached across runs
+            cache = board_cache.get_cache(self.config.get("platformio", "cache_dir"))
+            lazy = board_cache.LazyBoardConfig(
+                board.manifest_path,
+                cache,
+                lambda b: board_cache.expand_board(
+                    b, cache, lambda b: arch.add_default_debug_tools(self, b)
+                ),
+            )
+            if "platform" in board:
+                lazy.update("platform", board.get("platform"))
+            self._lazy_boards[board.manifest_path] = lazy
+            return lazy
 
 
 
     def configure_debug_session(self, debug_config):
-        global Architecture
-
-        if Architecture:
-            # 动态导入板子配置函数
-            try:
-                board_module = import_module(f"platform_cfg.{Architecture}_cfg")
-                configure_debug_seesion = getattr(board_module, f"configure_{Architecture}_debug_session")
-                configure_debug_seesion(self, debug_config)
-            except (ImportError, AttributeError) as e:
-                print(f"Error: in configure_debug_session {e} for board {Architecture}")
+        # resolved from the session's own board, so that envs of different
+        # architectures can be configured concurrently by one process
+        board_config = debug_config.board_config
+        if not board_config:
+            return
+        arch = registry.resolve(board_config.id, board_config.get("architecture", ""))
+        if arch:
+            arch.configure_debug_session(self, debug_config)
+
+
+if profiling.enabled():
+    profiling.add_span("load platform.py", "platform", _load_started)
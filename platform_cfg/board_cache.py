@@ -0,0 +1,218 @@
+"""
+Lazy, cached expansion of the dynamic board options (debug tools and the
+upload protocols derived from them).
+
+A board's expansion runs only when its "debug" or "upload" section is first
+read. Board listings (get_brief_data()) take the debug tools from the cache
+when it has them, without expanding. The expanded sections are memoized in process and persisted to a cache
+file, which is invalidated by any change in boards/ or platform_cfg/. Each
+entry also records the mtime of the board's own manifest, so custom project
+boards are covered too. Expansions which look up an installed package are
+not persisted, the package may be installed or updated before the next run.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import sys
+import threading
+
+from platformio.compat import MISSING
+from platformio.platform.board import PlatformBoardConfig
+
+from platform_cfg import profiling
+
+EXPANDED_KEYS = ("debug", "upload")
+CACHE_VERSION = 2
+
+PLATFORM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WATCHED_DIRS = ("boards", "platform_cfg")
+
+_lock = threading.Lock()
+_caches = {}
+_local = threading.local()
+
+
+class LazyBoardConfig(PlatformBoardConfig):
+    """Board config which calls `expand(board)` before its expanded
+    sections (or the whole manifest) are used for the first time"""
+
+    def __init__(self, manifest_path, cache, expand):
+        super().__init__(manifest_path)
+        self._cache = cache
+        self._expand = expand
+        self._expanded = False
+        # other threads wait for the expansion, the expanding one reads
+        # the sections it is filling in
+        self._expand_lock = threading.RLock()
+
+    @property
+    def expanded(self):
+        return self._expanded
+
+    def expand(self):
+        if self._expanded:
+            return
+        with self._expand_lock:
+            expand, self._expand = self._expand, None
+            if expand is None:
+                return
+            try:
+                expand(self)
+            finally:
+                self._expanded = True
+
+    @property
+    def manifest(self):
+        self.expand()
+        return super().manifest
+
+    def get(self, path, default=MISSING):
+        if path.split(".", 1)[0] in EXPANDED_KEYS:
+            self.expand()
+        return super().get(path, default)
+
+    def update(self, path, value):
+        if path.split(".", 1)[0] in EXPANDED_KEYS:
+            self.expand()
+        super().update(path, value)
+
+    def get_debug_data(self):
+        # board listings only need the debug tool names and flags, a cached
+        # expansion answers them without running the architecture hooks
+        if not self._expanded:
+            sections = self._cache.lookup(self.manifest_path)
+            if sections is not None:
+                return get_debug_data(sections.get("debug", {}))
+        self.expand()
+        return super().get_debug_data()
+
+    def get_debug_tool_name(self, custom=None):
+        self.expand()
+        return super().get_debug_tool_name(custom)
+
+
+def get_debug_data(debug):
+    """PlatformBoardConfig.get_debug_data() of an expanded "debug" section"""
+    if not debug.get("tools"):
+        return None
+    tools = {}
+    for name, options in debug["tools"].items():
+        tools[name] = {
+            key: value
+            for key, value in options.items()
+            if key in ("default", "onboard") and value
+        }
+    return {"tools": tools}
+
+
+def get_platform_key():
+    """Changes with every file added to, removed from or modified in the
+    directories the expansion depends on"""
+    h = hashlib.sha1()
+    h.update(("%s|%s|%d" % (PLATFORM_DIR, sys.platform, CACHE_VERSION)).encode())
+    for name in WATCHED_DIRS:
+        path = os.path.join(PLATFORM_DIR, name)
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            if entry.name.endswith((".json", ".py")):
+                h.update(("%s|%d|" % (entry.name, entry.stat().st_mtime_ns)).encode())
+    return h.hexdigest()
+
+
+class BoardCache(object):
+    def __init__(self, path):
+        self.path = path
+        self.key = get_platform_key()
+        self.boards = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(path, encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("key") == self.key:
+                self.boards = data.get("boards", {})
+        except (OSError, ValueError):
+            pass
+
+    def lookup(self, manifest_path):
+        """Copy of the expanded sections of a board, or None"""
+        entry = self.boards.get(manifest_path)
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except OSError:
+            return None
+        if entry is None or entry.get("mtime") != mtime:
+            return None
+        # a JSON round trip copies much faster than copy.deepcopy()
+        return json.loads(json.dumps(entry["sections"]))
+
+    def store(self, manifest_path, sections):
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except OSError:
+            return
+        with self._lock:
+            self.boards[manifest_path] = dict(
+                mtime=mtime, sections=json.loads(json.dumps(sections))
+            )
+            # a listing expands every board, write them all at once
+            if not self._dirty:
+                self._dirty = True
+                atexit.register(self.save)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            data = json.dumps(dict(key=self.key, boards=self.boards))
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as fp:
+                fp.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+def get_cache(cache_dir):
+    """The cache of this platform in PlatformIO's cache directory, loaded
+    once per process"""
+    path = os.path.join(
+        cache_dir,
+        "seeedboards-%s.json" % hashlib.sha1(PLATFORM_DIR.encode()).hexdigest()[:10],
+    )
+    with _lock:
+        if path not in _caches:
+            _caches[path] = BoardCache(path)
+        return _caches[path]
+
+
+def note_package_lookup():
+    """Called by the platform's get_package_dir(), the expansion running on
+    this thread depends on which packages are installed"""
+    _local.package_lookup = True
+
+
+def expand_board(board, cache, expand):
+    """Fills in the expanded sections of `board`, from the cache if
+    possible, otherwise by calling `expand(board)` and caching its result"""
+    sections = cache.lookup(board.manifest_path)
+    if sections is not None:
+        board.manifest.update(sections)
+        return
+    _local.package_lookup = False
+    try:
+        with profiling.span("expand board %s" % board.id, "boards"):
+            expand(board)
+        uses_packages = _local.package_lookup
+    finally:
+        _local.package_lookup = False
+    if uses_packages:
+        return
+    cache.store(
+        board.manifest_path,
+        {k: board.manifest[k] for k in EXPANDED_KEYS if k in board.manifest},
+    )
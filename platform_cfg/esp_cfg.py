@@ -1,10 +1,24 @@
 
 
+import os
+
+from platformio.public import to_unix_path
+
+from platform_cfg import footprint
+
+RISCV_MCUS = ("esp32c2", "esp32c3", "esp32c6", "esp32h2", "esp32p4")
+XTENSA_MCUS = ("esp32", "esp32s2", "esp32s3")
+NON_DEBUG_UPLOAD_PROTOCOLS = ("esptool", "espota", "dfu", "custom")
+
+
 def configure_esp_default_packages(self, variables, targets):
     print("esp configure_default_packages")
 
     board_config = self.board_config(variables.get("board"))
     mcu = variables.get("board_build.mcu", board_config.get("build.mcu", "esp32"))
+
+    if footprint.minimal_mode():
+        return _configure_esp_minimal_packages(self, variables, targets, board_config, mcu)
     
     self.packages["framework-arduinoespressif32"]["optional"] = False
     self.packages["esp32-arduino-libs"]["optional"] = False
@@ -44,6 +58,65 @@ def configure_esp_default_packages(self, variables, targets):
 
 
 
+def _configure_esp_minimal_packages(self, variables, targets, board_config, mcu):
+    """Only the packages the targets, the MCU and the frameworks need"""
+    selection = footprint.get_selection(self)
+    frameworks = variables.get("pioframework", [])
+    building = "nobuild" not in targets
+
+    if building:
+        # esptool.py converts the ELF into the flash image of every build
+        selection.require("tool-esptoolpy", "elf2image for %s" % mcu)
+        if mcu in XTENSA_MCUS:
+            selection.require("toolchain-xtensa-esp-elf", "compiler for %s (Xtensa)" % mcu)
+        else:
+            selection.require("toolchain-riscv32-esp", "compiler for %s (RISC-V)" % mcu)
+        if mcu in ("esp32s2", "esp32s3"):
+            selection.require("toolchain-riscv32-esp", "ULP coprocessor of %s" % mcu)
+        if "arduino" in frameworks:
+            selection.require("framework-arduinoespressif32", "framework arduino")
+            selection.require("esp32-arduino-libs", "precompiled IDF libraries of framework arduino")
+        if "espidf" in frameworks:
+            for name in ("tool-cmake", "tool-ninja"):
+                selection.require(name, "build system of framework espidf")
+        if footprint.has_target(targets, footprint.FS_TARGETS):
+            filesystem = board_config.get("build.filesystem", "littlefs")
+            selection.require("tool-mk%s" % filesystem, "%s image for the filesystem target" % filesystem)
+
+    debug_tool = variables.get("debug_tool", board_config.get("debug.default_tool", ""))
+    upload_protocol = variables.get(
+        "upload_protocol", board_config.get("upload.protocol", "esptool")
+    )
+    if footprint.has_target(targets, footprint.UPLOAD_TARGETS):
+        if upload_protocol == "esptool":
+            selection.require("tool-esptoolpy", "upload_protocol = esptool")
+        elif upload_protocol == "dfu":
+            selection.require("tool-dfuutil-arduino", "upload_protocol = dfu")
+        elif upload_protocol not in NON_DEBUG_UPLOAD_PROTOCOLS:
+            selection.require("tool-openocd-esp32", "upload_protocol = %s" % upload_protocol)
+
+    gdb_package = "tool-riscv32-esp-elf-gdb" if mcu in RISCV_MCUS else "tool-xtensa-esp-elf-gdb"
+    if footprint.has_target(targets, footprint.DEBUG_TARGETS):
+        selection.require(gdb_package, "debugger for %s" % mcu)
+        if debug_tool not in NON_DEBUG_UPLOAD_PROTOCOLS:
+            selection.require("tool-openocd-esp32", "debug server for %s" % (debug_tool or "the default debug tool"))
+
+    check_tool = str(variables.get("check_tool")).strip("['']")
+    for name in ("tool-cppcheck", "tool-clangtidy", "tool-pvs-studio"):
+        if check_tool and check_tool in name:
+            selection.require(name, "check_tool = %s" % check_tool)
+
+    for name in ("tool-xtensa-esp-elf-gdb", "tool-riscv32-esp-elf-gdb"):
+        selection.drop(name, "not debugging" if name == gdb_package else "other CPU architecture than %s" % mcu)
+    selection.drop("tool-openocd-esp32", "no debug or JTAG upload target")
+    if "arduino" not in frameworks:
+        selection.drop("esp32-arduino-libs", "framework arduino is not used")
+    if mcu not in XTENSA_MCUS:
+        self.packages.pop("toolchain-xtensa-esp-elf", None)
+    if mcu in RISCV_MCUS:
+        self.packages.pop("toolchain-esp32ulp", None)
+
+
 def _add_esp_default_debug_tools(self, board):
     # print("in _add_default_esp_debug_tools")
     # upload protocols
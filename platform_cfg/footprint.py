@@ -0,0 +1,143 @@
+"""
+Minimal package resolution and the package footprint report.
+
+With SEEED_PIO_MINIMAL_PACKAGES=1 the architecture configs that support it
+only require the packages the requested targets, the board MCU and the
+frameworks actually use. The footprint report lists every required package,
+its size on disk and why it was selected. It is printed after each
+configure_*_default_packages() in minimal mode, or with
+SEEED_PIO_PACKAGE_REPORT=1 alone.
+"""
+
+import os
+
+MINIMAL_ENV = "SEEED_PIO_MINIMAL_PACKAGES"
+REPORT_ENV = "SEEED_PIO_PACKAGE_REPORT"
+
+# targets which only need the uploaders, see PlatformBase.configure_default_packages()
+UPLOAD_TARGETS = ("upload", "uploadfs", "uploadfsota", "program")
+DEBUG_TARGETS = ("__debug",)
+FS_TARGETS = ("buildfs", "uploadfs", "uploadfsota")
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def minimal_mode():
+    return _env_flag(MINIMAL_ENV)
+
+
+def report_enabled():
+    return minimal_mode() or _env_flag(REPORT_ENV)
+
+
+def has_target(targets, names):
+    return any(t in names for t in targets)
+
+
+class PackageSelection(object):
+    """Requires and drops packages of a platform and records why"""
+
+    def __init__(self, platform):
+        self.platform = platform
+        self.reasons = {}
+        self.dropped = {}
+
+    def require(self, name, reason):
+        if name not in self.platform.packages:
+            return
+        self.platform.packages[name]["optional"] = False
+        self.dropped.pop(name, None)
+        self.reasons.setdefault(name, [])
+        if reason not in self.reasons[name]:
+            self.reasons[name].append(reason)
+
+    def drop(self, name, reason):
+        if name not in self.platform.packages or name in self.reasons:
+            return
+        self.platform.packages[name]["optional"] = True
+        self.dropped[name] = reason
+
+
+def drop_unselected_uploaders(platform):
+    """PlatformBase enables every uploader for upload targets, a minimal
+    selection keeps only the ones it asked for"""
+    selection = get_selection(platform)
+    if not selection.reasons:
+        return
+    for name, options in platform.packages.items():
+        if options.get("type") == "uploader":
+            selection.drop(name, "uploader of another board family")
+
+
+def get_selection(platform):
+    """The selection of a platform instance, one per configured env"""
+    selection = getattr(platform, "_package_selection", None)
+    if selection is None:
+        selection = PackageSelection(platform)
+        platform._package_selection = selection
+    return selection
+
+
+def get_dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return "%d %s" % (size, unit) if unit == "B" else "%.1f %s" % (size, unit)
+        size /= 1024.0
+    return "%.2f GB" % size
+
+
+def _default_reason(platform, name, options, architecture, targets):
+    for framework, opts in (platform.frameworks or {}).items():
+        if opts.get("package") == name:
+            return "framework %s" % framework
+    if options.get("type") == "uploader" and has_target(targets, UPLOAD_TARGETS):
+        return "uploader for the upload target"
+    return "required by the %s defaults" % architecture
+
+
+def print_report(platform, board, architecture, targets):
+    selection = get_selection(platform)
+    rows = []
+    total = 0
+    for name, options in sorted(platform.packages.items()):
+        if options.get("optional"):
+            continue
+        reasons = selection.reasons.get(name) or [
+            _default_reason(platform, name, options, architecture, targets)
+        ]
+        try:
+            path = platform.get_package_dir(name)
+        except Exception:  # pylint: disable=broad-except
+            path = None
+        if path and os.path.isdir(path):
+            size = get_dir_size(path)
+            total += size
+            size_str = format_size(size)
+        else:
+            size_str = "not installed"
+        rows.append((name, size_str, "; ".join(reasons)))
+
+    mode = "minimal" if minimal_mode() else "default"
+    print(
+        "Package footprint of %s (%s, %s mode, targets: %s)"
+        % (board, architecture, mode, ", ".join(targets) or "build")
+    )
+    width = max([len(r[0]) for r in rows] + [7])
+    for name, size_str, reason in rows:
+        print("  %s  %12s  %s" % (name.ljust(width), size_str, reason))
+    print("  %s  %12s" % ("total".ljust(width), format_size(total)))
+    for name, reason in sorted(selection.dropped.items()):
+        print("  skipped %s: %s" % (name, reason))
@@ -0,0 +1,239 @@
+"""
+Opt-in timing of the platform and of the build script phases.
+
+Enabled with SEEED_PIO_PROFILE=1. Spans are recorded for the platform load,
+the architecture cfg imports, package resolution and directory lookups, every
+SConscript evaluated by the builder, and the subprocess / exec_command calls
+made by the platform and its build scripts.
+
+`pio run` configures the packages in its own process and then runs SCons in a
+child process. The parent flushes the spans of each env into the project build
+directory, and the child merges them into its report when the build ends and
+removes the file:
+
+    <build_dir>/<env>/seeedboards-profile.json  Chrome trace events, open in
+                                                chrome://tracing or Perfetto
+    <build_dir>/<env>/seeedboards-profile.txt   spans summed up by name, slowest first
+"""
+
+import atexit
+import json
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILE_ENV = "SEEED_PIO_PROFILE"
+TRACE_NAME = "seeedboards-profile.json"
+SUMMARY_NAME = "seeedboards-profile.txt"
+PARENT_TRACE_NAME = ".seeedboards-profile-%d.json"
+
+SUBPROCESS_FUNCTIONS = ("run", "call", "check_call", "check_output")
+
+_lock = threading.Lock()
+_local = threading.local()
+_events = []
+_installed = set()
+
+
+def enabled():
+    return os.environ.get(PROFILE_ENV, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _now_us():
+    # wall clock, so that the spans of the pio and SCons processes line up
+    return time.time() * 1e6
+
+
+def add_span(name, category, start_us, end_us=None, args=None):
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": start_us,
+        "dur": (end_us or _now_us()) - start_us,
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+    }
+    if args:
+        event["args"] = args
+    with _lock:
+        _events.append(event)
+
+
+@contextmanager
+def _span(name, category, args):
+    start = _now_us()
+    try:
+        yield
+    finally:
+        add_span(name, category, start, args=args)
+
+
+@contextmanager
+def _nothing():
+    yield
+
+
+def span(name, category, args=None):
+    """Context manager recording the time spent in its block"""
+    if not enabled():
+        return _nothing()
+    return _span(name, category, args)
+
+
+def _command_name(cmd):
+    if isinstance(cmd, (list, tuple)):
+        cmd = " ".join(str(c) for c in cmd)
+    cmd = str(cmd)
+    return cmd if len(cmd) <= 120 else cmd[:117] + "..."
+
+
+def _is_scons_run(cmd):
+    # PlatformIO runs the build of an env through exec_command(), after the
+    # spans of that env were flushed. The SCons process reports the build
+    return isinstance(cmd, (list, tuple)) and any(
+        os.path.basename(str(c)) == "scons.py" for c in cmd
+    )
+
+
+def _wrap_command(func, label):
+    def wrapper(*args, **kwargs):
+        cmd = args[0] if args else kwargs.get("args", "")
+        # check_output() & co. call run(), only the outer call is recorded
+        if getattr(_local, "in_command", False) or _is_scons_run(cmd):
+            return func(*args, **kwargs)
+        _local.in_command = True
+        try:
+            with _span(_command_name(cmd), "subprocess", {"function": label}):
+                return func(*args, **kwargs)
+        finally:
+            _local.in_command = False
+
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def install_process_hooks():
+    """Records the subprocess and exec_command calls of this process"""
+    with _lock:
+        if "process" in _installed:
+            return
+        _installed.add("process")
+    for name in SUBPROCESS_FUNCTIONS:
+        setattr(subprocess, name, _wrap_command(getattr(subprocess, name), "subprocess." + name))
+    try:
+        from platformio import proc
+    except ImportError:
+        return
+    # build scripts import exec_command when their SConscript runs, which
+    # is after this
+    proc.exec_command = _wrap_command(proc.exec_command, "exec_command")
+
+
+def install_build_hooks(env):
+    """Records every SConscript evaluated with `env` or its clones, and
+    writes the report into $BUILD_DIR when SCons exits"""
+    install_process_hooks()
+    with _lock:
+        if "build" in _installed:
+            return
+        _installed.add("build")
+
+    # the global SConscript() calls the method of the default environment
+    env_class = type(env)
+    sconscript = env_class.SConscript
+
+    def SConscript(self, *args, **kwargs):
+        script = args[0] if args else kwargs.get("dirs", "")
+        if isinstance(script, (list, tuple)):
+            script = ", ".join(str(s) for s in script)
+        with _span(str(script), "sconscript", None):
+            return sconscript(self, *args, **kwargs)
+
+    env_class.SConscript = SConscript
+
+    started = _now_us()
+    build_dir = env.subst("$BUILD_DIR")
+    parent_trace = os.path.join(
+        env.subst("$PROJECT_BUILD_DIR"), PARENT_TRACE_NAME % os.getppid()
+    )
+
+    def finish():
+        add_span("SCons build of %s" % env.subst("$PIOENV"), "build", started)
+        write_report(build_dir, parent_trace)
+        try:
+            os.remove(parent_trace)
+        except OSError:
+            pass
+
+    atexit.register(finish)
+
+
+def flush_parent_trace(project_build_dir, env_started):
+    """Saves the spans of the `pio` process for the SCons process to merge.
+    Each env of a `pio run` gets the spans recorded since the previous env
+    was flushed which started at `env_started` or later, the ones before
+    belong to the previous env, whose SCons process is already gone"""
+    with _lock:
+        events = [e for e in _events if e["ts"] >= env_started]
+        del _events[:]
+    path = os.path.join(project_build_dir, PARENT_TRACE_NAME % os.getpid())
+    try:
+        os.makedirs(project_build_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fp:
+            json.dump(events, fp)
+    except OSError:
+        pass
+
+
+def _load_events(path):
+    try:
+        with open(path, encoding="utf-8") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return []
+
+
+def format_summary(events):
+    totals = {}
+    for event in events:
+        key = (event["cat"], event["name"])
+        count, total, longest = totals.get(key, (0, 0.0, 0.0))
+        totals[key] = (count + 1, total + event["dur"], max(longest, event["dur"]))
+
+    lines = ["%10s  %10s  %6s  %-12s  %s" % ("total ms", "max ms", "calls", "category", "span")]
+    for (category, name), (count, total, longest) in sorted(
+        totals.items(), key=lambda item: -item[1][1]
+    ):
+        lines.append(
+            "%10.1f  %10.1f  %6d  %-12s  %s"
+            % (total / 1000, longest / 1000, count, category, name)
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write_report(build_dir, parent_trace=None):
+    with _lock:
+        events = list(_events)
+    if parent_trace:
+        events = _load_events(parent_trace) + events
+    if not events:
+        return
+    processes = {}
+    for event in events:
+        processes.setdefault(event["pid"], "pio" if event["pid"] != os.getpid() else "scons")
+    metadata = [
+        {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}}
+        for pid, name in processes.items()
+    ]
+    try:
+        os.makedirs(build_dir, exist_ok=True)
+        with open(os.path.join(build_dir, TRACE_NAME), "w", encoding="utf-8") as fp:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, fp)
+        with open(os.path.join(build_dir, SUMMARY_NAME), "w", encoding="utf-8") as fp:
+            fp.write(format_summary(events))
+    except OSError:
+        return
+    print("Profile written to %s" % os.path.join(build_dir, TRACE_NAME))
@@ -0,0 +1,113 @@
+"""
+Board -> architecture registry shared by platform.py and builder/main.py.
+
+Built once per process from boards/*.json. A manifest names its architecture
+with an "architecture" field; manifests without one (e.g. custom boards of a
+project) are matched by their board id.
+"""
+
+import json
+import os
+import threading
+from collections import namedtuple
+from importlib import import_module
+
+from platform_cfg import profiling
+
+ARCHITECTURES = ("esp", "renesas", "rpi", "nrf", "samd", "siliconlab")
+
+# fallback for manifests without an "architecture" field
+BOARD_IDS = {
+    "seeed-xiao-ra4m1": "renesas",
+    "seeed-xiao-rp2040": "rpi",
+    "seeed-xiao-rp2350": "rpi",
+}
+BOARD_ID_PATTERNS = (
+    ("mg24", "siliconlab"),
+    ("samd", "samd"),
+    ("nrf", "nrf"),
+    ("esp32", "esp"),
+)
+
+BOARDS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "boards")
+
+ArchitectureConfig = namedtuple(
+    "ArchitectureConfig",
+    [
+        "name",
+        "module",
+        "builder_script",
+        "configure_default_packages",
+        "add_default_debug_tools",
+        "configure_debug_session",
+    ],
+)
+
+_lock = threading.Lock()
+_architectures = {}
+_boards = None
+
+
+def get_architecture(name):
+    """The ArchitectureConfig of an architecture, its cfg module is imported once"""
+    config = _architectures.get(name)
+    if config is not None or name not in ARCHITECTURES:
+        return config
+    with _lock:
+        if name not in _architectures:
+            with profiling.span("import platform_cfg.%s_cfg" % name, "platform"):
+                module = import_module("platform_cfg.%s_cfg" % name)
+            _architectures[name] = ArchitectureConfig(
+                name,
+                module,
+                "board_build/%s/%s_build.py" % (name, name),
+                getattr(module, "configure_%s_default_packages" % name),
+                getattr(module, "_add_%s_default_debug_tools" % name),
+                getattr(module, "configure_%s_debug_session" % name),
+            )
+    return _architectures[name]
+
+
+def match_board_id(board_id):
+    if board_id in BOARD_IDS:
+        return BOARD_IDS[board_id]
+    for pattern, name in BOARD_ID_PATTERNS:
+        if pattern in board_id:
+            return name
+    return None
+
+
+def _load_boards():
+    boards = {}
+    for filename in sorted(os.listdir(BOARDS_DIR)):
+        if not filename.endswith(".json"):
+            continue
+        board_id = filename[:-5]
+        with open(os.path.join(BOARDS_DIR, filename), encoding="utf-8") as fp:
+            name = json.load(fp).get("architecture") or match_board_id(board_id)
+        if name:
+            boards[board_id] = get_architecture(name)
+    return boards
+
+
+def get_boards():
+    """board id -> ArchitectureConfig for all boards of the platform"""
+    global _boards
+    if _boards is None:
+        boards = _load_boards()
+        with _lock:
+            if _boards is None:
+                _boards = boards
+    return _boards
+
+
+def resolve(board_id, architecture=None):
+    """ArchitectureConfig of a board, or None for unsupported boards.
+    `architecture` is the field of the board's manifest, if there is one."""
+    if architecture:
+        return get_architecture(architecture)
+    config = get_boards().get(board_id)
+    if config is None:
+        name = match_board_id(board_id)
+        config = get_architecture(name) if name else None
+    return config
@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@file hex_image.py
+@brief Sparse firmware images: Intel HEX / binary / UF2 reading, merging and writing.
+@details An image is a sorted list of non-overlapping contiguous (address, bytearray)
+         segments. Records are decoded with bytes.fromhex() and appended to the
+         current segment while they are contiguous, instead of storing every byte
+         in a dict like IntelHex does. Used by the nRF build (MergeHex) and the
+         nRF54L15 recovery script; can also be run to convert or merge images.
+@example python hex_image.py merge -o merged.hex softdevice.hex application.hex
+@example python hex_image.py convert firmware.hex firmware.uf2 --family-id 0xADA52840
+@example python hex_image.py benchmark --size 4
+"""
+
+import argparse
+import bisect
+import logging
+import os
+import struct
+import sys
+import time
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:  # optional, only makes parsing and writing faster
+    numpy = None
+
+logger = logging.getLogger("hex_image")
+
+## @brief Intel HEX record types
+RECORD_DATA = 0x00
+RECORD_EOF = 0x01
+RECORD_EXTENDED_SEGMENT = 0x02
+RECORD_START_SEGMENT = 0x03
+RECORD_EXTENDED_LINEAR = 0x04
+RECORD_START_LINEAR = 0x05
+
+HEX_RECORD_SIZE = 16  # Data bytes per record, the same as srec_cat --line-length=44
+ERASED_BYTE = 0xFF
+
+## @brief UF2 block layout, see https://github.com/microsoft/uf2
+UF2_MAGIC_START0 = 0x0A324655
+UF2_MAGIC_START1 = 0x9E5D5157
+UF2_MAGIC_END = 0x0AB16F30
+UF2_FLAG_FAMILY_ID = 0x00002000
+UF2_PAYLOAD_SIZE = 256
+UF2_DATA_SIZE = 476
+
+
+class HexImageError(ValueError):
+    """
+    @brief Malformed input or overlapping data.
+    """
+
+
+class HexImage(object):
+    """
+    @brief Sparse memory image made of contiguous segments.
+    """
+
+    def __init__(self):
+        self.segments: List[Tuple[int, bytearray]] = []
+        self.start_segment: Optional[int] = None  # CS:IP of a type 03 record
+        self.start_linear: Optional[int] = None   # EIP of a type 05 record
+
+    @classmethod
+    def from_hex(cls, text: str) -> "HexImage":
+        """
+        @brief Parse Intel HEX text.
+        @details All records are decoded by a single bytes.fromhex() call (which skips
+                 the line breaks), then validated and sliced in bulk with NumPy when
+                 it is installed, or record by record otherwise.
+        @param text Contents of a .hex file.
+        @return The parsed image.
+        """
+        try:
+            blob = bytes.fromhex(text.replace(":", " "))
+            offsets = _record_offsets(blob)
+        except ValueError:
+            offsets = None
+        if offsets is None or text.count(":") != len(offsets):
+            # Malformed somewhere, find the line to report
+            _check_hex_lines(text)
+            raise HexImageError("Malformed Intel HEX data")
+
+        image = cls()
+        if numpy is not None:
+            pieces = image._parse_records_numpy(blob, offsets)
+        else:
+            pieces = image._parse_records(blob, offsets)
+
+        for start, data in sorted(pieces, key=lambda piece: piece[0]):
+            if image.segments:
+                last_start, last = image.segments[-1]
+                if start < last_start + len(last):
+                    raise HexImageError(f"Data overlaps at 0x{start:08X}")
+                if start == last_start + len(last):
+                    last += data
+                    continue
+            image.segments.append((start, data))
+        return image
+
+    def _parse_control_record(self, record: bytes, base: int) -> int:
+        """
+        @brief Handle a non-data record, returns the new address base.
+        """
+        record_type = record[3]
+        if record_type == RECORD_EXTENDED_SEGMENT:
+            return int.from_bytes(record[4:6], "big") << 4
+        if record_type == RECORD_EXTENDED_LINEAR:
+            return int.from_bytes(record[4:6], "big") << 16
+        if record_type == RECORD_START_SEGMENT:
+            self.start_segment = int.from_bytes(record[4:8], "big")
+        elif record_type == RECORD_START_LINEAR:
+            self.start_linear = int.from_bytes(record[4:8], "big")
+        elif record_type != RECORD_EOF:
+            raise HexImageError(f"Unknown record type {record_type:02X}")
+        return base
+
+    def _parse_records(self, blob: bytes, offsets: List[int]) -> List[Tuple[int, bytearray]]:
+        pieces = []
+        base = 0
+        current_start = None
+        current = None
+        for index, offset in enumerate(offsets):
+            record = blob[offset:offset + blob[offset] + 5]
+            if sum(record) & 0xFF:
+                raise HexImageError(f"Record {index + 1}: checksum mismatch")
+            record_type = record[3]
+            if record_type == RECORD_DATA:
+                addr = base + (record[1] << 8 | record[2])
+                if current is not None and addr == current_start + len(current):
+                    current += record[4:-1]
+                elif record[0]:
+                    current_start, current = addr, bytearray(record[4:-1])
+                    pieces.append((current_start, current))
+                continue
+            if record_type == RECORD_EOF:
+                break
+            base = self._parse_control_record(record, base)
+        return pieces
+
+    def _parse_records_numpy(self, blob: bytes, offsets: List[int]) -> List[Tuple[int, bytearray]]:
+        raw = numpy.frombuffer(blob, dtype=numpy.uint8)
+        starts = numpy.fromiter(offsets, dtype=numpy.int64, count=len(offsets))
+        sums = numpy.add.reduceat(raw, starts, dtype=numpy.uint8)  # modulo 256
+        if sums.any():
+            raise HexImageError(f"Record {int(numpy.flatnonzero(sums)[0]) + 1}: checksum mismatch")
+
+        lengths = raw[starts].astype(numpy.int64)
+        types = raw[starts + 3]
+        eof = numpy.flatnonzero(types == RECORD_EOF)
+        count = int(eof[0]) if len(eof) else len(offsets)
+
+        # Address base of every record, set by the (few) extended address records
+        bases = numpy.zeros(count, dtype=numpy.int64)
+        base = 0
+        for index in numpy.flatnonzero(types[:count] != RECORD_DATA):
+            offset = offsets[index]
+            base = self._parse_control_record(blob[offset:offset + blob[offset] + 5], base)
+            bases[index + 1:] = base
+
+        is_data = (types[:count] == RECORD_DATA) & (lengths[:count] > 0)
+        data_starts = starts[:count][is_data]
+        data_lengths = lengths[:count][is_data]
+        addrs = bases[is_data] + (raw[data_starts + 1].astype(numpy.int64) << 8) + raw[data_starts + 2]
+        if not len(addrs):
+            return []
+
+        # Gather all data bytes at once: drop headers, checksums and control records
+        keep = numpy.ones(len(raw), dtype=bool)
+        for index in numpy.flatnonzero(~is_data[:count]).tolist() + list(range(count, len(offsets))):
+            keep[offsets[index]:offsets[index] + blob[offsets[index]] + 5] = False
+        for i in range(4):
+            keep[data_starts + i] = False
+        keep[data_starts + data_lengths + 4] = False
+        data = raw[keep].tobytes()
+        ends = numpy.cumsum(data_lengths)
+        breaks = numpy.flatnonzero(addrs[1:] != addrs[:-1] + data_lengths[:-1]) + 1
+        run_starts = [0] + breaks.tolist()
+        run_ends = breaks.tolist() + [len(addrs)]
+        byte_ends = [0] + ends.tolist()
+        return [
+            (int(addrs[first]), bytearray(data[byte_ends[first]:byte_ends[last]]))
+            for first, last in zip(run_starts, run_ends)
+        ]
+
+    @classmethod
+    def from_hex_file(cls, path: str) -> "HexImage":
+        with open(path, "r", encoding="ascii") as fp:
+            return cls.from_hex(fp.read())
+
+    @classmethod
+    def from_bin(cls, data: bytes, offset: int = 0) -> "HexImage":
+        image = cls()
+        if data:
+            image.segments.append((offset, bytearray(data)))
+        return image
+
+    @property
+    def size(self) -> int:
+        """
+        @brief Number of bytes with data (gaps excluded).
+        """
+        return sum(len(data) for _, data in self.segments)
+
+    @property
+    def min_address(self) -> Optional[int]:
+        return self.segments[0][0] if self.segments else None
+
+    @property
+    def max_address(self) -> Optional[int]:
+        """
+        @brief Address right after the last byte with data.
+        """
+        if not self.segments:
+            return None
+        start, data = self.segments[-1]
+        return start + len(data)
+
+    def add(self, addr: int, data: bytes, overwrite: bool = False):
+        """
+        @brief Add data, merging it with adjacent segments.
+        @param addr Start address.
+        @param data Bytes to add.
+        @param overwrite Replace existing data instead of raising HexImageError on overlaps.
+        """
+        if not data:
+            return
+        end = addr + len(data)
+        starts = [start for start, _ in self.segments]
+        # the segments touching or overlapping [addr, end]
+        first = bisect.bisect_left(starts, addr)
+        if first > 0 and self.segments[first - 1][0] + len(self.segments[first - 1][1]) >= addr:
+            first -= 1
+        last = bisect.bisect_right(starts, end)
+        touched = self.segments[first:last]
+
+        if not overwrite:
+            for start, existing in touched:
+                if start < end and addr < start + len(existing):
+                    lo = max(start, addr)
+                    raise HexImageError(f"Data overlaps at 0x{lo:08X}")
+
+        if not touched:
+            self.segments.insert(first, (addr, bytearray(data)))
+            return
+        new_start = min(addr, touched[0][0])
+        new_end = max(end, touched[-1][0] + len(touched[-1][1]))
+        if len(touched) == 1 and touched[0][0] == new_start and not overwrite:
+            # appending to one segment, the common case while parsing
+            buf = touched[0][1]
+            buf[addr - new_start:] = data
+            return
+        buf = bytearray([ERASED_BYTE]) * (new_end - new_start)
+        for start, existing in touched:
+            buf[start - new_start:start - new_start + len(existing)] = existing
+        buf[addr - new_start:end - new_start] = data
+        self.segments[first:last] = [(new_start, buf)]
+
+    def merge(self, other: "HexImage", overwrite: bool = False) -> "HexImage":
+        """
+        @brief Add all data of another image (like srec_cat with several inputs).
+        @param other Image to merge into this one.
+        @param overwrite Let `other` win on overlaps instead of raising HexImageError.
+        @return self
+        """
+        for start, data in other.segments:
+            self.add(start, data, overwrite)
+        if self.start_linear is None:
+            self.start_linear = other.start_linear
+        if self.start_segment is None:
+            self.start_segment = other.start_segment
+        return self
+
+    def clip(self, start: int, end: int) -> "HexImage":
+        """
+        @brief Copy of the data inside [start, end).
+        """
+        image = HexImage()
+        for seg_start, data in self.segments:
+            lo, hi = max(seg_start, start), min(seg_start + len(data), end)
+            if lo < hi:
+                image.segments.append((lo, data[lo - seg_start:hi - seg_start]))
+        return image
+
+    def split(self, regions: Iterable[Tuple[int, int]]) -> List["HexImage"]:
+        """
+        @brief Split the image by memory regions.
+        @param regions List of [start, end) address ranges.
+        @return One image per region, in the same order.
+        """
+        return [self.clip(start, end) for start, end in regions]
+
+    def fill(self, start: int, end: int, value: int = ERASED_BYTE):
+        """
+        @brief Fill the gaps inside [start, end) with a byte value.
+        """
+        gaps = []
+        position = start
+        for seg_start, data in self.segments:
+            seg_end = seg_start + len(data)
+            if seg_end <= position:
+                continue
+            if seg_start >= end:
+                break
+            if seg_start > position:
+                gaps.append((position, seg_start))
+            position = seg_end
+        if position < end:
+            gaps.append((position, end))
+        for gap_start, gap_end in gaps:
+            self.add(gap_start, bytes([value]) * (gap_end - gap_start))
+
+    def to_bin(self, start: Optional[int] = None, end: Optional[int] = None,
+               fill: int = ERASED_BYTE) -> bytes:
+        """
+        @brief Flat binary of [start, end), gaps filled with `fill`.
+        @param start Defaults to the lowest address with data.
+        @param end Defaults to the address after the last byte with data.
+        """
+        if not self.segments:
+            return b""
+        start = self.min_address if start is None else start
+        end = self.max_address if end is None else end
+        buf = bytearray([fill]) * (end - start)
+        for seg_start, data in self.segments:
+            lo, hi = max(seg_start, start), min(seg_start + len(data), end)
+            if lo < hi:
+                buf[lo - start:hi - start] = data[lo - seg_start:hi - seg_start]
+        return bytes(buf)
+
+    def to_hex(self, record_size: int = HEX_RECORD_SIZE) -> str:
+        """
+        @brief Intel HEX text with extended linear address records.
+        """
+        lines = []
+        for seg_start, data in self.segments:
+            offset = 0
+            while offset < len(data):
+                # one 64 KB bank at a time, records never cross its boundary
+                addr = seg_start + offset
+                size = min(len(data) - offset, 0x10000 - (addr & 0xFFFF))
+                lines.append(_hex_record(RECORD_EXTENDED_LINEAR, 0, (addr >> 16).to_bytes(2, "big")))
+                lines.append(_hex_data_records(addr & 0xFFFF, data[offset:offset + size], record_size))
+                offset += size
+        if self.start_segment is not None:
+            lines.append(_hex_record(RECORD_START_SEGMENT, 0, self.start_segment.to_bytes(4, "big")))
+        if self.start_linear is not None:
+            lines.append(_hex_record(RECORD_START_LINEAR, 0, self.start_linear.to_bytes(4, "big")))
+        lines.append(_hex_record(RECORD_EOF, 0, b""))
+        return "\n".join(lines) + "\n"
+
+    def write_hex(self, path: str, record_size: int = HEX_RECORD_SIZE):
+        with open(path, "w", encoding="ascii") as fp:
+            fp.write(self.to_hex(record_size))
+
+    def to_uf2(self, family_id: Optional[int] = None) -> bytes:
+        """
+        @brief UF2 file with one block per 256-byte aligned chunk of data.
+        @param family_id UF2 family ID, or None to leave the field unset.
+        """
+        chunks = []
+        for seg_start, data in self.segments:
+            offset = 0
+            while offset < len(data):
+                addr = seg_start + offset
+                size = min(UF2_PAYLOAD_SIZE - addr % UF2_PAYLOAD_SIZE, len(data) - offset)
+                chunks.append((addr, data[offset:offset + size]))
+                offset += size
+        blocks = []
+        flags = UF2_FLAG_FAMILY_ID if family_id is not None else 0
+        for number, (addr, payload) in enumerate(chunks):
+            header = struct.pack(
+                "<8I", UF2_MAGIC_START0, UF2_MAGIC_START1, flags, addr, len(payload),
+                number, len(chunks), family_id or 0,
+            )
+            blocks.append(header + bytes(payload).ljust(UF2_DATA_SIZE, b"\x00")
+                          + struct.pack("<I", UF2_MAGIC_END))
+        return b"".join(blocks)
+
+
+def _record_offsets(blob: bytes) -> Optional[List[int]]:
+    """
+    @brief Offsets of the records in decoded HEX data, None if they do not add up.
+    """
+    offsets = []
+    offset = 0
+    size = len(blob)
+    while offset < size:
+        offsets.append(offset)
+        offset += blob[offset] + 5
+    return offsets if offset == size else None
+
+
+def _check_hex_lines(text: str):
+    """
+    @brief Raise HexImageError naming the first malformed line.
+    """
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != ":":
+            raise HexImageError(f"Line {number}: not an Intel HEX record")
+        try:
+            record = bytes.fromhex(line[1:])
+        except ValueError:
+            raise HexImageError(f"Line {number}: invalid hex digits") from None
+        if len(record) < 5 or len(record) != record[0] + 5:
+            raise HexImageError(f"Line {number}: invalid record length")
+
+
+def _hex_record(record_type: int, addr: int, data: bytes) -> str:
+    record = bytes([len(data), addr >> 8, addr & 0xFF, record_type]) + bytes(data)
+    return ":%s%02X" % (record.hex().upper(), -sum(record) & 0xFF)
+
+
+def _hex_data_records(addr: int, data: bytes, record_size: int) -> str:
+    """
+    @brief Data records for `data` at 16-bit address `addr`, joined by line breaks.
+    """
+    count = len(data) // record_size
+    if numpy is None or count < 2:
+        return "\n".join(
+            _hex_record(RECORD_DATA, addr + offset, data[offset:offset + record_size])
+            for offset in range(0, len(data), record_size)
+        )
+
+    # Build all full records as rows of one array, then hex them in a single call
+    records = numpy.zeros((count, record_size + 5), dtype=numpy.uint8)
+    addrs = addr + record_size * numpy.arange(count)
+    records[:, 0] = record_size
+    records[:, 1] = addrs >> 8
+    records[:, 2] = addrs & 0xFF
+    records[:, 4:-1] = numpy.frombuffer(bytes(data[:count * record_size]), dtype=numpy.uint8).reshape(count, record_size)
+    records[:, -1] = -records[:, :-1].sum(axis=1, dtype=numpy.uint8)
+    text = ":" + records.tobytes().hex(":", record_size + 5).upper().replace(":", "\n:")
+    rest = len(data) - count * record_size
+    if rest:
+        text += "\n" + _hex_record(RECORD_DATA, addr + count * record_size, data[-rest:])
+    return text
+
+
+def load_image(path: str, offset: int = 0) -> HexImage:
+    """
+    @brief Load a .hex file, or any other file as a binary placed at `offset`.
+    """
+    if path.lower().endswith((".hex", ".ihex")):
+        return HexImage.from_hex_file(path)
+    with open(path, "rb") as fp:
+        return HexImage.from_bin(fp.read(), offset)
+
+
+def save_image(image: HexImage, path: str, family_id: Optional[int] = None):
+    """
+    @brief Save an image, the format is chosen by the extension (.hex, .uf2 or binary).
+    """
+    lower = path.lower()
+    if lower.endswith((".hex", ".ihex")):
+        image.write_hex(path)
+        return
+    with open(path, "wb") as fp:
+        fp.write(image.to_uf2(family_id) if lower.endswith(".uf2") else image.to_bin())
+
+
+def benchmark(size_mb: float):
+    """
+    @brief Compare parsing and writing a synthetic multi-megabyte image with IntelHex.
+    """
+    from intelhex import IntelHex  # only needed for the comparison
+
+    size = int(size_mb * 1024 * 1024)
+    image = HexImage()
+    # a few segments with gaps, like application + bootloader + settings
+    image.add(0x00000000, os.urandom(size // 2))
+    image.add(0x01000000, os.urandom(size // 4))
+    image.add(0x10000000, os.urandom(size - size // 2 - size // 4))
+    image.start_linear = 0x00000101
+    text = image.to_hex()
+    logger.info(f"Synthetic image: {image.size / 1e6:.1f} MB of data, {len(text) / 1e6:.1f} MB of HEX text.")
+
+    tmp_path = "hex_image_benchmark.hex"
+    with open(tmp_path, "w") as fp:
+        fp.write(text)
+    try:
+        started = time.perf_counter()
+        parsed = HexImage.from_hex_file(tmp_path)
+        parse_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        ih = IntelHex(tmp_path)
+        ih_parse_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        parsed.to_hex()
+        write_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        ih.write_hex_file(tmp_path + ".out")
+        ih_write_time = time.perf_counter() - started
+    finally:
+        for path in (tmp_path, tmp_path + ".out"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    if parsed.segments != image.segments or len(ih) != image.size:
+        logger.error("Parsed image differs from the synthetic one.")
+        sys.exit(1)
+    logger.info(f"Parse:  HexImage {parse_time * 1000:9.1f} ms   IntelHex {ih_parse_time * 1000:9.1f} ms"
+                f"   ({ih_parse_time / parse_time:.0f}x)")
+    logger.info(f"Write:  HexImage {write_time * 1000:9.1f} ms   IntelHex {ih_write_time * 1000:9.1f} ms"
+                f"   ({ih_write_time / write_time:.0f}x)")
+
+
+def main():
+    ## @brief Logging configuration (only when run as a tool, this is also a library)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+    )
+    parser = argparse.ArgumentParser(description="Convert, merge and benchmark firmware images.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert = subparsers.add_parser("convert", help="Convert between .hex, .bin and .uf2.")
+    convert.add_argument("input", help="Input .hex or binary file.")
+    convert.add_argument("output", help="Output .hex, .uf2 or binary file.")
+    convert.add_argument("--offset", type=lambda v: int(v, 0), default=0,
+                         help="Load address of a binary input (default: 0).")
+    convert.add_argument("--family-id", type=lambda v: int(v, 0), help="UF2 family ID.")
+
+    merge = subparsers.add_parser("merge", help="Merge several images into one.")
+    merge.add_argument("inputs", nargs="+", help="Input .hex files, merged in order.")
+    merge.add_argument("-o", "--output", required=True, help="Output .hex, .uf2 or binary file.")
+    merge.add_argument("--overwrite", action="store_true", help="Later inputs win on overlaps.")
+    merge.add_argument("--family-id", type=lambda v: int(v, 0), help="UF2 family ID.")
+
+    bench = subparsers.add_parser("benchmark", help="Compare with IntelHex on a synthetic image.")
+    bench.add_argument("--size", type=float, default=4, help="Image size in MB (default: 4).")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "convert":
+            save_image(load_image(args.input, args.offset), args.output, args.family_id)
+        elif args.command == "merge":
+            image = HexImage()
+            for path in args.inputs:
+                image.merge(load_image(path), args.overwrite)
+            save_image(image, args.output, args.family_id)
+        else:
+            benchmark(args.size)
+    except (OSError, HexImageError) as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@file serial_loopback_bench.py
+@brief Benchmark host-side serial consumers without hardware.
+@details Creates a pseudo-terminal pair, replays synthetic or recorded device
+         traffic into one end at a configurable rate and runs one of our serial
+         consumers on the other end through pySerial: the DMIC recorder (raw or
+         framed audio), the ESP32 exception decoder monitor filter (panic logs)
+         or an NMEA sentence reader (GPS). Reports the sustained throughput,
+         the processing latency percentiles and the loss, and fails when they
+         cross the given limits, so regressions show up in CI.
+@note POSIX only (pty). The decoder benchmark requires PlatformIO Core and --elf.
+@example python serial_loopback_bench.py --traffic audio --seconds 60 --rate 32000
+@example python serial_loopback_bench.py --traffic panic --elf .pio/build/esp32c6/firmware.elf --max-loss 0
+@example python serial_loopback_bench.py --traffic nmea --replay field_capture.nmea --json result.json
+"""
+
+import argparse
+import bisect
+import codecs
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import pty
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tty
+import wave
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import serial
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "examples", "zephyr-dmic-recorder", "scripts"))
+import record  # noqa: E402
+
+## @brief Logging configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+logger = logging.getLogger("serial_loopback_bench")
+
+## @brief A message written to the pty in one go and the key a consumer reports it by
+Message = Tuple[bytes, Optional[str]]
+
+TRAFFIC_KINDS = ("audio", "audio-framed", "panic", "nmea")
+MAX_MESSAGE_SIZE = 4096         # Replayed files are written in pieces of at most this size
+IDLE_TIMEOUT_S = 0.5            # Consumers stop after the sender finished and the port stayed idle
+DRAIN_TIMEOUT_S = 30.0          # Time for queued decodes to finish after the input ended
+PERCENTILES = (50, 90, 99)
+
+PANIC_LOG_LINES = 8             # Ordinary log lines between two synthetic panics
+BACKTRACE_RE = re.compile(r"Backtrace:\s*((?:0x[0-9a-fA-F]{8}[: ]?)+)")
+NMEA_RE = re.compile(rb"^\$([^*$]+)\*([0-9A-Fa-f]{2})\r?$")
+
+
+class TrafficEnd(Exception):
+    """
+    @brief Raised by TimedPort once the sender finished and no data is left.
+    """
+
+
+class TimedPort(object):
+    """
+    @brief pySerial port wrapper that logs when the data read so far was processed.
+    @details A consumer calls read() again only after it has handled the previous
+             data, so the time of each call marks everything before it as processed.
+    """
+
+    def __init__(self, ser: serial.Serial, sender_done: threading.Event):
+        self.ser = ser
+        self.sender_done = sender_done
+        self.consumed = 0
+        self.offsets: List[int] = []
+        self.times: List[float] = []
+
+    @property
+    def timeout(self):
+        return self.ser.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        # bound the wait so that the end of the traffic is noticed
+        self.ser.timeout = min(value, IDLE_TIMEOUT_S) if value is not None else IDLE_TIMEOUT_S
+
+    @property
+    def in_waiting(self):
+        return self.ser.in_waiting
+
+    def mark(self):
+        self.offsets.append(self.consumed)
+        self.times.append(time.perf_counter())
+
+    def read(self, size: int = 1) -> bytes:
+        self.mark()
+        done = self.sender_done.is_set()
+        data = self.ser.read(size)
+        if not data and done:
+            raise TrafficEnd()
+        self.consumed += len(data)
+        return data
+
+
+class TrafficSender(threading.Thread):
+    """
+    @brief Writes the messages to the pty master at a fixed byte rate.
+    """
+
+    def __init__(self, fd: int, messages: Iterable[Message], rate: float):
+        super().__init__(name="sender", daemon=True)
+        self.fd = fd
+        self.messages = messages
+        self.rate = rate
+        self.done = threading.Event()
+        self.offsets: List[int] = []
+        self.times: List[float] = []
+        self.key_times: Dict[str, float] = {}
+        self.max_lag = 0.0
+        self.started = None
+        self.finished = None
+
+    def run(self):
+        offset = 0
+        self.started = time.perf_counter()
+        try:
+            for data, key in self.messages:
+                if self.rate:
+                    delay = self.started + offset / self.rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        # the consumer (or the pty) cannot keep up with the rate
+                        self.max_lag = max(self.max_lag, -delay)
+                # latencies count from the start of the write, which may block
+                now = time.perf_counter()
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(self.fd, view):]
+                offset += len(data)
+                self.offsets.append(offset)
+                self.times.append(now)
+                if key is not None:
+                    self.key_times[key] = now
+        finally:
+            self.finished = time.perf_counter()
+            self.done.set()
+
+    @property
+    def sent(self) -> int:
+        return self.offsets[-1] if self.offsets else 0
+
+
+# --- Traffic --------------------------------------------------------------
+
+
+def audio_traffic(seconds: float, framed: bool) -> Tuple[List[Message], int]:
+    """
+    @brief START packet, 100 ms chunks of a 440 Hz tone, END packet.
+    @return Messages and the number of expected units (audio bytes, or frames if framed).
+    """
+    chunk_samples = record.SAMPLE_RATE // 10
+    period = [int(8000 * math.sin(2 * math.pi * 440 * i / record.SAMPLE_RATE))
+              for i in range(record.SAMPLE_RATE)]
+    tone = struct.pack("<%dh" % len(period), *period)
+    chunk_size = chunk_samples * record.FRAME_SIZE
+    count = int(seconds * 10)
+    messages = [(record.PACKET_START, None)]
+    for i in range(count):
+        offset = (i * chunk_size) % len(tone)
+        payload = (tone + tone)[offset:offset + chunk_size]
+        if framed:
+            body = struct.pack("<HH", i % record.SEQUENCE_MODULO, len(payload)) + payload
+            payload = record.FRAME_MAGIC + body + struct.pack("<I", zlib.crc32(body))
+        messages.append((payload, None))
+    messages.append((record.PACKET_END, None))
+    return messages, count if framed else count * chunk_size
+
+
+def panic_traffic(count: int) -> Tuple[List[Message], int]:
+    """
+    @brief ESP32 log lines with a Guru Meditation panic and backtrace every few lines.
+    @return Messages and the number of backtraces, each keyed by its address list.
+    """
+    messages = []
+    for i in range(count):
+        for j in range(PANIC_LOG_LINES):
+            messages.append((b"I (%d) app: tick %d\r\n" % (i * 1000 + j, j), None))
+        messages.append((
+            b"\r\nGuru Meditation Error: Core  0 panic'ed (LoadProhibited). Exception was unhandled.\r\n"
+            b"Core  0 register dump:\r\n"
+            b"PC      : 0x400d1f2a  PS      : 0x00060030  A0      : 0x800d2b1c  A1      : 0x3ffb1f50\r\n",
+            None,
+        ))
+        sp = 0x3FF00000 + i * 0x40
+        addresses = " ".join("0x%08x:0x%08x" % (0x400D1F27 + 0x100 * k + (i % 64) * 4, sp + 0x20 * k)
+                             for k in range(4))
+        messages.append((("\r\nBacktrace: %s\r\n" % addresses).encode(), addresses))
+        messages.append((b"\r\nRebooting...\r\n", None))
+    return messages, count
+
+
+def nmea_sentence(body: str) -> bytes:
+    checksum = 0
+    for c in body.encode("ascii"):
+        checksum ^= c
+    return ("$%s*%02X\r\n" % (body, checksum)).encode("ascii")
+
+
+def nmea_traffic(count: int) -> Tuple[List[Message], int]:
+    """
+    @brief Alternating GGA/RMC sentences of a receiver moving east, 10 Hz time steps.
+    @return Messages and the number of sentences.
+    """
+    messages = []
+    for i in range(count):
+        t = i // 2
+        stamp = "%02d%02d%02d.%d" % (t // 360000 % 24, t // 6000 % 60, t // 100 % 60, t // 10 % 10)
+        lon = "11403.%04d" % (t % 10000)
+        if i % 2 == 0:
+            body = "GPGGA,%s,2232.1234,N,%s,E,1,08,0.9,45.0,M,-2.4,M,," % (stamp, lon)
+        else:
+            body = "GPRMC,%s,A,2232.1234,N,%s,E,0.5,90.0,180926,,,A" % (stamp, lon)
+        sentence = nmea_sentence(body)
+        messages.append((sentence, sentence.decode("ascii").strip()))
+    return messages, count
+
+
+def replay_traffic(path: str, kind: str) -> Tuple[List[Message], Optional[int]]:
+    """
+    @brief Replay a recorded capture, line by line for text and in pieces for audio.
+    @return Messages and the number of expected units found in the capture.
+    """
+    with open(path, "rb") as fp:
+        data = fp.read()
+    messages = []
+    for line in data.splitlines(keepends=True):
+        for i in range(0, len(line), MAX_MESSAGE_SIZE):
+            messages.append((line[i:i + MAX_MESSAGE_SIZE], None))
+
+    if kind == "panic":
+        expected = 0
+        for i, (piece, _) in enumerate(messages):
+            m = BACKTRACE_RE.search(piece.decode("utf-8", "replace"))
+            if m:
+                messages[i] = (piece, m.group(1).strip())
+                expected += 1
+        return messages, expected
+    if kind == "nmea":
+        expected = 0
+        for i, (piece, _) in enumerate(messages):
+            if nmea_valid(piece.rstrip(b"\n")):
+                messages[i] = (piece, piece.decode("ascii").strip())
+                expected += 1
+        return messages, expected
+
+    start = data.find(record.PACKET_START)
+    end = data.find(record.PACKET_END, start + 1)
+    if start == -1 or end == -1:
+        return messages, None
+    audio = data[start + len(record.PACKET_START):end]
+    if kind == "audio-framed":
+        return messages, len(record.FrameDecoder().feed(audio))
+    return messages, len(audio) - len(audio) % record.FRAME_SIZE
+
+
+# --- Consumers ------------------------------------------------------------
+
+
+def consume_recorder(port: TimedPort, framed: bool) -> dict:
+    """
+    @brief Run the DMIC recorder's streaming path on the port.
+    @return Audio bytes (or frames) received and the recorder's loss statistics.
+    """
+    result = {}
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        path = os.path.join(tmp, "bench.wav")
+        try:
+            initial = record.find_start_packet(port, record.SYNC_TIMEOUT_S)
+            if initial is None:
+                return dict(received=0, error="no START packet")
+            with wave.open(path, "wb") as wav_file:
+                wav_file.setnchannels(record.CHANNELS)
+                wav_file.setsampwidth(record.SAMPLE_WIDTH_BYTES)
+                wav_file.setframerate(record.SAMPLE_RATE)
+                if framed:
+                    _, _, report = record.stream_framed_audio(port, wav_file, None, initial)
+                    result.update(received=report["frames"], lost_frames=report["lost_frames"],
+                                  crc_errors=report["crc_errors"], skipped_bytes=report["skipped_bytes"])
+                else:
+                    written, _ = record.stream_audio(port, wav_file, None, initial)
+                    result.update(received=written)
+        except TrafficEnd:
+            result.update(error="traffic ended before the END packet")
+            if os.path.exists(path):
+                with wave.open(path, "rb") as wav_file:
+                    result.setdefault("received", wav_file.getnframes() * record.FRAME_SIZE)
+            result.setdefault("received", 0)
+    return result
+
+
+def consume_decoder(port: TimedPort, sender: TrafficSender, elf: str, addr2line: Optional[str]) -> dict:
+    """
+    @brief Feed the port to the rx() path of the ESP32 exception decoder filter.
+    @return Decoded and dropped backtraces and the decode latency of each keyed backtrace.
+    """
+    from symbolize_log import EspLogSymbolizer, guess_project_dir  # requires PlatformIO Core
+    import symbol_index
+
+    completed = []
+
+    class BenchDecoder(EspLogSymbolizer):
+        def build_backtrace(self, line, address_match):
+            trace = super().build_backtrace(line, address_match)
+            completed.append((address_match.strip(), time.perf_counter()))
+            return trace
+
+    decoder = BenchDecoder(
+        elf, guess_project_dir(elf), addr2line,
+        addr2line.replace("addr2line", "c++filt") if addr2line else None,
+    )
+    decoder.init_stream_state(decoder.MAX_LINE_LENGTH)
+    decoder.firmware_stat = symbol_index.get_file_stat(elf)
+    decoder.enabled = True
+    if decoder.get_symbol_index() is None and not addr2line:
+        return dict(received=0, error="cannot index %s and no --addr2line given" % elf)
+
+    text = codecs.getincrementaldecoder("utf-8")("replace")
+    port.timeout = IDLE_TIMEOUT_S
+    try:
+        while True:
+            decoder.rx(text.decode(port.read(port.in_waiting or 1)))
+    except TrafficEnd:
+        pass
+
+    deadline = time.perf_counter() + DRAIN_TIMEOUT_S
+    while not decoder.decode_queue.empty() and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    # the job taken off the queue last may still be running
+    time.sleep(0.05)
+    done = dict(completed)
+    latencies = [done[key] - t for key, t in sender.key_times.items() if key in done]
+    return dict(received=len([key for key in sender.key_times if key in done]),
+                dropped=decoder.dropped_decodes, decode_latencies=latencies)
+
+
+def nmea_valid(line: bytes) -> bool:
+    m = NMEA_RE.match(line)
+    if m is None:
+        return False
+    checksum = 0
+    for c in m.group(1):
+        checksum ^= c
+    return checksum == int(m.group(2), 16)
+
+
+def consume_nmea(port: TimedPort) -> dict:
+    """
+    @brief Split the port into lines and validate the NMEA checksums.
+    @return Valid and invalid sentences received.
+    """
+    valid = invalid = 0
+    pending = b""
+    port.timeout = IDLE_TIMEOUT_S
+    try:
+        while True:
+            lines = (pending + port.read(port.in_waiting or 1)).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                if nmea_valid(line):
+                    valid += 1
+                elif line.strip():
+                    invalid += 1
+    except TrafficEnd:
+        pass
+    return dict(received=valid, invalid=invalid)
+
+
+# --- Report ---------------------------------------------------------------
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """
+    @brief Nearest-rank percentiles and maximum, in milliseconds.
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {"p%d" % q: values[min(len(values) - 1, int(math.ceil(q / 100 * len(values))) - 1)] * 1000
+              for q in PERCENTILES}
+    result["max"] = values[-1] * 1000
+    return result
+
+
+def processing_latencies(sender: TrafficSender, port: TimedPort) -> List[float]:
+    """
+    @brief Time from writing each message until the consumer had processed it.
+    """
+    latencies = []
+    for end, sent in zip(sender.offsets, sender.times):
+        i = bisect.bisect_left(port.offsets, end)
+        if i < len(port.times):
+            latencies.append(port.times[i] - sent)
+    return latencies
+
+
+def run_benchmark(args) -> dict:
+    """
+    @brief Replay the traffic through a pty and run the matching consumer on it.
+    @return Benchmark results.
+    """
+    if args.replay:
+        messages, expected = replay_traffic(args.replay, args.traffic)
+    elif args.traffic in ("audio", "audio-framed"):
+        messages, expected = audio_traffic(args.seconds, args.traffic == "audio-framed")
+    elif args.traffic == "panic":
+        messages, expected = panic_traffic(args.count)
+    else:
+        messages, expected = nmea_traffic(args.count)
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    ser = serial.Serial(os.ttyname(slave), timeout=IDLE_TIMEOUT_S)
+    sender = TrafficSender(master, messages, args.rate)
+    port = TimedPort(ser, sender.done)
+    try:
+        sender.start()
+        if args.traffic in ("audio", "audio-framed"):
+            result = consume_recorder(port, args.traffic == "audio-framed")
+        elif args.traffic == "panic":
+            result = consume_decoder(port, sender, args.elf, args.addr2line)
+        else:
+            result = consume_nmea(port)
+        port.mark()
+        sender.join()
+    finally:
+        ser.close()
+        os.close(slave)
+        os.close(master)
+
+    # the end of the traffic is only noticed after an idle read, count until the
+    # last byte was processed
+    i = bisect.bisect_left(port.offsets, sender.sent)
+    finished = port.times[min(i, len(port.times) - 1)]
+    elapsed = max(finished - sender.started, 1e-9)
+    result.update(
+        traffic=args.traffic,
+        rate_limit=args.rate,
+        sent_bytes=sender.sent,
+        consumed_bytes=port.consumed,
+        elapsed=elapsed,
+        bytes_per_second=port.consumed / elapsed,
+        sender_max_lag_ms=sender.max_lag * 1000,
+        expected=expected,
+        latency_ms=percentiles(processing_latencies(sender, port)),
+    )
+    if "decode_latencies" in result:
+        result["decode_latency_ms"] = percentiles(result.pop("decode_latencies"))
+    if expected:
+        result["loss"] = max(0, expected - result.get("received", 0)) / expected
+    return result
+
+
+def format_latency(latency: Dict[str, float]) -> str:
+    return "  ".join("%s %.2f ms" % item for item in latency.items()) or "n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark serial consumers against replayed device traffic on a pty."
+    )
+    parser.add_argument("--traffic", choices=TRAFFIC_KINDS, default="audio",
+                        help="Traffic to replay and the consumer to run (default: audio).")
+    parser.add_argument("--replay", help="Replay this capture file instead of synthetic traffic.")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="Bytes per second written to the pty, 0 for as fast as possible (default: 0).")
+    parser.add_argument("--seconds", type=float, default=30,
+                        help="Seconds of synthetic audio (default: 30).")
+    parser.add_argument("--count", type=int, default=2000,
+                        help="Number of synthetic panics or NMEA sentences (default: 2000).")
+    parser.add_argument("--elf", help="Firmware ELF for the exception decoder (--traffic panic).")
+    parser.add_argument("--addr2line", help="Toolchain addr2line, used only when the ELF cannot be indexed.")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    parser.add_argument("--min-rate", type=float, help="Fail below this many consumed bytes per second.")
+    parser.add_argument("--max-loss", type=float, help="Fail above this fraction of lost units (0..1).")
+    parser.add_argument("--max-p99-ms", type=float, help="Fail above this 99th percentile processing latency.")
+    args = parser.parse_args()
+
+    if args.traffic == "panic" and not args.elf:
+        parser.error("--traffic panic requires --elf")
+
+    result = run_benchmark(args)
+
+    logger.info(f"Traffic: {result['traffic']}, {result['sent_bytes']} bytes sent, "
+                f"{result['consumed_bytes']} consumed in {result['elapsed']:.2f}s")
+    logger.info(f"Throughput: {result['bytes_per_second'] / 1024:.1f} KiB/s"
+                + (f" (limit {args.rate / 1024:.1f} KiB/s, sender lag up to "
+                   f"{result['sender_max_lag_ms']:.1f} ms)" if args.rate else ""))
+    logger.info(f"Processing latency: {format_latency(result['latency_ms'])}")
+    if "decode_latency_ms" in result:
+        logger.info(f"Decode latency: {format_latency(result['decode_latency_ms'])}, "
+                    f"dropped {result['dropped']}")
+    if result.get("expected"):
+        logger.info(f"Received {result.get('received', 0)} of {result['expected']} unit(s), "
+                    f"loss {result['loss'] * 100:.2f}%")
+    for key in ("lost_frames", "crc_errors", "skipped_bytes", "invalid"):
+        if key in result:
+            logger.info(f"{key.replace('_', ' ').capitalize()}: {result[key]}")
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(result, fp, indent=2)
+
+    failures = []
+    if result.get("error"):
+        failures.append(result["error"])
+    if args.min_rate is not None and result["bytes_per_second"] < args.min_rate:
+        failures.append(f"throughput {result['bytes_per_second']:.0f} B/s < {args.min_rate:.0f} B/s")
+    if args.max_loss is not None and result.get("loss", 0) > args.max_loss:
+        failures.append(f"loss {result['loss']:.4f} > {args.max_loss}")
+    if args.max_p99_ms is not None and result["latency_ms"].get("p99", 0) > args.max_p99_ms:
+        failures.append(f"p99 latency {result['latency_ms']['p99']:.2f} ms > {args.max_p99_ms} ms")
+    for failure in failures:
+        logger.error(failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@file symbolize_log.py
+@brief Offline symbolizer for large device logs (soak tests, field captures).
+@details Reuses the monitor exception decoders to annotate every backtrace in a
+         log file. The log is memory-mapped, split into chunks on line boundaries
+         and decoded by a pool of worker processes which all load the same
+         precomputed symbol index. Writes the annotated log and a histogram of
+         crash signatures (the innermost resolved functions of each backtrace).
+@note Requires PlatformIO Core in the running Python environment.
+@example python symbolize_log.py --elf .pio/build/seeed-xiao-esp32c6/firmware.elf soak.log
+"""
+
+import argparse
+import collections
+import logging
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+from typing import Counter, Iterator, List, Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "monitor"))
+
+from filter_exception_decoder import (  # noqa: E402
+    Addr2LineProcess,
+    CortexMFaultDecoder,
+    Esp32ExceptionDecoder,
+)
+import symbol_index  # noqa: E402
+
+## @brief Logging configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+logger = logging.getLogger("symbolize_log")
+
+CHUNK_SIZE = 16 * 1024 * 1024   # Max bytes of log handed to a worker at once
+MIN_CHUNK_SIZE = 1024 * 1024    # Smaller logs are not split any further
+SIGNATURE_DEPTH = 3             # Frames that make up a crash signature
+
+
+class OfflineDecoderMixin(object):
+    """
+    @brief Runs a monitor filter outside of a PlatformIO monitor session.
+    """
+
+    def __init__(self, firmware_path: str, project_dir: str,
+                 addr2line_path: Optional[str] = None, cxxfilt_path: Optional[str] = None):
+        # DeviceMonitorFilterBase.__init__() needs a project configuration, skip it
+        self.project_dir = os.path.abspath(project_dir)
+        self.firmware_path = firmware_path
+        self.addr2line_path = addr2line_path
+        self.cxxfilt_path = cxxfilt_path
+        self.addr2line = Addr2LineProcess(addr2line_path, firmware_path) if addr2line_path else None
+        self.symbols = None
+        self.symbols_failed = not symbol_index.is_available()
+        self.index_thread = None
+        self.fault_lines_left = 0
+        self.last_frames = []
+
+    def resolve_addresses(self, addresses):
+        self.last_frames = super().resolve_addresses(addresses)
+        return self.last_frames
+
+    def signature(self) -> str:
+        """
+        @brief Crash signature of the backtrace resolved last.
+        """
+        names = []
+        for output in self.last_frames:
+            name = output.strip().split(" at ", 1)[0]
+            if name and not name.startswith("??"):
+                names.append(name)
+            if len(names) == SIGNATURE_DEPTH:
+                break
+        return " < ".join(names)
+
+
+class EspLogSymbolizer(OfflineDecoderMixin, Esp32ExceptionDecoder):
+    pass
+
+
+class CortexMLogSymbolizer(OfflineDecoderMixin, CortexMFaultDecoder):
+    pass
+
+
+SYMBOLIZERS = {
+    "esp32": EspLogSymbolizer,
+    "cortexm": CortexMLogSymbolizer,
+}
+
+## @brief Per worker process state, see init_worker()
+_worker = {}
+
+
+def init_worker(log_path: str, symbolizer_name: str, symbolizer_args: tuple):
+    """
+    @brief Pool initializer: map the log and load the shared symbol index once.
+    """
+    symbolizer = SYMBOLIZERS[symbolizer_name](*symbolizer_args)
+    symbolizer.get_symbol_index()
+    fp = open(log_path, "rb")
+    _worker.update(
+        symbolizer=symbolizer,
+        fp=fp,
+        data=mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ),
+    )
+
+
+def process_chunk(bounds: Tuple[int, int]) -> Tuple[bytes, Counter, int]:
+    """
+    @brief Annotate log bytes [start, end) which begin and end on line boundaries.
+    @return Annotated bytes, crash signature counts and number of decoded backtraces.
+    """
+    start, end = bounds
+    symbolizer = _worker["symbolizer"]
+    data = _worker["data"]
+    prime_fault_state(symbolizer, data, start)
+    text = data[start:end].decode("utf-8", "surrogateescape")
+    signatures = collections.Counter()
+    pieces = []
+    decoded = 0
+    for line in split_lines(text):
+        pieces.append(line)
+        match = symbolizer.match_line(line.rstrip("\r\n"))
+        if not match:
+            continue
+        trace = symbolizer.build_backtrace(line, match)
+        if trace:
+            pieces.append(trace)
+            signatures[symbolizer.signature()] += 1
+            decoded += 1
+    return "".join(pieces).encode("utf-8", "surrogateescape"), signatures, decoded
+
+
+def prime_fault_state(symbolizer, data: mmap.mmap, start: int):
+    """
+    @brief Restore the fault dump state a serial pass would have at `start`.
+    @details Workers process unrelated chunks in any order, so the state is reset
+             and the lines before the chunk that can still belong to a fault dump
+             are replayed through match_line() without output.
+    """
+    symbolizer.fault_lines_left = 0
+    context_lines = getattr(symbolizer, "FAULT_CONTEXT_LINES", 0)
+    if not context_lines or start == 0:
+        return
+    context_start = start
+    for _ in range(context_lines):
+        context_start = data.rfind(b"\n", 0, context_start - 1) + 1
+        if context_start == 0:
+            break
+    context = data[context_start:start].decode("utf-8", "surrogateescape")
+    for line in split_lines(context):
+        symbolizer.match_line(line.rstrip("\r\n"))
+
+
+def split_lines(text: str) -> Iterator[str]:
+    """
+    @brief Lines of `text` with their line breaks, split on "\n" only as in the monitor.
+    @details str.splitlines() would also split on "\r" and other control characters.
+    """
+    last = 0
+    while last < len(text):
+        end = text.find("\n", last)
+        end = len(text) if end == -1 else end + 1
+        yield text[last:end]
+        last = end
+
+
+def split_on_lines(data: mmap.mmap, chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    @brief Split the mapped log into chunks that end right after a line break.
+    """
+    chunks = []
+    start = 0
+    size = len(data)
+    while start < size:
+        end = data.find(b"\n", min(start + chunk_size, size) - 1)
+        end = size if end == -1 else end + 1
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+def guess_project_dir(firmware_path: str) -> str:
+    """
+    @brief `<project>/.pio/build/<env>/firmware.elf` -> `<project>`.
+    """
+    parts = os.path.abspath(firmware_path).split(os.sep)
+    if len(parts) > 4 and parts[-4] == ".pio":
+        return os.sep.join(parts[:-4])
+    return os.getcwd()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Annotate backtraces in device logs with source locations."
+    )
+    parser.add_argument("log", help="Path to the log file.")
+    parser.add_argument("--elf", required=True, help="Firmware ELF the devices were running.")
+    parser.add_argument("-o", "--output", help="Annotated log (default: <log>.decoded<ext>).")
+    parser.add_argument("--histogram", help="Crash signature histogram (default: <log>.signatures.txt).")
+    parser.add_argument("--format", choices=sorted(SYMBOLIZERS), default="esp32",
+                        help="Backtrace format in the log (default: esp32).")
+    parser.add_argument("--addr2line", help="Toolchain addr2line, used only when the ELF cannot be indexed.")
+    parser.add_argument("--project-dir", help="Prefix stripped from source paths.")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: CPU count).")
+    args = parser.parse_args()
+
+    root, ext = os.path.splitext(args.log)
+    output_path = args.output or "%s.decoded%s" % (root, ext or ".log")
+    histogram_path = args.histogram or "%s.signatures.txt" % root
+    symbolizer_args = (
+        args.elf,
+        args.project_dir or guess_project_dir(args.elf),
+        args.addr2line,
+        args.addr2line.replace("addr2line", "c++filt") if args.addr2line else None,
+    )
+
+    # Build (or validate) the cached index once so that workers only load it
+    started = time.time()
+    symbolizer = SYMBOLIZERS[args.format](*symbolizer_args)
+    if symbolizer.get_symbol_index() is None and not args.addr2line:
+        logger.error(f"Cannot index {args.elf} and no --addr2line given.")
+        sys.exit(1)
+    logger.info(f"Symbol index ready in {time.time() - started:.2f}s")
+
+    signatures = collections.Counter()
+    decoded = 0
+    with open(args.log, "rb") as fp, open(output_path, "wb") as out:
+        total = os.fstat(fp.fileno()).st_size
+        chunks = []
+        if total == 0:
+            # still write the empty outputs, callers expect both files
+            logger.warning("Log file is empty.")
+        else:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                # a few chunks per worker keep all of them busy until the end
+                chunk_size = max(MIN_CHUNK_SIZE, min(CHUNK_SIZE, total // (args.jobs * 4)))
+                chunks = split_on_lines(data, chunk_size)
+
+        if chunks:
+            logger.info(f"Decoding {total / 1e6:.1f} MB in {len(chunks)} chunk(s) "
+                        f"with {args.jobs} worker(s)...")
+            with multiprocessing.Pool(
+                args.jobs, initializer=init_worker,
+                initargs=(args.log, args.format, symbolizer_args),
+            ) as pool:
+                for annotated, chunk_signatures, chunk_decoded in pool.imap(process_chunk, chunks):
+                    out.write(annotated)
+                    signatures.update(chunk_signatures)
+                    decoded += chunk_decoded
+
+    with open(histogram_path, "w") as fp:
+        for signature, count in signatures.most_common():
+            fp.write("%8d  %s\n" % (count, signature or "<unresolved>"))
+
+    elapsed = time.time() - started
+    logger.info(f"Decoded {decoded} backtrace(s), {len(signatures)} distinct signature(s) "
+                f"in {elapsed:.2f}s ({total / 1e6 / elapsed:.1f} MB/s).")
+    logger.info(f"Annotated log: {output_path}")
+    logger.info(f"Signature histogram: {histogram_path}")
+
+
+if __name__ == "__main__":
+    main()
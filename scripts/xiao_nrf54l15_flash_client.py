@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@file xiao_nrf54l15_flash_client.py
+@brief Thin client for the nRF54L15 flash server.
+@details Sends one flash job to `xiao_nrf54l15_recover_flash.py --serve`, which keeps
+         pyOCD and the probe sessions loaded between jobs, and prints the
+         duration of every step. Uses the standard library only, so it starts fast.
+@example python xiao_nrf54l15_flash_client.py --hex application.hex --probe 103E0DC0 --mass-erase --verify
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+DEFAULT_SERVER_PORT = 47054  # Keep in sync with xiao_nrf54l15_recover_flash.py
+
+
+def send_job(job: dict, port: int, timeout: float) -> dict:
+    """
+    @brief Send a job to the flash server and wait for its result.
+    @param job Job description, see FlashServer in xiao_nrf54l15_recover_flash.py.
+    @param port Local TCP port of the server.
+    @param timeout Seconds to wait for the job to finish.
+    @return The result reported by the server.
+    """
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as sock:
+        sock.sendall((json.dumps(job) + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as fp:
+            line = fp.readline()
+    if not line:
+        raise ConnectionError("Flash server closed the connection.")
+    return json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Send a flash job to a running nRF54L15 flash server."
+    )
+    parser.add_argument("--hex", required=True, help="Path to the HEX file to be programmed.")
+    parser.add_argument("--probe", help="Unique ID of the debug probe (optional with a single probe).")
+    parser.add_argument("--mass-erase", action="store_true",
+                        help="Perform a mass erase to unlock and fully erase the chip before programming.")
+    parser.add_argument("--verify", action="store_true", help="Read back and compare the programmed data.")
+    parser.add_argument("--incremental", choices=("readback", "manifest"),
+                        help="Program only the pages that differ from the image.")
+    parser.add_argument("--reconnect", action="store_true",
+                        help="Open a new session first, e.g. after the board was replaced.")
+    parser.add_argument("--port", type=int, default=DEFAULT_SERVER_PORT,
+                        help=f"Local TCP port of the flash server (default: {DEFAULT_SERVER_PORT}).")
+    parser.add_argument("--timeout", type=float, default=300,
+                        help="Seconds to wait for the job (default: 300).")
+    args = parser.parse_args()
+
+    job = {
+        "hex": os.path.abspath(args.hex),
+        "probe": args.probe,
+        "mass_erase": args.mass_erase,
+        "verify": args.verify,
+        "reconnect": args.reconnect,
+        "incremental": args.incremental,
+    }
+    try:
+        result = send_job(job, args.port, args.timeout)
+    except (OSError, ValueError) as e:
+        print(f"Cannot reach the flash server on port {args.port}: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    for phase, seconds in result.get("phases", {}).items():
+        print(f"{phase:<10} {seconds * 1000:10.1f} ms")
+    print(f"{'total':<10} {result.get('total', 0) * 1000:10.1f} ms")
+    if not result.get("ok"):
+        print(f"FAILED ({result.get('probe')}): {result.get('error')}", file=sys.stderr)
+        sys.exit(1)
+    print(f"OK ({result.get('probe')})")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,36 +5,42 @@
 @brief Simplified pyOCD script to unlock (mass erase) and program nRF54L15.
 @details This script provides core functionality to erase and flash nRF54L15 devices.
          It is a stripped-down version focusing on the essential features.
-@note Requires: pip install pyocd intelhex
+@note Requires: pip install pyocd (and intelhex for --benchmark-split)
 @example python xiao_nrf54l15_recover_flash.py --hex application.hex --probe 103E0DC0 --mass-erase
+@example python xiao_nrf54l15_recover_flash.py --hex application.hex --gang --mass-erase
 """
 
 import subprocess
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import socketserver
 import sys
+import threading
 import os
-import tempfile
+import time
 import logging
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
-## @brief Automatically install dependencies if missing
-try:
-    from intelhex import IntelHex
-except ImportError:
-    print("Installing intelhex...")
-    subprocess.run([sys.executable, "-m", "pip", "install", "intelhex"], check=True)
-    from intelhex import IntelHex
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from hex_image import HexImage  # noqa: E402
 
+## @brief Automatically install dependencies if missing
 try:
     from pyocd.core.helpers import ConnectHelper
-    from pyocd.flash.file_programmer import FileProgrammer
+    from pyocd.flash.loader import FlashLoader
     from pyocd.core.session import Session
     from pyocd.probe.aggregator import DebugProbeAggregator
 except ImportError:
     print("Installing pyocd...")
     subprocess.run([sys.executable, "-m", "pip", "install", "pyocd"], check=True)
     from pyocd.core.helpers import ConnectHelper
-    from pyocd.flash.file_programmer import FileProgrammer
+    from pyocd.flash.loader import FlashLoader
     from pyocd.core.session import Session
     from pyocd.probe.aggregator import DebugProbeAggregator
 
@@ -55,12 +61,49 @@ NRF54L15_CORE_DEFINITIONS = {
     },
 }
 NRF54L15_APPROTECT_ADDRESS = 0x00FF8208  # Application core APPROTECT
+DEFAULT_PAGE_SIZE = 0x1000  # Used when the memory map has no page size
+ERASED_BYTE = 0xFF
 
 ## @brief Protection status constants
 PROTECTION_STATUS_NONE = "UNPROTECTED"
 PROTECTION_STATUS_PROTECTED = "PROTECTED"
 PROTECTION_STATUS_UNKNOWN = "UNKNOWN"
 
+## @brief Contiguous data as (start address, bytes)
+Segment = Tuple[int, bytes]
+
+## @brief Session options for every board
+SESSION_OPTIONS = {
+    'target_override': 'nrf54l',
+    'connect_mode': 'under-reset' # This mode is usually required for protected devices
+}
+
+## @brief Incremental programming modes: how the current page contents are known
+INCREMENTAL_MODES = ("readback", "manifest")
+DEFAULT_MANIFEST_DIR = os.path.join(os.path.expanduser("~"), ".cache", "xiao_nrf54l15_flash")
+
+## @brief Local TCP port of the flash server (--serve)
+DEFAULT_SERVER_PORT = 47054
+
+class RecoveryError(Exception):
+    """
+    @brief A board cannot be recovered (no accessible core, no data, verify mismatch).
+    """
+
+@contextlib.contextmanager
+def timed_phase(phases: Optional[Dict[str, float]], name: str):
+    """
+    @brief Record the duration of a step in seconds.
+    @param phases Dictionary receiving the duration, or None to skip timing.
+    @param name Name of the step.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if phases is not None:
+            phases[name] = round(time.perf_counter() - started, 3)
+
 def read_word_safely(session: Session, addr: int) -> Optional[int]:
     """
     @brief Safely read a 32-bit word from the target.
@@ -102,88 +145,602 @@ def get_core_info(session: Session) -> Dict[str, dict]:
             logger.warning(f"{core_name} core not accessible.")
     return core_info
 
-def split_hex_by_core(hex_file: str, core_info: Dict[str, dict]) -> Dict[str, IntelHex]:
+def load_hex_segments(hex_file: str) -> List[Segment]:
     """
-    @brief Split the HEX file by core according to memory mapping.
+    @brief Parse a HEX file into contiguous data segments.
     @param hex_file Path to the HEX file.
-    @param core_info Dictionary of core info.
-    @return Dictionary of IntelHex objects per core.
+    @return List of (start address, bytes), sorted by address.
     """
-    merged_hex = IntelHex(hex_file)
-    core_hexes = {}
+    return [(start, bytes(data)) for start, data in HexImage.from_hex_file(hex_file).segments]
 
+def get_core_windows(core_def: dict) -> List[Tuple[int, int]]:
+    """
+    @brief Get the [start, end) address windows of a core (ROM and UICR).
+    @param core_def Core definition from NRF54L15_CORE_DEFINITIONS.
+    @return List of (start, end) windows.
+    """
+    return [
+        (core_def["romBaseAddr"], core_def["romBaseAddr"] + core_def["romSize"]),
+        (core_def["uicrBaseAddr"], core_def["uicrBaseAddr"] + core_def["uicrSize"]),
+    ]
+
+def clip_segments(segments: List[Segment], windows: List[Tuple[int, int]]) -> List[Segment]:
+    """
+    @brief Intersect data segments with address windows, copying whole slices.
+    @param segments List of (start address, bytes).
+    @param windows List of [start, end) address windows.
+    @return The parts of the segments inside the windows, sorted by address.
+    """
+    result = []
+    for start, data in segments:
+        end = start + len(data)
+        for window_start, window_end in windows:
+            lo, hi = max(start, window_start), min(end, window_end)
+            if lo < hi:
+                result.append((lo, data[lo - start:hi - start]))
+    result.sort(key=lambda segment: segment[0])
+    return result
+
+def split_segments_by_core(segments: List[Segment], core_info: Dict[str, dict]) -> Dict[str, List[Segment]]:
+    """
+    @brief Split data segments by core according to memory mapping.
+    @param segments List of (start address, bytes).
+    @param core_info Dictionary of core info.
+    @return Dictionary of segment lists per accessible core with data.
+    """
+    core_segments = {}
     for core_name, core_def in core_info.items():
         if not core_def.get("accessible", False):
             continue
+        clipped = clip_segments(segments, get_core_windows(core_def))
+        if clipped:
+            core_segments[core_name] = clipped
+            logger.info(f"Data for {core_name} core extracted from HEX file.")
+    return core_segments
 
-        core_hex = IntelHex()
-        rom_start, rom_end = core_def["romBaseAddr"], core_def["romBaseAddr"] + core_def["romSize"]
-        uicr_start, uicr_end = core_def["uicrBaseAddr"], core_def["uicrBaseAddr"] + core_def["uicrSize"]
+def split_hex_by_core(hex_file: str, core_info: Dict[str, dict]) -> Dict[str, List[Segment]]:
+    """
+    @brief Split the HEX file by core according to memory mapping.
+    @param hex_file Path to the HEX file.
+    @param core_info Dictionary of core info.
+    @return Dictionary of segment lists per core.
+    """
+    return split_segments_by_core(load_hex_segments(hex_file), core_info)
+
+def benchmark_split():
+    """
+    @brief Parse and split a synthetic full-flash image (whole ROM and UICR) and compare
+           against IntelHex parsing and the previous byte-by-byte copy into IntelHex objects.
+    """
+    from intelhex import IntelHex  # only needed for the comparison
 
+    core_info = {name: {**core_def, "accessible": True}
+                 for name, core_def in NRF54L15_CORE_DEFINITIONS.items()}
+    core_def = NRF54L15_CORE_DEFINITIONS["Application"]
+    segments = [
+        (core_def["romBaseAddr"], os.urandom(core_def["romSize"])),
+        (core_def["uicrBaseAddr"], os.urandom(core_def["uicrSize"])),
+    ]
+    total = sum(len(data) for _, data in segments)
+    image = HexImage()
+    for start, data in segments:
+        image.add(start, data)
+    hex_text = image.to_hex()
+
+    started = time.perf_counter()
+    parsed = [(start, bytes(data)) for start, data in HexImage.from_hex(hex_text).segments]
+    parse_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    core_segments = split_segments_by_core(parsed, core_info)
+    split_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    merged_hex = IntelHex()
+    merged_hex.loadhex(io.StringIO(hex_text))
+    intelhex_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    legacy = {}
+    for core_name, core_def in core_info.items():
+        core_hex = IntelHex()
+        windows = get_core_windows(core_def)
         for start, end in merged_hex.segments():
             for addr in range(start, end):
-                if (rom_start <= addr < rom_end) or (uicr_start <= addr < uicr_end):
+                if any(lo <= addr < hi for lo, hi in windows):
                     core_hex[addr] = merged_hex[addr]
-        
-        if len(core_hex) > 0:
-            core_hexes[core_name] = core_hex
-            logger.info(f"Data for {core_name} core extracted from HEX file.")
+        legacy[core_name] = core_hex
+    legacy_time = time.perf_counter() - started
 
-    return core_hexes
+    for core_name, core_hex in legacy.items():
+        legacy_segments = [(start, core_hex.tobinstr(start=start, end=end - 1))
+                           for start, end in core_hex.segments()]
+        if legacy_segments != core_segments.get(core_name, []):
+            logger.error(f"Split mismatch for {core_name} core.")
+            sys.exit(1)
+    logger.info(f"Synthetic image: {total / 1024:.0f} KB in {len(segments)} segment(s).")
+    logger.info(f"HexImage parse:      {parse_time * 1000:10.2f} ms")
+    logger.info(f"Segment split:       {split_time * 1000:10.2f} ms")
+    logger.info(f"IntelHex parse:      {intelhex_time * 1000:10.2f} ms")
+    logger.info(f"Byte-by-byte split:  {legacy_time * 1000:10.2f} ms")
 
-def write_intelhex_to_temp(ih: IntelHex) -> str:
+def merge_segments(segments: List[Segment], page_size: Optional[int] = None) -> List[Segment]:
     """
-    @brief Write IntelHex object to a temporary file.
-    @param ih IntelHex object.
-    @return Path to the temporary HEX file.
+    @brief Merge adjacent segments into contiguous blocks.
+    @param segments List of (start address, bytes).
+    @param page_size If given, blocks are padded with erased bytes to page boundaries
+           and segments sharing a page end up in the same block.
+    @return List of (start address, bytes) blocks, sorted by address.
     """
-    fd, tmp_path = tempfile.mkstemp(suffix=".hex", prefix="nrf54l15_")
-    os.close(fd)
-    ih.write_hex_file(tmp_path)
-    return tmp_path
+    blocks = []
+    for start, data in sorted(segments, key=lambda segment: segment[0]):
+        block_start = start - start % page_size if page_size else start
+        if blocks and block_start <= blocks[-1][0] + len(blocks[-1][1]):
+            previous_start, buf = blocks[-1]
+            buf.extend(bytes([ERASED_BYTE]) * max(0, start - previous_start - len(buf)))
+        else:
+            buf = bytearray([ERASED_BYTE]) * (start - block_start)
+            blocks.append((block_start, buf))
+        buf.extend(data)
+    if page_size:
+        for _, buf in blocks:
+            buf.extend(bytes([ERASED_BYTE]) * (-len(buf) % page_size))
+    return [(start, bytes(buf)) for start, buf in blocks]
 
-def unlock_and_erase_device(session: Session):
+def get_page_size(session: Session, addr: int) -> int:
+    """
+    @brief Get the program page size of the flash region containing an address.
+    @param session The pyOCD session object.
+    @param addr Address inside the region.
+    @return Page size in bytes.
+    """
+    region = session.target.memory_map.get_region_for_address(addr)
+    return getattr(region, "page_size", None) or DEFAULT_PAGE_SIZE
+
+def unlock_and_erase_device(session: Session, phases: Optional[Dict[str, float]] = None):
     """
     @brief Perform device recovery (mass erase) to unlock the device.
     @param session The pyOCD session object.
+    @param phases Optional dictionary receiving the "unlock" and "erase" durations.
     """
     logger.info("Performing mass erase to unlock and erase the device...")
     try:
         target = session.target
-        is_protected = detect_protection_status_nrf54l15(session) == PROTECTION_STATUS_PROTECTED
+        with timed_phase(phases, "unlock"):
+            is_protected = detect_protection_status_nrf54l15(session) == PROTECTION_STATUS_PROTECTED
         if is_protected:
             logger.info("Protected device detected - mass erase is required to unlock.")
         # For nRF54L series, mass_erase is a reliable erase even if not protected
-        target.mass_erase()
-        logger.info("Mass erase completed successfully.")
-        target.reset_and_halt() # Reset is required after erase
+        with timed_phase(phases, "erase"):
+            target.mass_erase()
+            logger.info("Mass erase completed successfully.")
+            target.reset_and_halt() # Reset is required after erase
         logger.info("Target halted after mass erase.")
     except Exception as e:
         logger.error(f"Mass erase failed: {e}")
         logger.info("This might be due to a hardware connection issue or severe lock state.")
         raise
 
-def program_device(session: Session, core_hexes: Dict[str, IntelHex]):
+def program_device(session: Session, core_hexes: Dict[str, List[Segment]], erased: bool = False):
     """
-    @brief Program the split HEX files to all cores.
+    @brief Program the split images of all cores straight from memory.
     @param session The pyOCD session object.
-    @param core_hexes Dictionary of IntelHex objects per core.
+    @param core_hexes Dictionary of segment lists per core.
+    @param erased True if the device was mass erased, so partial pages can be
+           padded with erased bytes instead of keeping their current contents.
+    """
+    for core_name, core_segments in core_hexes.items():
+        logger.info(f"Programming {core_name} core...")
+        loader = FlashLoader(session, progress=lambda p: logger.info(f"Programming progress: {p * 100:.1f}%"),
+                             smart_flash=True)
+        if erased:
+            blocks = []
+            for window_start, window_end in get_core_windows(NRF54L15_CORE_DEFINITIONS[core_name]):
+                window_segments = clip_segments(core_segments, [(window_start, window_end)])
+                if window_segments:
+                    blocks.extend(merge_segments(window_segments, get_page_size(session, window_start)))
+        else:
+            blocks = merge_segments(core_segments)
+        for start, data in blocks:
+            loader.add_data(start, data)
+        loader.commit()
+        logger.info(f"{core_name} core programming completed.")
+
+def verify_device(session: Session, core_hexes: Dict[str, List[Segment]]):
+    """
+    @brief Read back the programmed data and compare it with the image.
+    @param session The pyOCD session object.
+    @param core_hexes Dictionary of segment lists per core.
+    """
+    for core_name, core_segments in core_hexes.items():
+        for start, data in merge_segments(core_segments):
+            if bytes(session.target.read_memory_block8(start, len(data))) != data:
+                raise RecoveryError(
+                    f"{core_name} core verify failed in 0x{start:08X}-0x{start + len(data):08X}")
+        logger.info(f"{core_name} core verified.")
+
+def split_segments_by_page(segments: List[Segment], page_size: int) -> Dict[int, List[Segment]]:
+    """
+    @brief Cut data segments at page boundaries.
+    @param segments List of (start address, bytes).
+    @param page_size Page size in bytes.
+    @return Dictionary of page address -> segments inside that page.
+    """
+    pages = collections.defaultdict(list)
+    for start, data in segments:
+        offset = 0
+        while offset < len(data):
+            addr = start + offset
+            page = addr - addr % page_size
+            size = min(len(data) - offset, page + page_size - addr)
+            pages[page].append((addr, data[offset:offset + size]))
+            offset += size
+    return dict(pages)
+
+def hash_page(page_segments: List[Segment]) -> str:
+    """
+    @brief Hash the image data of one page (addresses included, gaps excluded).
+    """
+    h = hashlib.sha256()
+    for addr, data in merge_segments(page_segments):
+        h.update(addr.to_bytes(4, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+def get_manifest_path(manifest_dir: str, probe_id: str) -> str:
+    return os.path.join(manifest_dir, f"{probe_id}.json")
+
+def load_manifest(manifest_dir: str, probe_id: str) -> Dict[str, str]:
+    """
+    @brief Page hashes of the last successful flash through a probe.
+    @return Dictionary of page address (hex string) -> hash, empty if unknown.
     """
-    temp_files = []
     try:
-        for core_name, core_hex in core_hexes.items():
-            logger.info(f"Programming {core_name} core...")
-            temp_file = write_intelhex_to_temp(core_hex)
-            temp_files.append(temp_file)
+        with open(get_manifest_path(manifest_dir, probe_id)) as fp:
+            return json.load(fp).get("pages", {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+def save_manifest(manifest_dir: str, probe_id: str, pages: Dict[str, str]):
+    """
+    @brief Atomically replace the manifest of a probe, an empty one removes it.
+    """
+    path = get_manifest_path(manifest_dir, probe_id)
+    if not pages:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(manifest_dir, exist_ok=True)
+    with open(path + ".tmp", "w") as fp:
+        json.dump({"probe": probe_id, "pages": pages}, fp, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def get_image_pages(session: Session, core_hexes: Dict[str, List[Segment]]) -> Dict[str, list]:
+    """
+    @brief Cut the image of every core into flash pages.
+    @param session The pyOCD session object.
+    @param core_hexes Dictionary of segment lists per core.
+    @return Dictionary of core -> list of (page address, page size, segments in the page).
+    """
+    image_pages = {}
+    for core_name, core_segments in core_hexes.items():
+        pages = []
+        for window in get_core_windows(NRF54L15_CORE_DEFINITIONS[core_name]):
+            window_segments = clip_segments(core_segments, [window])
+            if window_segments:
+                page_size = get_page_size(session, window[0])
+                pages.extend((page, page_size, page_segments) for page, page_segments
+                             in sorted(split_segments_by_page(window_segments, page_size).items()))
+        image_pages[core_name] = pages
+    return image_pages
+
+def get_page_hashes(image_pages: Dict[str, list]) -> Dict[str, str]:
+    """
+    @brief Manifest entries for the pages of an image, see get_image_pages().
+    """
+    return {f"0x{page:08X}": hash_page(page_segments)
+            for pages in image_pages.values() for page, _, page_segments in pages}
 
-            fp = FileProgrammer(session, progress=lambda p: logger.info(f"Programming progress: {p * 100:.1f}%"))
-            fp.program(temp_file, smart_flash=True)
-            logger.info(f"{core_name} core programming completed.")
+def diff_pages(session: Session, image_pages: Dict[str, list], mode: str,
+               manifest: Dict[str, str]) -> Dict[str, List[Segment]]:
+    """
+    @brief Find the pages whose current contents differ from the image.
+    @param session The pyOCD session object.
+    @param image_pages Pages of the image per core, see get_image_pages().
+    @param mode "readback" compares with the flash contents, "manifest" with the
+           page hashes recorded by the last successful flash of this probe.
+    @param manifest Page hashes of the last successful flash (manifest mode).
+    @return Dictionary of the segments to program per core.
+    """
+    changed = {}
+    changed_pages = 0
+    total_pages = 0
+    for core_name, pages in image_pages.items():
+        current = []
+        if mode == "readback":
+            # Read whole blocks at once, much faster than one read per page
+            for start, data in merge_segments([seg for _, _, page_segments in pages for seg in page_segments]):
+                current.append((start, bytes(session.target.read_memory_block8(start, len(data)))))
+        core_changed = []
+        for page, page_size, page_segments in pages:
+            if mode == "readback":
+                known = hash_page(clip_segments(current, [(page, page + page_size)]))
+            else:
+                known = manifest.get(f"0x{page:08X}")
+            if known != hash_page(page_segments):
+                core_changed.extend(page_segments)
+                changed_pages += 1
+        total_pages += len(pages)
+        if core_changed:
+            changed[core_name] = core_changed
+    logger.info(f"{changed_pages} of {total_pages} page(s) differ ({mode}).")
+    return changed
+
+def open_session(probe_id: str) -> Session:
+    """
+    @brief Open a pyOCD session on the board attached to a probe.
+    @param probe_id Unique ID of the debug probe.
+    @return The opened session, to be closed by the caller.
+    """
+    session = ConnectHelper.session_with_chosen_probe(unique_id=probe_id, **SESSION_OPTIONS)
+    if session is None:
+        raise RecoveryError(f"Probe {probe_id} not found.")
+    session.open()
+    logger.info("Successfully connected to target.")
+    return session
+
+def recover_session(session: Session, segments: List[Segment], mass_erase: bool, verify: bool,
+                    phases: Optional[Dict[str, float]] = None, incremental: Optional[str] = None,
+                    manifest_dir: str = DEFAULT_MANIFEST_DIR):
+    """
+    @brief Unlock/erase, program, verify and restart the board of an open session.
+    @param session The pyOCD session object.
+    @param segments Data segments of the whole HEX file.
+    @param mass_erase Perform a mass erase before programming.
+    @param verify Read back and compare the programmed data.
+    @param phases Optional dictionary receiving the duration of every step.
+    @param incremental None to program the whole image, or one of INCREMENTAL_MODES
+           to program only the pages that differ.
+    @param manifest_dir Directory of the per-probe page hash manifests.
+    """
+    if incremental and incremental not in INCREMENTAL_MODES:
+        raise RecoveryError(f"Unknown incremental mode {incremental}.")
+    if mass_erase and incremental:
+        raise RecoveryError("Incremental programming cannot be combined with a mass erase.")
+    probe_id = session.probe.unique_id
+    manifest = load_manifest(manifest_dir, probe_id)
 
+    # Step 1: Unlock and erase (if specified by user)
+    if mass_erase:
+        save_manifest(manifest_dir, probe_id, {})
+        manifest = {}
+        unlock_and_erase_device(session, phases)
+
+    # Step 2: Prepare programming data
+    core_info = get_core_info(session)
+    if not any(info.get("accessible") for info in core_info.values()):
+        raise RecoveryError("No cores are accessible. Cannot proceed with programming.")
+
+    core_hexes = split_segments_by_core(segments, core_info)
+    if not core_hexes:
+        raise RecoveryError("No relevant data found in the HEX file for the accessible cores.")
+
+    image_pages = get_image_pages(session, core_hexes)
+    page_hashes = get_page_hashes(image_pages)
+    to_program = core_hexes
+    if incremental:
+        with timed_phase(phases, "diff"):
+            to_program = diff_pages(session, image_pages, incremental, manifest)
+    # Pages being rewritten are unknown until the flash succeeds
+    for key in page_hashes:
+        manifest.pop(key, None)
+    save_manifest(manifest_dir, probe_id, manifest)
+
+    # Step 3: Program device
+    with timed_phase(phases, "program"):
+        program_device(session, to_program, erased=mass_erase)
+    if verify:
+        with timed_phase(phases, "verify"):
+            verify_device(session, core_hexes)
+    manifest.update(page_hashes)
+    save_manifest(manifest_dir, probe_id, manifest)
+
+    # Step 4: Reset and run
+    logger.info("Resetting target to run application...")
+    with timed_phase(phases, "reset"):
+        session.target.reset()
+    logger.info("nRF54L15 programming completed successfully.")
+
+def recover_board(probe_id: str, segments: List[Segment], mass_erase: bool, verify: bool,
+                  phases: Optional[Dict[str, float]] = None, incremental: Optional[str] = None):
+    """
+    @brief Unlock/erase, program, verify and restart one board.
+    @param probe_id Unique ID of the debug probe attached to the board.
+    @param segments Data segments of the whole HEX file.
+    @param mass_erase Perform a mass erase before programming.
+    @param verify Read back and compare the programmed data.
+    @param phases Optional dictionary receiving the duration of every step.
+    @param incremental None or one of INCREMENTAL_MODES, see recover_session().
+    """
+    logger.info("Connecting to target...")
+    with timed_phase(phases, "connect"):
+        session = open_session(probe_id)
+    try:
+        recover_session(session, segments, mass_erase, verify, phases, incremental)
     finally:
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+        session.close()
+
+class FlashServer(socketserver.ThreadingTCPServer):
+    """
+    @brief Flash job server keeping pyOCD sessions and parsed images between jobs.
+    @details Clients send one JSON object per line:
+             {"hex": path, "probe": uid or null, "mass_erase": bool, "verify": bool,
+              "reconnect": bool, "incremental": null or one of INCREMENTAL_MODES}
+             and get one JSON object per line back:
+             {"ok": bool, "probe": uid, "error": str, "phases": {step: seconds}, "total": seconds}
+             Jobs for different probes run concurrently, jobs for the same probe in order.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int):
+        super().__init__(("127.0.0.1", port), FlashRequestHandler)
+        self.lock = threading.Lock()
+        self.probe_locks = collections.defaultdict(threading.Lock)
+        self.sessions = {}
+        self.images = {}
+
+    def load_image(self, hex_file: str) -> List[Segment]:
+        """
+        @brief Parse a HEX file, reusing the result while the file is unchanged.
+        """
+        st = os.stat(hex_file)
+        key = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            cached = self.images.get(hex_file)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        segments = load_hex_segments(hex_file)
+        with self.lock:
+            self.images[hex_file] = (key, segments)
+        return segments
+
+    def close_session(self, probe_id: str):
+        session = self.sessions.pop(probe_id, None)
+        if session is not None:
+            try:
+                session.close()
+            except Exception as e:
+                logger.debug(f"Closing session of {probe_id} failed: {e}")
+
+    def run_job(self, job: dict) -> dict:
+        """
+        @brief Run one flash job, see the class description for the format.
+        """
+        phases = {}
+        probe_id = job.get("probe")
+        started = time.perf_counter()
+        try:
+            with timed_phase(phases, "load"):
+                segments = self.load_image(job["hex"])
+            if not probe_id:
+                probes = DebugProbeAggregator.get_all_connected_probes()
+                if len(probes) != 1:
+                    raise RecoveryError(f"{len(probes)} probes connected, the job must name one.")
+                probe_id = probes[0].unique_id
+            with self.lock:
+                probe_lock = self.probe_locks[probe_id]
+            with probe_lock:
+                if job.get("reconnect"):
+                    self.close_session(probe_id)
+                session = self.sessions.get(probe_id)
+                if session is None:
+                    with timed_phase(phases, "connect"):
+                        session = open_session(probe_id)
+                    self.sessions[probe_id] = session
+                try:
+                    recover_session(session, segments, bool(job.get("mass_erase")),
+                                    bool(job.get("verify")), phases, job.get("incremental"))
+                except Exception:
+                    # Reconnect from scratch for the next job
+                    self.close_session(probe_id)
+                    raise
+        except Exception as e:
+            logger.error(f"Job for {probe_id or 'default probe'} failed: {e}")
+            return {"ok": False, "probe": probe_id, "error": str(e) or e.__class__.__name__,
+                    "phases": phases, "total": round(time.perf_counter() - started, 3)}
+        return {"ok": True, "probe": probe_id, "error": "",
+                "phases": phases, "total": round(time.perf_counter() - started, 3)}
+
+    def server_close(self):
+        for probe_id in list(self.sessions):
+            self.close_session(probe_id)
+        super().server_close()
+
+class FlashRequestHandler(socketserver.StreamRequestHandler):
+    """
+    @brief Reads JSON line jobs from one client connection.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict) or "hex" not in job:
+                    raise ValueError("a job needs at least a \"hex\" path")
+            except ValueError as e:
+                reply = {"ok": False, "probe": None, "error": f"Invalid job: {e}", "phases": {}, "total": 0}
+            else:
+                reply = self.server.run_job(job)
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+def serve(port: int):
+    """
+    @brief Run the flash server until interrupted.
+    @param port Local TCP port to listen on.
+    """
+    with FlashServer(port) as server:
+        logger.info(f"Flash server listening on 127.0.0.1:{port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Flash server stopped.")
+
+## @brief Per worker process state of the gang mode, see init_gang_worker()
+_gang = {}
+
+def init_gang_worker(segments: List[Segment], mass_erase: bool, verify: bool,
+                     incremental: Optional[str] = None):
+    """
+    @brief Pool initializer: receive the already parsed image once per worker.
+    """
+    _gang.update(segments=segments, mass_erase=mass_erase, verify=verify, incremental=incremental)
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] [%(processName)s] %(message)s"))
+
+def gang_recover_board(probe_id: str) -> Tuple[str, bool, float, str]:
+    """
+    @brief Gang mode task: recover the board attached to one probe.
+    @return (probe ID, success, elapsed seconds, error message).
+    """
+    multiprocessing.current_process().name = probe_id
+    started = time.time()
+    try:
+        recover_board(probe_id, _gang["segments"], _gang["mass_erase"], _gang["verify"],
+                      incremental=_gang["incremental"])
+    except Exception as e:
+        logger.error(f"Recovery failed: {e}")
+        return probe_id, False, time.time() - started, str(e) or e.__class__.__name__
+    return probe_id, True, time.time() - started, ""
+
+def gang_recover(probe_ids: List[str], segments: List[Segment], mass_erase: bool, verify: bool,
+                 jobs: Optional[int] = None, incremental: Optional[str] = None) -> bool:
+    """
+    @brief Recover all boards concurrently, one worker process per probe.
+    @return True if every board succeeded.
+    """
+    logger.info(f"Gang programming {len(probe_ids)} board(s)...")
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs or len(probe_ids),
+        initializer=init_gang_worker,
+        initargs=(segments, mass_erase, verify, incremental),
+    ) as pool:
+        for probe_id, ok, elapsed, error in pool.map(gang_recover_board, probe_ids):
+            results[probe_id] = (ok, elapsed, error)
+
+    width = max(len("Probe"), *(len(probe_id) for probe_id in probe_ids))
+    print(f"\n{'Probe':<{width}}  Result  Time(s)  Details")
+    for probe_id in probe_ids:
+        ok, elapsed, error = results[probe_id]
+        print(f"{probe_id:<{width}}  {'OK' if ok else 'FAILED':<6}  {elapsed:7.1f}  {error}")
+    failed = sum(1 for ok, _, _ in results.values() if not ok)
+    print(f"\n{len(probe_ids) - failed} passed, {failed} failed")
+    return failed == 0
 
 def main():
     parser = argparse.ArgumentParser(
@@ -191,7 +748,6 @@ def main():
     )
     parser.add_argument(
         "--hex",
-        required=True,
         help="Path to the HEX file to be programmed.",
     )
     parser.add_argument(
@@ -203,8 +759,81 @@ def main():
         "--probe", 
         help="Specify the unique ID of the debug probe to use."
     )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Read back and compare the programmed data (always done in gang mode).",
+    )
+    parser.add_argument(
+        "--incremental",
+        choices=INCREMENTAL_MODES,
+        help="Program only the pages that differ from the image, compared with a read-back of "
+             "the flash or with the manifest of the last successful flash through this probe "
+             "(manifest mode assumes nothing else wrote the flash, e.g. no board swap).",
+    )
+    parser.add_argument(
+        "--gang",
+        action="store_true",
+        help="Program the boards of all connected probes (or of --probes) concurrently.",
+    )
+    parser.add_argument(
+        "--probes",
+        help="Comma separated unique IDs of the probes to use in gang mode.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Maximum number of boards programmed at once in gang mode (default: all).",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep sessions open and accept flash jobs on a local socket "
+             "(see xiao_nrf54l15_flash_client.py).",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_SERVER_PORT,
+        help=f"Local TCP port of the flash server (default: {DEFAULT_SERVER_PORT}).",
+    )
+    parser.add_argument(
+        "--benchmark-split",
+        action="store_true",
+        help="Benchmark splitting a synthetic full-flash image and exit (no probe needed).",
+    )
     args = parser.parse_args()
 
+    if args.benchmark_split:
+        benchmark_split()
+        return
+    if args.serve:
+        serve(args.port)
+        return
+    if not args.hex:
+        parser.error("the following arguments are required: --hex")
+    if args.mass_erase and args.incremental:
+        parser.error("--incremental cannot be combined with --mass-erase")
+
+    # The image is parsed once, every board only splits it by its accessible cores
+    segments = load_hex_segments(args.hex)
+
+    if args.gang or args.probes:
+        if args.probes:
+            probe_ids = [p.strip() for p in args.probes.split(",") if p.strip()]
+        else:
+            probe_ids = [p.unique_id for p in DebugProbeAggregator.get_all_connected_probes()]
+        if not probe_ids:
+            logger.error("No connected debug probes found.")
+            sys.exit(1)
+        try:
+            ok = gang_recover(probe_ids, segments, args.mass_erase, True, args.jobs,
+                              args.incremental)
+        except KeyboardInterrupt:
+            logger.warning("Operation cancelled by user.")
+            sys.exit(2)
+        sys.exit(0 if ok else 1)
+
     # Find or select debug probe
     if args.probe:
         probe_id = args.probe
@@ -215,7 +844,7 @@ def main():
             logger.error("No connected debug probes found.")
             sys.exit(1)
         elif len(probes) > 1:
-            logger.error("Multiple probes connected. Please specify one with --probe <unique_id>:")
+            logger.error("Multiple probes connected. Please specify one with --probe <unique_id> or use --gang:")
             for p in probes:
                 logger.error(f"  - {p.unique_id} : {p.description}")
             sys.exit(1)
@@ -223,45 +852,16 @@ def main():
             probe_id = probes[0].unique_id
             logger.info(f"Auto-selected probe: {probe_id} ({probes[0].description})")
 
-    session_options = {
-        'target_override': 'nrf54l',
-    'connect_mode': 'under-reset' # This mode is usually required for protected devices
-    }
-    session = None
-
     try:
-        logger.info("Connecting to target...")
-        with ConnectHelper.session_with_chosen_probe(unique_id=probe_id, **session_options) as session:
-            logger.info("Successfully connected to target.")
-            
-            # Step 1: Unlock and erase (if specified by user)
-            if args.mass_erase:
-                unlock_and_erase_device(session)
-
-            # Step 2: Prepare programming data
-            core_info = get_core_info(session)
-            if not any(info.get("accessible") for info in core_info.values()):
-                logger.error("No cores are accessible. Cannot proceed with programming.")
-                sys.exit(1)
-                
-            core_hexes = split_hex_by_core(args.hex, core_info)
-            if not core_hexes:
-                logger.error("No relevant data found in the HEX file for the accessible cores.")
-                sys.exit(1)
-
-            # Step 3: Program device
-            program_device(session, core_hexes)
-            
-            # Step 4: Reset and run
-            logger.info("Resetting target to run application...")
-            session.target.reset()
-            logger.info("nRF54L15 programming completed successfully.")
-
+        recover_board(probe_id, segments, args.mass_erase, args.verify, incremental=args.incremental)
     except KeyboardInterrupt:
         logger.warning("Operation cancelled by user.")
+    except RecoveryError as e:
+        logger.error(str(e))
+        sys.exit(1)
     except Exception as e:
         logger.error(f"An error occurred: {e}", exc_info=True)
         sys.exit(2)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
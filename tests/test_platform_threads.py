@@ -0,0 +1,121 @@
+"""
+Configures envs of different architectures concurrently and checks that every
+env gets the packages and debug session of its own board. The platform module
+is loaded once and every env gets its own instance, as in a long-lived process
+serving several envs, so state kept at module level would leak between them.
+
+Run with `pytest tests` from the repository root; `python -m pytest` would put
+the root on sys.path, where platform.py shadows the standard library module.
+"""
+
+import os
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("platformio")
+
+from platformio.platform.factory import PlatformFactory  # noqa: E402
+
+PLATFORM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# board -> (packages only this env may require, debug server package,
+#           adapter speed its debug hook adds without debug_speed)
+BOARDS = {
+    "seeed-xiao-esp32-s3-sense": (
+        {"toolchain-xtensa-esp-elf", "tool-esptoolpy"},
+        "tool-openocd-esp32",
+        "5000",
+    ),
+    "seeed-xiao-esp32-c6": (
+        {"toolchain-riscv32-esp", "tool-esptoolpy"},
+        "tool-openocd-esp32",
+        "5000",
+    ),
+    "seeed-xiao-mbed-nrf52840": (
+        {"framework-arduino-mbed", "toolchain-gccarmnoneeabi"},
+        "tool-openocd",
+        None,
+    ),
+    "seeed-xiao-rp2040": (
+        {"toolchain-rp2040-earlephilhower", "tool-picotool-rp2040-earlephilhower"},
+        "tool-openocd-rp2040-earlephilhower",
+        "1000",
+    ),
+}
+ROUNDS = 4
+
+
+@pytest.fixture(scope="module")
+def platform_class():
+    return type(PlatformFactory.new(PLATFORM_DIR))
+
+
+def configure_env(platform_class, board, flash_image, barrier=None):
+    platform = platform_class(os.path.join(PLATFORM_DIR, "platform.json"))
+    platform.configure_default_packages(
+        {"board": board, "framework": ["arduino"], "pioframework": ["arduino"]},
+        ["upload", "__debug"],
+    )
+    required = {name for name, opts in platform.packages.items() if not opts.get("optional")}
+
+    board_config = platform.board_config(board)
+    tool = board_config.get("debug.tools")["cmsis-dap"]
+    server = dict(tool["server"])
+    server["arguments"] = list(server["arguments"])
+    if barrier is not None:
+        # every env is configured before any debug session starts, which
+        # is when state shared between envs would show
+        barrier.wait()
+    debug_config = types.SimpleNamespace(
+        board_config=board_config,
+        env_options={},
+        speed=None,
+        server=server,
+        load_cmds=["load"],
+        build_data={
+            "prog_path": flash_image[:-4] + ".elf",
+            "extra": {"flash_images": [{"path": flash_image, "offset": "0x0"}]},
+        },
+    )
+    platform.configure_debug_session(debug_config)
+    return required, debug_config
+
+
+def test_envs_configured_on_threads(platform_class, tmp_path, capsys):
+    flash_image = str(tmp_path / "bootloader.bin")
+    with open(flash_image, "wb") as fp:
+        fp.write(b"\0")
+
+    boards = list(BOARDS) * ROUNDS
+    barrier = threading.Barrier(len(boards), timeout=60)
+    with ThreadPoolExecutor(max_workers=len(boards)) as pool:
+        results = list(
+            pool.map(
+                lambda board: configure_env(platform_class, board, flash_image, barrier),
+                boards,
+            )
+        )
+    capsys.readouterr()
+
+    serial = {
+        board: configure_env(platform_class, board, flash_image)[0] for board in BOARDS
+    }
+    for board, (required, debug_config) in zip(boards, results):
+        own_packages, server_package, adapter_speed = BOARDS[board]
+        assert required == serial[board], board
+        assert own_packages <= required, board
+        for other, (other_packages, _, _) in BOARDS.items():
+            if BOARDS[other][1] != server_package:
+                assert not (other_packages - own_packages) & required, (board, other)
+
+        assert debug_config.server["package"] == server_package
+        speeds = [
+            arg for arg in debug_config.server["arguments"] if arg.startswith("adapter speed")
+        ]
+        assert speeds == (["adapter speed %s" % adapter_speed] if adapter_speed else []), board
+        # only the ESP hook turns "load" into program_esp commands
+        is_esp = server_package == "tool-openocd-esp32"
+        assert (debug_config.load_cmds != ["load"]) == is_esp, board
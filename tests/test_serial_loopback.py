@@ -0,0 +1,61 @@
+"""
+Runs the pty scenarios of scripts/serial_loopback_bench.py and fails when a
+serial consumer no longer keeps up with its device or starts losing data.
+
+The limits are far below what a development machine reaches, so that a slow
+CI runner passes and only a real regression fails. The exception decoder
+scenario needs a firmware ELF and is left to the script.
+"""
+
+import argparse
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("pty")
+pytest.importorskip("serial")
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+)
+import serial_loopback_bench  # noqa: E402
+
+# traffic -> (bytes per second the device sends, units)
+SCENARIOS = {
+    "audio": (32000, "audio bytes"),  # 16 kHz, 16 bit mono
+    "audio-framed": (32000, "frames"),
+    "nmea": (960, "sentences"),  # 9600 baud GPS receiver
+}
+MAX_LOSS = 0.01
+AUDIO_SECONDS = 3
+NMEA_COUNT = 2000
+
+
+def run_scenario(traffic):
+    args = argparse.Namespace(
+        traffic=traffic,
+        replay=None,
+        rate=0,
+        seconds=AUDIO_SECONDS,
+        count=NMEA_COUNT,
+        elf=None,
+        addr2line=None,
+    )
+    return serial_loopback_bench.run_benchmark(args)
+
+
+@pytest.mark.parametrize("traffic", sorted(SCENARIOS))
+def test_consumer_keeps_up(traffic):
+    device_rate, units = SCENARIOS[traffic]
+    result = run_scenario(traffic)
+
+    assert not result.get("error"), result
+    assert result["consumed_bytes"] == result["sent_bytes"], result
+    # twice the device rate leaves room for a loaded runner
+    assert result["bytes_per_second"] >= 2 * device_rate, result
+    assert result["loss"] <= MAX_LOSS, "%s of %s %s lost" % (
+        result["expected"] - result.get("received", 0),
+        result["expected"],
+        units,
+    )